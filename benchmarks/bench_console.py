@@ -0,0 +1,145 @@
+""" Console hot paths: UBootClient.read_response on large outputs, SerialOverTelnet.read and per-command
+latency of UBootClient and AsyncUBootClient (U-Boot doesn't terminate its prompt with newline,
+the blocking client notices it only by read timeout)
+"""
+import asyncio
+import os
+import pty
+import socket
+import threading
+import tty
+from hiburn.async_u_boot_client import AsyncUBootClient
+from hiburn.serial_over_telnet import SerialOverTelnet
+from hiburn.u_boot_client import UBootClient
+from suite import rate, select_all, throughput
+
+
+PROMPT = b"hisilicon # "
+
+
+class ScriptedSerial:
+    """ Serial port which returns prepared lines, the prompt is the last one
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self.pos = 0
+        self.timeout = None
+
+    def rewind(self):
+        self.pos = 0
+
+    def readline(self):
+        if self.pos == len(self.lines):
+            return b""
+        self.pos += 1
+        return self.lines[self.pos - 1]
+
+
+def md_lines(count):
+    return [b"%08x: 56190527 a1b2c3d4 00000000 ffffffff    '..V............\r\n" % (0x80000000 + 16 * i)
+        for i in range(count)]
+
+
+def read_response(client, serial):
+    serial.rewind()
+    client.read_response()
+
+
+class Sender:
+    """ Local TCP server which sends `data` to every connection
+    """
+    def __init__(self, data):
+        self.data = data
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(4)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            with conn:
+                try:
+                    conn.sendall(self.data)
+                except OSError:
+                    pass  # reader has got enough and closed connection
+
+
+def read_telnet(port, size, chunk_size):
+    conn = SerialOverTelnet("127.0.0.1", port)
+    conn.timeout = 5
+    received = 0
+    while received < size:
+        received += len(conn.read(chunk_size))
+    conn.close()
+
+
+def fake_console(fd):
+    """ Echo commands and answer `crc32` like U-Boot does
+    """
+    buf = b""
+    while True:
+        try:
+            data = os.read(fd, 1024)
+        except OSError:
+            return
+        if not data:
+            return
+        buf += data
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            os.write(fd, line + b"\r\ncrc32 for 80000000 ... 800000ff ==> 1234abcd\r\n" + PROMPT)
+
+
+def open_console():
+    """ Pty with fake U-Boot console on its master side, returns slave's path
+    """
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    threading.Thread(target=fake_console, args=(master,), daemon=True).start()
+    return os.ttyname(slave)
+
+
+def run_commands(client, count):
+    for _ in range(count):
+        client.crc32(0x80000000, 0x100)
+
+
+async def run_async_commands(client, count):
+    for _ in range(count):
+        await client.crc32(0x80000000, 0x100)
+
+
+def command_rates(count, selected):
+    if selected("u_boot_client.commands"):
+        client = UBootClient.create_with_serial(port=open_console(), baudrate=115200)
+        yield rate("u_boot_client.commands", count, "commands/s", lambda: run_commands(client, count), repeat=1)
+        client.s.close()
+
+    if selected("async_u_boot_client.commands"):
+        loop = asyncio.new_event_loop()
+        client = loop.run_until_complete(AsyncUBootClient.create_with_serial(port=open_console(), baudrate=115200))
+        yield rate("async_u_boot_client.commands", count, "commands/s",
+            lambda: loop.run_until_complete(run_async_commands(client, count)))
+        client.close()
+        loop.close()
+
+
+def run(quick=False, selected=select_all):
+    count = 20000 if quick else 100000
+    if selected("u_boot_client.read_response.md_lines"):
+        serial = ScriptedSerial(md_lines(count) + [PROMPT])
+        client = UBootClient(serial)
+        yield rate("u_boot_client.read_response.md_lines", count, "lines/s", lambda: read_response(client, serial))
+
+    names = ["serial_over_telnet.read.{}".format(chunk_size) for chunk_size in (1, 1024, 64 << 10)]
+    if any(selected(name) for name in names):
+        data = os.urandom((4 if quick else 32) << 20).replace(b"\xff", b"\xfe")
+        sender = Sender(data)
+        for name, chunk_size in zip(names, (1, 1024, 64 << 10)):
+            if selected(name):
+                size = len(data) if chunk_size > 1 else len(data) // 64
+                yield throughput(name, size, lambda: read_telnet(sender.port, size, chunk_size))
+
+    yield from command_rates(3 if quick else 10, selected)
@@ -0,0 +1,68 @@
+""" TFTP upload/download throughput through utils.upload_files_via_tftp/download_files_via_tftp on loopback
+"""
+import io
+import os
+import socket
+import tempfile
+from hiburn import fleet
+from hiburn import tftp
+from hiburn import utils
+from suite import select_all, throughput
+
+
+class FakeUBoot:
+    """ Runs `tftp` commands by a TFTP client against the host like U-Boot does, RAM is a dict addr -> bytes
+    """
+    def __init__(self, port, options):
+        self.port = port
+        self.options = options
+        self.ram = {}
+
+    def tftp(self, addr, file_name, size=None):
+        client = tftp.TftpClient("127.0.0.1", self.port, options=self.options, dally=False)
+        if size is None:
+            out = io.BytesIO()
+            client.download(file_name, out)
+            self.ram[addr] = out.getvalue()
+        else:
+            client.upload(file_name, io.BytesIO(self.ram[addr][:size]))
+        return []
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run(quick=False, selected=select_all):
+    """ The server is shared by all runs of a configuration like in fleets, so the final ACK lingering
+    of finished downloads (see tftp.Transfer.linger) overlaps with next runs instead of being measured.
+    Block and window sizes help to pick `net.tftp_block_size` and `net.tftp_window_size` values
+    """
+    configs = [(block_size, window_size, "tftp.{{}}.blksize_{}.window_{}".format(block_size, window_size))
+        for block_size, window_size in ((512, 1), (1468, 1), (1468, 8), (8192, 16))]
+    if not any(selected(name.format(d)) for _, _, name in configs for d in ("upload", "download")):
+        return
+
+    data = os.urandom((2 if quick else 16) << 20)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dump = os.path.join(tmpdir, "dump.bin")
+        for block_size, window_size, name in configs:
+            upload, download = selected(name.format("upload")), selected(name.format("download"))
+            if not upload and not download:
+                continue
+            port = free_udp_port()
+            uboot = FakeUBoot(port, {"blksize": block_size, "windowsize": window_size})
+
+            with fleet.SharedTftp("127.0.0.1", port) as shared:
+                context = fleet.BoardTftp(shared, "127.0.0.1")
+                if upload:
+                    yield throughput(name.format("upload"), len(data), lambda: utils.upload_files_via_tftp(
+                        uboot, ((data, 0x80000000),), listen_ip="127.0.0.1", tftp=context), repeat=2)
+                else:
+                    uboot.ram[0x80000000] = data  # what is downloaded
+                if download:
+                    yield throughput(name.format("download"), len(data), lambda: utils.download_files_via_tftp(
+                        uboot, ((dump, 0x80000000, len(data)),), listen_ip="127.0.0.1", verify=False, tftp=context),
+                        repeat=2)
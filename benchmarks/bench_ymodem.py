@@ -0,0 +1,49 @@
+""" YMODEM frame building (payload copy and CRC) and transmission against fake receivers
+"""
+import os
+import time
+from hiburn.ymodem import YModem
+from suite import select_all, throughput
+
+
+class FakeReceiver:
+    """ Receiver which ACKs every frame `latency` seconds after it is written
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.answers = bytearray(YModem.C)
+
+    def write(self, data):
+        self.answers += YModem.ACK
+        return len(data)
+
+    def read(self, size=1):
+        if self.latency:
+            time.sleep(self.latency)
+        data = bytes(self.answers[:size])
+        del self.answers[:size]
+        return data
+
+
+def build_frames(data, long, crc16):
+    for _ in YModem(None)._frames(data, long=long, crc16=crc16):
+        pass
+
+
+def run(quick=False, selected=select_all):
+    frames = [("ymodem.frames.128B.crc16", False, True), ("ymodem.frames.1K.crc16", True, True),
+        ("ymodem.frames.128B.checksum", False, False)]
+    transmits = [("ymodem.transmit.1K.latency_{}us".format(int(latency * 1e6)), latency) for latency in (0.0, 0.0005)]
+    if not any(selected(name) for name, *_ in frames + transmits):
+        return
+
+    data = os.urandom((1 if quick else 8) << 20)
+    for name, long, crc16 in frames:
+        if selected(name):
+            yield throughput(name, len(data), lambda: build_frames(data, long, crc16))
+
+    for name, latency in transmits:
+        if selected(name):
+            size = len(data) if not latency else (256 if quick else 1024) << 10
+            yield throughput(name, size,
+                lambda: YModem(FakeReceiver(latency)).transmit(memoryview(data)[:size], long=True), repeat=1)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+""" Runs benchmarks of transfer and protocol hot paths and compares results against a stored baseline
+Exits with 1 if any benchmark is slower than the baseline by more than the tolerance,
+with 2 if the baseline is recorded in another mode (`--quick` or not).
+Baselines are machine-specific: regenerate one with `--update-baseline` on the machine which runs comparisons
+"""
+import argparse
+import importlib
+import logging
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, ".."))
+sys.path.insert(0, BENCHMARKS_DIR)
+import suite
+
+
+MODULES = ("bench_ymodem", "bench_tftp", "bench_console")
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+
+
+# -------------------------------------------------------------------------------------------------
+def run_all(quick=False, name_filter=None):
+    """ Run benchmarks which names contain `name_filter`, modules skip cases (and their setup) not asked for
+    """
+    selected = suite.select_all if not name_filter else lambda name: name_filter in name
+    results = []
+    for module_name in MODULES:
+        module = importlib.import_module(module_name)
+        for result in module.run(quick=quick, selected=selected):
+            print("{:<40} {:>12.2f}  {}".format(result.name, result.value, result.unit), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="Smaller data sizes, for a smoke run")
+    parser.add_argument("--filter", type=str, help="Keep only benchmarks which names contain the substring")
+    parser.add_argument("--json", type=str, help="Save results to the JSON file")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="Baseline JSON file to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="Save results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=suite.DEFAULT_TOLERANCE,
+        help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    baseline = {}
+    if not args.update_baseline and os.path.exists(args.baseline):
+        mode, baseline = suite.load(args.baseline)
+        if mode != ("quick" if args.quick else "full"):
+            print("Baseline '{}' is recorded in {} mode, results of another mode aren't comparable: "
+                "{} --quick or record a baseline of this mode with --update-baseline".format(
+                args.baseline, mode, "add" if mode == "quick" else "drop"), file=sys.stderr)
+            sys.exit(2)
+
+    results = run_all(quick=args.quick, name_filter=args.filter)
+    if args.json:
+        suite.save(results, args.json, quick=args.quick)
+    if args.update_baseline:
+        suite.save(results, args.baseline, quick=args.quick)
+        return
+
+    rows = suite.compare(results, baseline, tolerance=args.tolerance)
+    suite.format_table(rows)
+    if any(regression for _, _, _, regression in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+""" Tiny benchmark framework: timing helpers, JSON results and comparison against a baseline
+"""
+import json
+import platform
+import sys
+import time
+
+
+DEFAULT_TOLERANCE = 0.25  # relative slowdown which is reported as a regression
+
+
+def select_all(name):
+    return True
+
+
+# -------------------------------------------------------------------------------------------------
+class Result:
+    def __init__(self, name, value, unit, higher_is_better=True):
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+
+    def as_dict(self):
+        return {"value": self.value, "unit": self.unit, "higher_is_better": self.higher_is_better}
+
+
+def best_time(func, repeat=3):
+    """ The fastest of `repeat` runs of `func()`, seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def throughput(name, size, func, repeat=3):
+    """ Result in MB/s for `func()` processing `size` bytes
+    """
+    return Result(name, size / best_time(func, repeat) / (1 << 20), "MB/s")
+
+
+def rate(name, count, unit, func, repeat=3):
+    """ Result in `unit` (like "lines/s") for `func()` processing `count` items
+    """
+    return Result(name, count / best_time(func, repeat), unit)
+
+
+# -------------------------------------------------------------------------------------------------
+def save(results, path, quick=False):
+    doc = {
+        "mode": "quick" if quick else "full",  # sizes differ, so results of different modes aren't comparable
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "results": {r.name: r.as_dict() for r in results},
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path):
+    """ Returns (mode, results) of a saved run
+    """
+    with open(path, "r") as f:
+        doc = json.load(f)
+    return doc.get("mode", "full"), doc["results"]
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Returns [(result, baseline value or None, relative change or None, is regression)]
+    Relative change is positive when the result is better than the baseline
+    """
+    rows = []
+    for r in results:
+        base = baseline.get(r.name)
+        if base is None or not base["value"]:
+            rows.append((r, None, None, False))
+            continue
+        change = r.value / base["value"] - 1
+        if not r.higher_is_better:
+            change = base["value"] / r.value - 1 if r.value else float("inf")
+        rows.append((r, base["value"], change, change < -tolerance))
+    return rows
+
+
+def format_table(rows, out=sys.stdout):
+    print("{:<40} {:>12} {:>12} {:>8}  {}".format("benchmark", "value", "baseline", "change", "unit"), file=out)
+    for r, base, change, regression in rows:
+        print("{:<40} {:>12.2f} {:>12} {:>8}  {}{}".format(
+            r.name, r.value, "-" if base is None else "{:.2f}".format(base),
+            "-" if change is None else "{:+.0%}".format(change), r.unit, "  REGRESSION" if regression else ""),
+            file=out)
@@ -1,19 +1,35 @@
+import contextlib
 import logging
 import ipaddress
 import os
+import tempfile
+import time
 from . import utils
 from . import ymodem
+from . import chunked_dump
+from . import compression
+from . import delta
+from . import layout
+from . import md_dump
+from . import timings
+from . import uimage
+from .u_boot_client import parse_sf_erase_size
 
 
 # -------------------------------------------------------------------------------------------------
 class Action:
+    needs_client = True  # whether the action works with device's U-Boot console
+
     @classmethod
     def _run(cls, client, config, args):
-        return cls(client, config).run(args)
+        action = cls(client, config)
+        with action.span(cls.__name__, "action"):
+            return action.run(args)
 
     def __init__(self, client, config):
         self.client = client
         self.config = config
+        self.tftp = None  # shared TFTP context (see `utils.open_tftp_context`), own one is opened if None
 
     @classmethod
     def add_arguments(cls, parser):
@@ -23,6 +39,11 @@ class Action:
         raise NotImplementedError()
 
     # some helper methods are below
+    def span(self, name, kind="phase", size=None):
+        """ Span of client's tracer (if any), see `timings.Tracer.span`
+        """
+        return timings.span(getattr(self.client, "tracer", None), name, kind, size=size)
+
     @property
     def host_ip(self):
         return ipaddress.ip_interface(self.config["net"]["host_ip_mask"]).ip
@@ -38,20 +59,291 @@ class Action:
     def configure_network(self):
         """ Common method to configure network on target device
         """
+        with self.span("configure network"):
+            self._configure_network()
+
+    def _configure_network(self):
+        # U-Boot requests these in TFTP options (RFC 2348/7440), ones without the support ignore them
+        tftp_env = {
+            "tftpblocksize": self.config["net"].get("tftp_block_size"),
+            "tftpwindowsize": self.config["net"].get("tftp_window_size"),
+        }
         self.client.setenv(
             ipaddr=self.device_ip,
             serverip=self.host_ip,
-            netmask=self.host_netmask
+            netmask=self.host_netmask,
+            **{k: v for k, v in tftp_env.items() if v}
         )
-    
-    def upload_files(self, *args):
-        utils.upload_files_via_tftp(self.client, args, listen_ip=str(self.host_ip))
 
-    def upload_y_files(self, *args):
+    def upload_files(self, *args, skip_present=False, verify=False):
+        if skip_present:  # the span counts data actually sent
+            args = utils.skip_present_files(self.client, args)
+        if not args:
+            return
+        with self.span("tftp upload", "transfer", size=sum(utils.data_size(src) for src, _ in args)):
+            utils.upload_files_via_tftp(self.client, args, listen_ip=str(self.host_ip), verify=verify, tftp=self.tftp)
+
+    def upload_y_files(self, *args, streaming=False, baudrate=None):
         for fname, addr in args:
-            with open(fname, "rb") as f:
-                data = f.read()
-            self.client.loady(addr, data)
+            with self.span("ymodem upload", "transfer", size=utils.data_size(fname)):
+                self.client.loady(addr, fname, streaming=streaming, baudrate=baudrate)
+
+    def upload_k_files(self, *args, packet_size=1000, window=1):
+        for fname, addr in args:
+            with self.span("kermit upload", "transfer", size=utils.data_size(fname)):
+                self.client.loadb(addr, fname, packet_size=packet_size, window=window)
+
+    @classmethod
+    def add_upload_arguments(cls, parser):
+        """ Arguments to choose uploading protocol, see `upload_files_by_args`
+        """
+        protocol_group = parser.add_mutually_exclusive_group()
+        protocol_group.add_argument("--ymodem", action="store_true",
+            help="Upload via serial (ymodem protocol)")
+        protocol_group.add_argument("--ymodem-g", action="store_true",
+            help="Upload via serial using streaming YMODEM-G if device supports it (implies --ymodem)")
+        protocol_group.add_argument("--kermit", action="store_true",
+            help="Upload via serial (kermit protocol)")
+        parser.add_argument("--ymodem-baudrate", type=int,
+            help="Baudrate to switch to for uploading via serial (lower ones are tried if transfer fails)")
+        parser.add_argument("--kermit-packet-size", type=int, default=1000,
+            help="Kermit long packet size")
+        parser.add_argument("--kermit-window", type=int, default=1,
+            help="Kermit sliding window size, U-Boot's receiver doesn't support windows (only other ones do)")
+        parser.add_argument("--compress", nargs="?", const="gzip", choices=("gzip", "lzma"),
+            help="Upload compressed images into scratch RAM and decompress them on device "
+                 "(gzip by default, skipped if it doesn't pay off)")
+        parser.add_argument("--force-upload", action="store_true",
+            help="Upload images even if they are already in device's RAM (by CRC32)")
+        parser.add_argument("--no-verify", action="store_true",
+            help="Don't check CRC32 of uploaded images")
+        parser.add_argument("--delta", action="store_true",
+            help="Upload only blocks which differ from device's RAM contents")
+        parser.add_argument("--delta-block-size", type=utils.hsize2int, default=delta.DEFAULT_BLOCK_SIZE,
+            help="Block size for --delta")
+        parser.add_argument("--delta-max-changed", type=float, default=0.5,
+            help="Fraction of changed blocks above which whole image is uploaded in --delta mode")
+
+    @staticmethod
+    def is_serial_upload(args):
+        return args.kermit or args.ymodem or args.ymodem_g
+
+    def upload_rate(self, args):
+        """ Estimated throughput (bytes per second) of uploading protocol chosen by `args`
+        """
+        if self.is_serial_upload(args):
+            baudrate = getattr(self.client.s, "baudrate", 115200)
+            if args.ymodem_baudrate and not args.kermit:
+                baudrate = args.ymodem_baudrate
+            return baudrate / 10  # 8N1
+        return compression.TFTP_RATE
+
+    def mem_range(self):
+        """ Device's RAM region available for uploading, (start, end) tuple
+        """
+        start = self.config["mem"]["start_addr"]
+        return start, start + self.config["mem"]["linux_size"]
+
+    def new_layout(self, files=()):
+        """ Layout of device's RAM (see `layout.Layout`) with U-Boot's region at the top of Linux RAM
+        and `files` (file, addr) at their destinations
+        """
+        ram = layout.Layout(*self.mem_range(), self.config["mem"]["alignment"])
+        uboot_size = self.config["mem"].get("uboot_size", 0)
+        if uboot_size:
+            ram.add("U-Boot", ram.end - uboot_size, uboot_size, kind="reserved")
+        for fname, addr in files:
+            ram.add(utils.describe_data(fname), addr, utils.data_size(fname))
+        return ram
+
+    def compress_files(self, files, method, link_rate, tmpdir, ram):
+        """ Compress files which are worth it into `tmpdir`
+        Returns files to be uploaded and (method, scratch address, address, size) decompression jobs.
+        Scratch regions are placed into free space of `ram` layout
+        """
+        if method == "lzma" and not self.client.has_command(compression.U_BOOT_COMMANDS["lzma"]):
+            logging.info("U-Boot doesn't support 'lzmadec', use gzip instead")
+            method = "gzip"
+
+        uploads, unpacks = [], []
+        for num, (fname, addr) in enumerate(files):
+            orig_size = os.path.getsize(fname)
+            packed = os.path.join(tmpdir, "{}.{}".format(num, method))
+            packed_size = compression.compress_file(fname, packed, method)
+            if not compression.is_worth_compressing(orig_size, packed_size, link_rate, method):
+                logging.info("Compression of '{}' doesn't pay off, upload it as is".format(fname))
+                uploads.append((fname, addr))
+                continue
+
+            scratch_addr = ram.place("{} packed".format(utils.describe_data(fname)), packed_size,
+                kind="scratch").addr
+            logging.info("'{}' is compressed by {} ({} -> {} bytes), scratch address {:#x}".format(
+                fname, method, orig_size, packed_size, scratch_addr))
+            uploads.append((packed, scratch_addr))
+            unpacks.append((method, scratch_addr, addr, orig_size))
+        return uploads, unpacks
+
+    def upload_files_by_args(self, args, *files, ram=None):
+        """ Upload files via TFTP or via serial by protocol chosen with `add_upload_arguments`
+        Files which are already in device's RAM are skipped, uploaded ones are verified by CRC32.
+        Scratch and staging areas are placed into free space of `ram` layout which has the files already
+        (a layout of Linux RAM with just the files by default)
+        """
+        if ram is None:
+            ram = self.new_layout(files)
+        if not args.force_upload:
+            files = utils.skip_present_files(self.client, files)
+        if not files:
+            return
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uploads, unpacks = files, []
+            if args.delta:
+                uploads = self.upload_delta_files(args, files, ram)
+            if args.compress is not None and uploads:
+                uploads, unpacks = self.compress_files(uploads, args.compress, self.upload_rate(args), tmpdir, ram)
+
+            if uploads:
+                self._upload_files_by_args(args, *uploads)
+
+            for method, scratch_addr, addr, size in unpacks:
+                logging.info("Decompress {} bytes from {:#x} to {:#x}".format(size, scratch_addr, addr))
+                with self.span("decompress", size=size):
+                    if method == "lzma":
+                        self.client.lzmadec(scratch_addr, addr, size)
+                    else:
+                        self.client.unzip(scratch_addr, addr, size)
+
+        if not args.no_verify:
+            with self.span("verify"):
+                utils.verify_files(self.client, files)
+
+    def upload_delta_files(self, args, files, ram):
+        """ Upload only blocks of files which differ from device's RAM contents (by CRC32)
+        Returns files which have to be uploaded completely since too many of their blocks differ
+        """
+        block_size = args.delta_block_size
+        full_uploads = []
+        for fname, addr in files:
+            start = time.monotonic()
+            size = os.path.getsize(fname)
+            host_crcs = delta.host_block_crcs(fname, block_size)
+            device_crcs = delta.device_block_crcs(self.client, addr, size, block_size)
+            changed = sum(h != d for h, d in zip(host_crcs, device_crcs))
+            if changed > len(host_crcs) * args.delta_max_changed:
+                logging.info("{} of {} blocks of '{}' differ, upload it completely".format(
+                    changed, len(host_crcs), fname))
+                full_uploads.append((fname, addr))
+                continue
+
+            ranges = delta.changed_ranges(host_crcs, device_crcs, size, block_size)
+            with utils.open_buffer(fname) as view:
+                if self.is_serial_upload(args):  # straight to destination
+                    self._upload_files_by_args(args, *((view[offset:offset + length], addr + offset)
+                        for offset, length in ranges))
+                else:  # all ranges at once into staging area, then copy them to destination
+                    self._upload_ranges_via_staging(args, view, addr, ranges, ram)
+
+            saved = size - sum(length for _, length in ranges)
+            logging.info("Delta upload of '{}': {} of {} blocks differ, {} bytes and ~{:.1f}s saved".format(
+                fname, changed, len(host_crcs), saved, size / self.upload_rate(args) - (time.monotonic() - start)))
+        return full_uploads
+
+    def _upload_ranges_via_staging(self, args, view, addr, ranges, ram):
+        staging = b"".join(view[offset:offset + length] for offset, length in ranges)
+        if not staging:
+            return
+        region = ram.place("delta staging", len(staging), kind="scratch")
+
+        self._upload_files_by_args(args, (staging, region.addr))
+        staging_addr = region.addr
+        for offset, length in ranges:
+            self.client.cp(staging_addr, addr + offset, length)
+            staging_addr += length
+        ram.remove(region)
+
+    @classmethod
+    def add_download_arguments(cls, parser):
+        """ Arguments to choose downloading method, see `download_files_by_args` and `download_region_by_args`
+        """
+        parser.add_argument("--md", action="store_true",
+            help="Download via serial by parsing 'md' output (no TFTP needed)")
+        parser.add_argument("--md-width", type=int, choices=(1, 2, 4, 8),
+            help="'md' item width in bytes (the fastest one is measured by default)")
+        parser.add_argument("--md-batch-size", type=utils.hsize2int,
+            help="Amount of bytes dumped by a single 'md' command (the fastest one is measured by default)")
+        parser.add_argument("--chunk-size", type=utils.hsize2int, default=chunked_dump.DEFAULT_CHUNK_SIZE,
+            help="Region is dumped and verified by chunks of that size, an interrupted dump is resumed by rerun")
+        parser.add_argument("--reference", type=str,
+            help="Image the region mostly matches: only blocks which differ from it (by CRC32) are transferred")
+        parser.add_argument("--reference-block-size", type=utils.hsize2int, default=delta.DEFAULT_BLOCK_SIZE,
+            help="Block size for --reference")
+
+    def download_files_by_args(self, args, *files):
+        """ Download (file, addr, size) regions via TFTP or via serial as chosen with `add_download_arguments`
+        """
+        if not args.md:
+            self.configure_network()
+        self._download_files_by_args(args, *files)
+
+    def download_region_by_args(self, args, dst, size, region, stage):
+        """ Download region of `size` bytes into `dst` file by chunks (see `chunked_dump.dump_chunked`)
+        `stage(offset, length)` makes the region's chunk available in device's RAM and returns its address,
+        `region` describes the region to tell whether a progress file left by previous run is for this one
+        """
+        if not args.md:
+            self.configure_network()
+
+        with contextlib.ExitStack() as stack:
+            reference = None if args.reference is None else stack.enter_context(utils.open_buffer(args.reference))
+
+            def fetch(offset, length, f):
+                addr = stage(offset, length)
+                if reference is None:
+                    self._download_files_by_args(args, (f, addr, length))
+                else:
+                    self._download_changed_blocks(args, reference[offset:offset + length], addr, length, f)
+
+            chunked_dump.dump_chunked(dst, size, fetch, region, chunk_size=args.chunk_size)
+
+    def _download_changed_blocks(self, args, reference, addr, size, f):
+        """ Download region into `f` file object from its current position transferring only blocks
+        which differ from `reference` (by CRC32), the rest is taken from `reference`
+        """
+        block_size = args.reference_block_size
+        with self.span("compare with reference"):
+            host_crcs = delta.host_block_crcs(reference, block_size)
+            device_crcs = delta.device_block_crcs(self.client, addr, size, block_size)
+        host_crcs += [None] * (len(device_crcs) - len(host_crcs))  # reference is shorter than the region
+        ranges = delta.changed_ranges(host_crcs, device_crcs, size, block_size)
+
+        changed = sum(length for _, length in ranges)
+        logging.info("{} of {} bytes differ from reference".format(changed, size))
+        base = f.tell()
+        f.write(reference[:size])
+        for offset, length in ranges:  # changed ranges are transferred right over the reference data
+            f.seek(base + offset)
+            self._download_files_by_args(args, (f, addr + offset, length))
+        f.seek(base + size)
+
+    def _download_files_by_args(self, args, *files):
+        size = sum(size for _, _, size in files)
+        if args.md:
+            with self.span("md download", "transfer", size=size):
+                md_dump.download_files_via_md(self.client, files, width=args.md_width,
+                    batch_size=args.md_batch_size)
+        else:
+            with self.span("tftp download", "transfer", size=size):
+                utils.download_files_via_tftp(self.client, files, listen_ip=str(self.host_ip), tftp=self.tftp)
+
+    def _upload_files_by_args(self, args, *files):
+        if args.kermit:
+            self.upload_k_files(*files, packet_size=args.kermit_packet_size, window=args.kermit_window)
+        elif args.ymodem or args.ymodem_g:
+            self.upload_y_files(*files, streaming=args.ymodem_g, baudrate=args.ymodem_baudrate)
+        else:
+            self.configure_network()
+            self.upload_files(*files)
 
 
 def add_actions(parser, *actions):
@@ -61,7 +353,7 @@ def add_actions(parser, *actions):
             help=action.__doc__.strip() if action.__doc__ else None
         )
         action.add_arguments(action_parser)
-        action_parser.set_defaults(action=action._run)
+        action_parser.set_defaults(action=action._run, needs_client=action.needs_client)
 
 
 # -------------------------------------------------------------------------------------------------
@@ -85,35 +377,92 @@ class ping(Action):
         print("Network is fine")
 
 
+# -------------------------------------------------------------------------------------------------
+class serve(Action):
+    """ Run TFTP service shared by other hiburn invocations on this host (no device is needed)
+    """
+    needs_client = False
+
+    @classmethod
+    def add_arguments(cls, parser):
+        from . import tftp_service
+        parser.add_argument("--listen-ip", type=str,
+            help="Address to listen TFTP requests on (host IP from config by default)")
+        parser.add_argument("--port", type=int, default=utils.TFTP_SERVER_DEFAULT_PORT,
+            help="TFTP port")
+        parser.add_argument("--control", type=str, default=tftp_service.control_socket_path(),
+            help="Control socket path, other invocations find it via ${} environment variable".format(
+                tftp_service.CONTROL_PATH_ENV))
+        parser.add_argument("--control-mode", type=lambda v: int(v, 8), default=tftp_service.DEFAULT_CONTROL_MODE,
+            help="Control socket permissions (octal), connected users may serve and receive files via the service")
+
+    def run(self, args):
+        from . import tftp_service
+        listen_ip = str(self.host_ip) if args.listen_ip is None else args.listen_ip
+        service = tftp_service.TftpService(listen_ip, args.port, control_path=args.control,
+            control_mode=args.control_mode)
+        try:
+            service.run()
+        except KeyboardInterrupt:
+            logging.info("TFTP service is stopped")
+
+
+# -------------------------------------------------------------------------------------------------
+class fleet(Action):
+    """ Run actions on many boards concurrently as described by JSON manifest (see `fleet.load_manifest`)
+    """
+    needs_client = False
+
+    @classmethod
+    def add_arguments(cls, parser):
+        from . import fleet
+        parser.add_argument("--manifest", type=str, required=True, help="Boards manifest (JSON)")
+        parser.add_argument("--jobs", "-j", type=int, default=fleet.DEFAULT_JOBS,
+            help="Amount of boards handled at the same time")
+        parser.add_argument("--tftp-port", type=int, default=utils.TFTP_SERVER_DEFAULT_PORT,
+            help="Port of TFTP server shared by all boards (it listens on all interfaces)")
+
+    def run(self, args):
+        from . import fleet
+        logging.getLogger().handlers[0].setFormatter(logging.Formatter("%(threadName)s: %(levelname)s: %(message)s"))
+        action_classes = {cls.__name__: cls for cls in Action.__subclasses__() if cls.needs_client}
+        boards = fleet.load_manifest(args.manifest)
+        results = fleet.run_fleet(boards, self.config, action_classes, jobs=args.jobs,
+            listen_ip="0.0.0.0", listen_port=args.tftp_port)
+        print(fleet.format_summary(results))
+        failed = [r.name for r in results if not r.ok]
+        if failed:
+            raise RuntimeError("{} board(s) failed: {}".format(len(failed), ", ".join(failed)))
+
+
 # -------------------------------------------------------------------------------------------------
 class download(Action):
-    """ Download data from device's RAM via TFTP
+    """ Download data from device's RAM via TFTP or serial
     """
     @classmethod
     def add_arguments(cls, parser):
         parser.add_argument("--dst", type=str, default="./dump", help="Destination file")
         parser.add_argument("--addr", type=utils.hsize2int, required=True, help="Address to start downloading from")
         parser.add_argument("--size", type=utils.hsize2int, required=True, help="Amount of bytes to be downloaded")
+        cls.add_download_arguments(parser)
 
     def run(self, args):
-        self.configure_network()
-        utils.download_files_via_tftp(self.client, (
-            (args.dst, args.addr, args.size),
-        ), listen_ip=str(self.host_ip))
+        self.download_region_by_args(args, args.dst, args.size, {"ram": args.addr, "size": args.size},
+            lambda offset, length: args.addr + offset)
 
 
 # -------------------------------------------------------------------------------------------------
 class upload(Action):
-    """ Upload data to device's RAM via TFTP
+    """ Upload data to device's RAM via TFTP or serial
     """
     @classmethod
     def add_arguments(cls, parser):
         parser.add_argument("--src", type=str, required=True, help="File to be uploaded")
         parser.add_argument("--addr", type=utils.hsize2int, required=True, help="Destination address in device's memory")
+        cls.add_upload_arguments(parser)
 
     def run(self, args):
-        self.configure_network()
-        self.upload_files((args.src, args.addr))
+        self.upload_files_by_args(args, (args.src, args.addr))
 
 
 # -------------------------------------------------------------------------------------------------
@@ -124,14 +473,17 @@ class boot(Action):
     def add_arguments(cls, parser):
         parser.add_argument("--uimage", type=str, required=True, help="Kernel UImage file")
         parser.add_argument("--rootfs", type=str, required=True, help="RootFS image file")
+        parser.add_argument("--dtb", type=str, help="Device tree blob to pass to the kernel")
         parser.add_argument("--upload-addr", type=utils.hsize2int,
-            help="Start address to upload into")
+            help="Start address to upload into (by default uncompressed kernel is placed right at its load "
+                 "address, so 'bootm' doesn't move it, and the rest goes to the top of Linux RAM)")
         parser.add_argument("--initrd-size", type=utils.hsize2int,
             help="Amount of RAM for initrd (actual size of RootFS image file by default)")
         parser.add_argument("--no-wait", action="store_true",
             help="Don't wait end of serial output and exit immediately after sending 'bootm' command")
-        parser.add_argument("--ymodem", action="store_true",
-            help="Upload via serial (ymodem protocol)")
+        parser.add_argument("--bootm-verify", action="store_true",
+            help="Let 'bootm' checksum the kernel image too (it's skipped if uploaded images are verified)")
+        cls.add_upload_arguments(parser)
 
         bootargs_group = parser.add_argument_group("bootargs", "Kernel's boot arguments")
         bootargs_group.add_argument("--bootargs-ip", metavar="IP", type=str,
@@ -163,27 +515,25 @@ class boot(Action):
         )
 
     def run(self, args):
-        uimage_size = os.path.getsize(args.uimage)
-        rootfs_size = os.path.getsize(args.rootfs) if args.initrd_size is None else args.initrd_size
-
-        alignment = self.config["mem"]["alignment"]
-        if args.upload_addr is None:
-            mem_end_addr = self.config["mem"]["start_addr"] + self.config["mem"]["linux_size"]
-            rootfs_addr = utils.align_address_down(alignment, mem_end_addr - rootfs_size)
-            uimage_addr = utils.align_address_down(alignment, rootfs_addr - uimage_size)
-        else:
-            uimage_addr = utils.align_address_up(alignment, args.upload_addr)  # to ensure alignment
-            rootfs_addr = utils.align_address_up(alignment, uimage_addr + uimage_size)
+        image = uimage.inspect(args.uimage)  # corrupted image is refused before anything is sent
+        logging.info("Kernel {} image {}".format(image.format, image.kernel))
 
+        rootfs_size = os.path.getsize(args.rootfs) if args.initrd_size is None else args.initrd_size
+        mem = self.config["mem"]
+        ram = layout.plan_boot(mem["start_addr"], mem["linux_size"], mem["alignment"], mem.get("uboot_size", 0),
+            args.uimage, image, max(rootfs_size, os.path.getsize(args.rootfs)), dtb=args.dtb,
+            upload_addr=args.upload_addr)
+        uimage_addr, rootfs_addr = ram["kernel"].addr, ram["rootfs"].addr
+        dtb_addr = None if args.dtb is None else ram["dtb"].addr
         logging.info("Kernel uImage upload addr {:#x}; RootFS image upload addr {:#x}".format(
             uimage_addr, rootfs_addr
         ))
 
-        if args.ymodem:
-            self.upload_y_files((args.uimage, uimage_addr), (args.rootfs, rootfs_addr))
-        else:
-            self.configure_network()
-            self.upload_files((args.uimage, uimage_addr), (args.rootfs, rootfs_addr))
+        files = [(args.uimage, uimage_addr), (args.rootfs, rootfs_addr)]
+        if args.dtb is not None:
+            files.append((args.dtb, dtb_addr))
+        self.upload_files_by_args(args, *files, ram=ram)
+        print(ram.format_map())
 
         bootargs = ""
         bootargs += "mem={} ".format(self.config["mem"]["linux_size"])
@@ -195,8 +545,13 @@ class boot(Action):
 
         logging.info("Load kernel with bootargs: {}".format(bootargs))
 
-        self.client.setenv(bootargs=bootargs)
-        resp = self.client.bootm(uimage_addr, wait=(not args.no_wait))
+        env = {"bootargs": bootargs}
+        if not (args.no_verify or args.bootm_verify):
+            env["verify"] = "n"  # the image is validated on host and uploaded copy is checked by CRC32
+
+        with self.span("bootm"), self.client.batch():  # a single line if it fits
+            self.client.setenv(**env)
+            resp = self.client.bootm(uimage_addr, wait=(not args.no_wait), fdt_addr=dtb_addr)
         if resp is None:
             print("'bootm' command has been sent. Hopefully booting is going on well...")
         else:
@@ -209,9 +564,26 @@ class boot(Action):
             )
 
 
+# -------------------------------------------------------------------------------------------------
+class image_info(Action):
+    """ Validate legacy uImage or FIT image and print its contents (no device is needed)
+    """
+    needs_client = False
+
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument("--image", type=str, required=True, help="uImage or FIT image file")
+
+    def run(self, args):
+        image = uimage.inspect(args.image)
+        print("{} image, checksums are OK".format(image.format))
+        for info in image.images:
+            print("  {}{}".format(info, " (default kernel)" if info is image.kernel and len(image.images) > 1 else ""))
+
+
 # -------------------------------------------------------------------------------------------------
 class download_sf(Action):
-    """ Download data from device's SPI flasg via TFTP
+    """ Download data from device's SPI flasg via TFTP or serial
     """
     @classmethod
     def add_arguments(cls, parser):
@@ -220,20 +592,98 @@ class download_sf(Action):
         parser.add_argument("--offset", type=utils.hsize2int, default=0, help="Flash offset")
         parser.add_argument("--dst", type=str, default="./dump.bin", help="Destination file")
         parser.add_argument("--addr", type=utils.hsize2int, help="Devices's RAM address read data from flash into")
+        cls.add_download_arguments(parser)
 
     def run(self, args):
-        DEFAULT_MEM_ADDR = self.config["mem"]["start_addr"] + (1 << 20)  # 1Mb
-
-        self.configure_network()
         self.client.sf_probe(args.probe)
 
-        mem_addr = DEFAULT_MEM_ADDR if args.addr is None else args.addr
-        logging.info("Read {} bytes from {} offset of SPI flash into memory at {}...".format(args.size, args.offset, mem_addr))
-        self.client.sf_read(mem_addr, args.offset, args.size)
+        staging_size = min(args.chunk_size, args.size)  # a chunk at a time is read from flash
+        ram = self.new_layout()
+        if args.addr is None:
+            mem_addr = ram.place("flash chunk staging", staging_size, kind="scratch").addr
+        elif ram.is_free(args.addr, staging_size):
+            mem_addr = ram.add("flash chunk staging", args.addr, staging_size, kind="scratch").addr
+        else:
+            raise RuntimeError("Staging area [{:#x}, {:#x}) is out of free Linux RAM, use smaller --chunk-size".format(
+                args.addr, args.addr + staging_size))
+        logging.debug(ram.format_map())
+
+        def stage(offset, length):  # a chunk at a time, so RAM usage is bounded by chunk size
+            logging.info("Read {} bytes from {:#x} offset of SPI flash into memory at {:#x}...".format(
+                length, args.offset + offset, mem_addr))
+            self.client.sf_read(mem_addr, args.offset + offset, length)
+            return mem_addr
 
-        utils.download_files_via_tftp(self.client, (
-            (args.dst, mem_addr, args.size),
-        ), listen_ip=str(self.host_ip))
+        region = {"sf": args.probe, "offset": args.offset, "size": args.size}
+        self.download_region_by_args(args, args.dst, args.size, region, stage)
+
+
+# -------------------------------------------------------------------------------------------------
+class upload_sf(Action):
+    """ Write image to device's SPI flash, only erase blocks which differ are erased and written
+    """
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument("--probe", type=str, required=True, help="'sf probe' arguments")
+        parser.add_argument("--src", type=str, required=True, help="Image file to be written")
+        parser.add_argument("--offset", type=utils.hsize2int, default=0,
+            help="Flash offset, a multiple of erase size")
+        parser.add_argument("--addr", type=utils.hsize2int,
+            help="Device's RAM address to stage the image at (current flash contents are read behind it)")
+        parser.add_argument("--erase-size", type=utils.hsize2int,
+            help="Flash erase block size ('sf probe' reports it by default)")
+        parser.add_argument("--full", action="store_true", help="Erase and write all blocks, even unchanged ones")
+        cls.add_upload_arguments(parser)
+
+    def run(self, args):
+        probe = self.client.sf_probe(args.probe)
+        erase_size = args.erase_size or parse_sf_erase_size(probe) or delta.DEFAULT_BLOCK_SIZE
+        if args.offset % erase_size:
+            raise RuntimeError("Flash offset {:#x} isn't a multiple of erase size {:#x}".format(args.offset, erase_size))
+
+        size = os.path.getsize(args.src)
+        padded_size = utils.align_address_up(erase_size, size)
+        ram = self.new_layout()
+        if args.addr is None:
+            staging_addr = ram.place("image staging", padded_size).addr
+        elif ram.is_free(args.addr, padded_size):
+            staging_addr = ram.add("image staging", args.addr, padded_size).addr
+        else:
+            raise RuntimeError("Staging area [{:#x}, {:#x}) is out of free Linux RAM".format(
+                args.addr, args.addr + padded_size))
+        flash_addr = ram.place("flash readback", padded_size, kind="scratch").addr
+        logging.info("Stage '{}' at {:#x}, read flash at {:#x} offset into {:#x}, erase size {:#x}".format(
+            args.src, staging_addr, args.offset, flash_addr, erase_size))
+        logging.debug(ram.format_map())
+
+        self.upload_files_by_args(args, (args.src, staging_addr), ram=ram)
+
+        with self.span("compare"):
+            self.client.sf_read(flash_addr, args.offset, padded_size)
+            if padded_size != size:  # blocks are written whole, keep flash contents behind the image
+                self.client.cp(flash_addr + size, staging_addr + size, padded_size - size)
+            if args.full:
+                ranges = [(0, padded_size)]
+            else:
+                host_crcs = delta.host_block_crcs(args.src, erase_size)
+                device_crcs = delta.device_block_crcs(self.client, flash_addr, size, erase_size)
+                ranges = delta.changed_ranges(host_crcs, device_crcs, size, erase_size)
+        ranges = [(offset, utils.align_address_up(erase_size, length)) for offset, length in ranges]
+
+        changed = sum(length for _, length in ranges)
+        logging.info("{} of {} erase blocks differ".format(changed // erase_size, padded_size // erase_size))
+        for offset, length in ranges:
+            with self.span("erase and write", "transfer", size=length):
+                self.client.sf_erase(args.offset + offset, length)
+                self.client.sf_write(staging_addr + offset, args.offset + offset, length)
+
+        with self.span("verify"):
+            for offset, length in ranges:
+                self.client.sf_read(flash_addr + offset, args.offset + offset, length)
+                if self.client.crc32(flash_addr + offset, length) != self.client.crc32(staging_addr + offset, length):
+                    raise RuntimeError("Flash contents at {:#x} offset don't match written data".format(
+                        args.offset + offset))
+        print("{} bytes of flash are rewritten, {} bytes are up to date".format(changed, padded_size - changed))
 
 
 # -------------------------------------------------------------------------------------------------
@@ -0,0 +1,291 @@
+import asyncio
+import logging
+from .u_boot_client import ENCODING, CTRL_C, PROMPTS, READ_TIMEOUT, MD_SUFFIXES, SF_ERRORS, PromptMatcher, \
+    bytes_to_string
+from . import kermit
+from . import ymodem
+
+
+READ_CHUNK_SIZE = 4096
+SETTLE_TIMEOUT = 0.05  # quiet period after console is fetched
+
+
+# -------------------------------------------------------------------------------------------------
+class _SerialConnection:
+    """ pyserial port driven by event loop's reader callback
+    """
+    def __init__(self, serial):
+        self.serial = serial
+        self.serial.timeout = 0
+        self.reader = asyncio.StreamReader()
+        self._loop = asyncio.get_running_loop()
+        self.resume()
+
+    def _on_readable(self):
+        data = self.serial.read(self.serial.in_waiting or 1)
+        if data:
+            self.reader.feed_data(data)
+
+    def write(self, data):
+        self.serial.write(data)
+
+    async def drain(self):
+        pass
+
+    def pause(self):
+        self._loop.remove_reader(self.serial.fileno())
+
+    def resume(self):
+        self._loop.add_reader(self.serial.fileno(), self._on_readable)
+
+    def close(self):
+        self.pause()
+        self.serial.close()
+
+    def __str__(self):
+        return str(self.serial.port)
+
+
+class _StreamConnection:
+    """ Raw TCP stream (e.g. ser2net in raw mode), telnet negotiation isn't supported
+    """
+    def __init__(self, reader, writer):
+        self.serial = None
+        self.reader = reader
+        self._writer = writer
+
+    def write(self, data):
+        self._writer.write(data)
+
+    async def drain(self):
+        await self._writer.drain()
+
+    def close(self):
+        self._writer.close()
+
+    def __str__(self):
+        return "{}:{}".format(*self._writer.get_extra_info("peername")[:2])
+
+
+# -------------------------------------------------------------------------------------------------
+class AsyncUBootClient:
+    """ asyncio counterpart of UBootClient: a single event loop may drive many consoles
+    Responses are complete as soon as the prompt arrives instead of after a read timeout
+    """
+    @classmethod
+    async def create_with_serial(cls, **kwargs):
+        import serial
+        return cls(_SerialConnection(serial.Serial(**kwargs)))
+
+    @classmethod
+    async def create_with_tcp(cls, host, port):
+        return cls(_StreamConnection(*await asyncio.open_connection(host, port)))
+
+    def __init__(self, conn, prompts=PROMPTS):
+        self.conn = conn
+        self.matcher = PromptMatcher(prompts)
+        self._tail = bytearray()  # received data which isn't a complete line yet
+        logging.debug("AsyncUBootClient for {} constructed".format(self.conn))
+
+    def close(self):
+        self.conn.close()
+
+    async def _read_chunk(self, timeout):
+        try:
+            data = await asyncio.wait_for(self.conn.reader.read(READ_CHUNK_SIZE), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not data:
+            raise EOFError("Connection to {} is closed".format(self.conn))
+        logging.debug("<< {}".format(data))
+        return data
+
+    def _split_lines(self, data):
+        """ Append `data` to the incomplete tail, returns complete lines
+        """
+        self._tail += data
+        end = self._tail.rfind(b"\n") + 1
+        if not end:
+            return []
+        lines = bytes(self._tail[:end]).splitlines(keepends=True)
+        del self._tail[:end]
+        return lines
+
+    async def _write(self, data):
+        if isinstance(data, str):
+            data = data.encode(ENCODING)
+        self.conn.write(data)
+        await self.conn.drain()
+        logging.debug(">> {}".format(data))
+
+    def _pop_line(self):
+        end = self._tail.find(b"\n") + 1
+        line = bytes(self._tail[:end])
+        del self._tail[:end]
+        return line
+
+    async def fetch_console(self):
+        """ Wait for running U-Boot and interrupt autoboot by Ctrl-C till prompt appears
+        """
+        self._tail.clear()
+        logging.debug("Wait for U-Boot printable output...")
+        while True:
+            data = await self._read_chunk(None)
+            if any(line.strip().isprintable() and line.strip() for line in
+                    bytes_to_string(data).splitlines()):
+                break
+
+        logging.debug("Wait for prompt...")
+        while True:
+            await self._write(CTRL_C)
+            data = await self._read_chunk(READ_TIMEOUT)
+            if data is not None:
+                self._split_lines(data)
+                if self.matcher.is_prompt(bytes(self._tail)):
+                    break
+
+        # interrupts sent meanwhile may produce a couple of extra prompts
+        while await self._read_chunk(SETTLE_TIMEOUT) is not None:
+            pass
+        self._tail.clear()
+        logging.info("U-Boot console is fetched")
+
+    async def write_command(self, cmd):
+        await self._write(cmd + "\n")
+        while b"\n" not in self._tail:
+            data = await self._read_chunk(READ_TIMEOUT)
+            if data is None:
+                raise RuntimeError("command '{}' isn't echoed".format(cmd))
+            self._tail += data
+        echoed = bytes_to_string(self._pop_line())
+        if not echoed.endswith(cmd):
+            raise RuntimeError("echoed data '{}' doesn't match input '{}'".format(echoed, cmd))
+
+    async def read_response(self, timeout=None):
+        """ Read lines till prompt is received, with `timeout` reading stops after that long silence
+        """
+        lines = []
+        while True:
+            while b"\n" in self._tail:
+                line = self._pop_line()
+                if self.matcher.is_prompt(line):
+                    return lines
+                lines.append(bytes_to_string(line))
+            if self.matcher.is_prompt(bytes(self._tail)):
+                self._tail.clear()
+                return lines
+            data = await self._read_chunk(timeout)
+            if data is None:
+                return lines
+            self._tail += data
+
+    async def command(self, cmd, timeout=None):
+        await self.write_command(cmd)
+        return await self.read_response(timeout=timeout)
+
+    # simple wraps for U-Boot commands are below, see UBootClient
+    async def printenv(self):
+        return await self.command("printenv")
+
+    async def setenv(self, **kwargs):
+        for k, v in kwargs.items():
+            await self.command("setenv {} {}".format(k, str(v).replace(";", "\\;")))
+
+    async def ping(self, addr):
+        return await self.command("ping {}".format(addr))
+
+    async def tftp(self, addr, file_name, size=None):
+        if size is None:  # host -> device
+            return await self.command("tftp {:#x} {}".format(addr, file_name))
+        return await self.command("tftp {:#x} {} {:#x}".format(addr, file_name, size))
+
+    async def md(self, addr, count, width=4):
+        return await self.command("md.{} {:#x} {:#x}".format(MD_SUFFIXES[width], addr, count))
+
+    async def cp(self, src_addr, dst_addr, size):
+        return await self.command("cp.b {:#x} {:#x} {:#x}".format(src_addr, dst_addr, size))
+
+    async def crc32(self, addr, size):
+        resp = await self.command("crc32 {:#x} {:#x}".format(addr, size))
+        for line in resp:
+            if "==>" in line:
+                return int(line.split("==>")[1].strip().split()[0], 16)
+        raise RuntimeError("Couldn't parse 'crc32' output: {}".format(" ".join(resp)))
+
+    async def has_command(self, name):
+        resp = await self.command("help {}".format(name))
+        return not any(line.startswith("Unknown command") for line in resp)
+
+    async def _decompress(self, cmd, src_addr, dst_addr, size):
+        if size is None:
+            resp = await self.command("{} {:#x} {:#x}".format(cmd, src_addr, dst_addr))
+        else:
+            resp = await self.command("{} {:#x} {:#x} {:#x}".format(cmd, src_addr, dst_addr, size))
+        if not any(line.startswith("Uncompressed size") for line in resp):
+            raise RuntimeError("'{}' failed: {}".format(cmd, " ".join(resp)))
+        return resp
+
+    async def unzip(self, src_addr, dst_addr, size=None):
+        return await self._decompress("unzip", src_addr, dst_addr, size)
+
+    async def lzmadec(self, src_addr, dst_addr, size=None):
+        return await self._decompress("lzmadec", src_addr, dst_addr, size)
+
+    async def bootm(self, uimage_addr, wait=True, fdt_addr=None):
+        cmd = "bootm {:#x}".format(uimage_addr)
+        if fdt_addr is not None:
+            cmd += " - {:#x}".format(fdt_addr)
+        await self.write_command(cmd)
+        if not wait:
+            return
+        return await self.read_response(timeout=5)
+
+    async def sf_probe(self, args):
+        return await self.command("sf probe {}".format(args))
+
+    async def sf_read(self, dst_addr, flash_offset, size):
+        cmd = "sf read {:#x} {:#x} {:#x}".format(dst_addr, flash_offset, size)
+        resp = await self.command(cmd)
+        if any(error in line.lower() for line in resp for error in SF_ERRORS):
+            raise RuntimeError("'{}' failed: {}".format(cmd, " ".join(resp)))
+        return resp
+
+    async def _transfer(self, cmd, sender):
+        """ Run blocking serial protocol `sender(serial)` in executor with the loop's reader paused
+        """
+        if self.conn.serial is None:
+            raise RuntimeError("Binary uploads need a serial port connection")
+        await self.write_command(cmd)
+        await self._readline_raw()  # "## Ready for binary ..."
+        self.conn.pause()
+        # handshakes ('C', NAK) received meanwhile are dropped, the receiver repeats them to the sender
+        self._tail.clear()
+        while await self._read_chunk(SETTLE_TIMEOUT) is not None:
+            pass
+        self.conn.serial.timeout = READ_TIMEOUT
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, sender, self.conn.serial)
+        finally:
+            self.conn.serial.timeout = 0
+            self.conn.resume()
+        return await self.read_response()
+
+    async def _readline_raw(self):
+        while b"\n" not in self._tail:
+            data = await self._read_chunk(READ_TIMEOUT)
+            if data is None:
+                return b""
+            self._tail += data
+        return self._pop_line()
+
+    async def loady(self, addr, data, long=True, streaming=False):
+        """ Upload `data` to `addr` via YMODEM (serial port connections only)
+        """
+        return await self._transfer("loady {:#x}".format(addr),
+            lambda s: ymodem.YModem(s).transmit(data, long=long, streaming=streaming))
+
+    async def loadb(self, addr, data, packet_size=1000, window=1):
+        """ Upload `data` to `addr` via Kermit (serial port connections only)
+        """
+        return await self._transfer("loadb {:#x}".format(addr),
+            lambda s: kermit.Kermit(s, packet_size=packet_size, window=window).transmit(data))
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import zlib
+
+# Dumping of a large region chunk by chunk. Every chunk is staged, transferred and verified on its own
+# straight into the destination file at its offset. CRC32 of finished chunks are kept in a sidecar
+# progress file, so a failed dump is resumed from the first missing chunk by a rerun.
+
+
+DEFAULT_CHUNK_SIZE = 4 << 20
+PROGRESS_SUFFIX = ".progress"
+CRC_BLOCK_SIZE = 1 << 20
+
+
+# -------------------------------------------------------------------------------------------------
+class DumpProgress:
+    """ Sidecar file of `dst` with CRC32 of dumped chunks; it's valid for the same `region` description
+    (a dict like {"ram": addr, "size": size}) and chunk size only
+    """
+    def __init__(self, dst, region, chunk_size):
+        self.path = dst + PROGRESS_SUFFIX
+        self.region = region
+        self.chunk_size = chunk_size
+        self.chunks = {}  # number -> CRC32
+
+    def load(self):
+        """ Returns True if there is a progress of the same dump
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r") as f:
+            state = json.load(f)
+        if state.get("region") != self.region or state.get("chunk_size") != self.chunk_size:
+            logging.info("Progress file '{}' is for another region, start over".format(self.path))
+            return False
+        self.chunks = {int(num): crc for num, crc in state["chunks"].items()}
+        return True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"region": self.region, "chunk_size": self.chunk_size, "chunks": self.chunks}, f)
+        os.replace(tmp_path, self.path)
+
+    def mark_done(self, num, crc):
+        self.chunks[num] = crc
+        self.save()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def file_crc32(f, offset, size):
+    f.seek(offset)
+    crc = 0
+    while size > 0:
+        data = f.read(min(size, CRC_BLOCK_SIZE))
+        if not data:
+            break
+        crc = zlib.crc32(data, crc)
+        size -= len(data)
+    return crc
+
+
+def dump_chunked(dst, size, fetch, region, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Dump region of `size` bytes into `dst` file by `chunk_size` chunks
+    `fetch(offset, length, f)` transfers region's chunk into `f` file object from its current position
+    verifying it against device's CRC32 and leaves `f` positioned after the chunk.
+    Chunks recorded in the progress file are skipped if the file still has them
+    """
+    progress = DumpProgress(dst, region, chunk_size)
+    resumed = progress.load() and os.path.exists(dst)
+    if not resumed:
+        progress.chunks = {}
+
+    with open(dst, "r+b" if resumed else "w+b", buffering=0) as f:
+        for num, offset in enumerate(range(0, size, chunk_size)):
+            length = min(chunk_size, size - offset)
+            if num in progress.chunks and file_crc32(f, offset, length) == progress.chunks[num]:
+                logging.debug("Chunk {} ({} bytes at {:#x}) is already dumped".format(num, length, offset))
+                continue
+
+            logging.info("Dump chunk {} of {} ({} bytes at {:#x})".format(
+                num + 1, -(-size // chunk_size), length, offset))
+            f.seek(offset)
+            fetch(offset, length, f)
+            if f.tell() != offset + length:
+                raise RuntimeError("{} bytes of chunk are received, {} are expected".format(f.tell() - offset, length))
+            os.fsync(f.fileno())
+            progress.mark_done(num, file_crc32(f, offset, length))
+        f.truncate(size)
+
+    progress.remove()
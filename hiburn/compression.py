@@ -0,0 +1,48 @@
+import logging
+import os
+import shutil
+
+
+# -------------------------------------------------------------------------------------------------
+# Rough throughput figures (bytes per second) used to decide whether compression pays off
+DECOMPRESSION_RATES = {
+    "gzip": 10 << 20,  # U-Boot's `unzip` on ARM926/Cortex-A7 SoCs
+    "lzma": 2 << 20,  # U-Boot's `lzmadec`
+}
+TFTP_RATE = 1 << 20  # lock-step TFTP with default 512 bytes blocks
+COMMAND_OVERHEAD = 0.2  # extra U-Boot command round trip, seconds
+
+U_BOOT_COMMANDS = {
+    "gzip": "unzip",
+    "lzma": "lzmadec",
+}
+
+
+# -------------------------------------------------------------------------------------------------
+def compress_file(src, dst, method):
+    """ Compress `src` file into `dst` file in a streaming way
+    'lzma' method produces legacy .lzma ("alone") format expected by U-Boot's `lzmadec`
+    """
+    if method == "gzip":
+        import gzip
+        opener = gzip.open
+    elif method == "lzma":
+        import lzma
+        opener = lambda path, mode: lzma.open(path, mode, format=lzma.FORMAT_ALONE)
+    else:
+        raise ValueError("Unknown compression method '{}'".format(method))
+
+    with open(src, "rb") as fin, opener(dst, "wb") as fout:
+        shutil.copyfileobj(fin, fout, 1 << 20)
+    return os.path.getsize(dst)
+
+
+# -------------------------------------------------------------------------------------------------
+def is_worth_compressing(orig_size, packed_size, link_rate, method):
+    """ Check whether time saved on transfer exceeds time spent on decompression on device
+    """
+    saved = (orig_size - packed_size) / link_rate
+    cost = orig_size / DECOMPRESSION_RATES[method] + COMMAND_OVERHEAD
+    logging.debug("Compression by {} saves {:.2f}s of transfer and costs {:.2f}s of decompression".format(
+        method, saved, cost))
+    return saved > cost
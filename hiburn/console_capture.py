@@ -0,0 +1,111 @@
+import logging
+import subprocess
+import time
+from .u_boot_client import CTRL_C, ENCODING, PROMPTS, PromptMatcher
+
+# Catching of U-Boot's console after power reset.
+# Reset command is started in background while the port is already read, interrupts are sent
+# from the very first received byte at a fixed cadence, so even `bootdelay=0` window isn't missed.
+
+
+INTERRUPT_INTERVAL = 0.01  # seconds between interrupts
+SETTLE_TIMEOUT = 0.1  # quiet period after prompt, extra interrupts produce extra prompts
+MAX_TAIL_SIZE = 256  # incomplete line longer than that isn't a prompt anyway
+
+
+def parse_stop_string(text):
+    """ Stop string from command line, escapes like '\\x03' or '\\r' are allowed
+    """
+    return text.encode(ENCODING).decode("unicode_escape").encode("latin-1")
+
+
+# -------------------------------------------------------------------------------------------------
+class CaptureTimings:
+    """ Seconds since capture's start (reset command's launch)
+    """
+    def __init__(self):
+        self.first_byte = None
+        self.prompt = None
+        self.interrupts = 0
+
+    def as_dict(self):
+        return {"first_byte": self.first_byte, "prompt": self.prompt, "interrupts": self.interrupts}
+
+    def __str__(self):
+        return "first byte in {:.3f}s, prompt in {:.3f}s after {} interrupts".format(
+            self.first_byte, self.prompt, self.interrupts)
+
+
+class ConsoleCapture:
+    """ Interrupt autoboot on connection `conn` (pyserial-like object) by sending `stop` every `interval`
+    """
+    def __init__(self, conn, prompts=PROMPTS, stop=CTRL_C, interval=INTERRUPT_INTERVAL, timeout=None):
+        self.s = conn
+        self.matcher = PromptMatcher(prompts)
+        self.stop = stop
+        self.interval = interval
+        self.timeout = timeout
+
+    def _read(self):
+        return self.s.read(getattr(self.s, "in_waiting", 0) or 1)
+
+    def run(self, reset_cmd=None):
+        """ Start `reset_cmd` shell command (if any) and wait for the prompt, returns CaptureTimings
+        """
+        timings = CaptureTimings()
+        saved_timeout = self.s.timeout
+        self.s.timeout = self.interval
+        self.s.reset_input_buffer()
+
+        start = time.monotonic()
+        proc = None
+        if reset_cmd is not None:
+            logging.debug("Run '{}' shell command to reset power...".format(reset_cmd))
+            proc = subprocess.Popen(reset_cmd, shell=True)
+        try:
+            self._wait_prompt(timings, start, proc)
+            self._settle()
+            if proc is not None and proc.wait() != 0:
+                raise RuntimeError("Reset command '{}' failed with code {}".format(reset_cmd, proc.returncode))
+        finally:
+            self.s.timeout = saved_timeout
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        return timings
+
+    def _wait_prompt(self, timings, start, proc):
+        logging.debug("Wait for U-Boot output...")
+        tail = b""  # last incomplete line
+        next_interrupt = None
+        while True:
+            now = time.monotonic()
+            if self.timeout is not None and now - start > self.timeout:
+                raise RuntimeError("U-Boot prompt isn't received in {}s".format(self.timeout))
+            if proc is not None and proc.poll():
+                raise RuntimeError("Reset command '{}' failed with code {}".format(proc.args, proc.returncode))
+
+            if next_interrupt is not None and now >= next_interrupt:
+                self.s.write(self.stop)
+                timings.interrupts += 1
+                next_interrupt += self.interval
+                if next_interrupt < now:  # reading took longer than the interval
+                    next_interrupt = now + self.interval
+
+            data = self._read()
+            if not data:
+                continue
+            if timings.first_byte is None:
+                timings.first_byte = time.monotonic() - start
+                next_interrupt = time.monotonic()
+                logging.debug("First byte is received in {:.3f}s, start interrupting".format(timings.first_byte))
+
+            tail = (tail + data).rsplit(b"\n", 1)[-1][-MAX_TAIL_SIZE:]
+            if self.matcher.is_prompt(tail):
+                timings.prompt = time.monotonic() - start
+                return
+
+    def _settle(self):
+        self.s.timeout = SETTLE_TIMEOUT
+        while self._read():
+            pass
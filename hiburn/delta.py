@@ -0,0 +1,38 @@
+import zlib
+from . import utils
+
+
+DEFAULT_BLOCK_SIZE = 64 << 10
+
+
+# -------------------------------------------------------------------------------------------------
+def host_block_crcs(src, block_size=DEFAULT_BLOCK_SIZE):
+    """ CRC32 of every `block_size` block of `src` (bytes-like object, file path or file object)
+    """
+    with utils.open_buffer(src) as view:
+        return [zlib.crc32(view[offset:offset + block_size]) for offset in range(0, len(view), block_size)]
+
+
+# -------------------------------------------------------------------------------------------------
+def device_block_crcs(u_boot_client, addr, size, block_size=DEFAULT_BLOCK_SIZE):
+    """ CRC32 of every `block_size` block of device's memory region
+    """
+    return u_boot_client.crc32_regions((addr + offset, min(block_size, size - offset))
+        for offset in range(0, size, block_size))
+
+
+# -------------------------------------------------------------------------------------------------
+def changed_ranges(host_crcs, device_crcs, size, block_size=DEFAULT_BLOCK_SIZE):
+    """ Merge differing blocks into (offset, length) ranges
+    """
+    ranges = []
+    for num, (host_crc, device_crc) in enumerate(zip(host_crcs, device_crcs)):
+        if host_crc == device_crc:
+            continue
+        offset = num * block_size
+        length = min(block_size, size - offset)
+        if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((offset, length))
+    return ranges
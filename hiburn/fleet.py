@@ -0,0 +1,284 @@
+import argparse
+import concurrent.futures
+import copy
+import json
+import logging
+import threading
+import time
+from . import console_capture
+from . import tftp
+from . import utils
+from .u_boot_client import UBootClient, CTRL_C
+
+
+DEFAULT_JOBS = 8
+
+
+# -------------------------------------------------------------------------------------------------
+def load_manifest(path):
+    """ Load boards description from JSON manifest:
+    {"defaults": {...}, "boards": [{...}, ...]}, board's fields override default ones:
+      "name" - board's name for the summary,
+      "serial" - serial port 'port[:baudrate[:DPS]]', "serial_over_telnet" - endpoint '[host:]port'
+      or "serial_url" - console URL like 'rfc2217://host:port' (see transport.open_url),
+      "reset_cmd" - shell command to reset board's power, "no_fetch" - U-Boot's console is already fetched,
+      "stop_string" - string to interrupt autoboot with, "interrupt_interval" - seconds between interrupts,
+      "fetch_timeout" - seconds to wait for U-Boot's prompt,
+      "config" - config overrides like {"net": {"device_ip": "192.168.10.101"}},
+      "action" - action's name and "args" - its arguments like {"uimage": "uImage", "ymodem": true}
+    """
+    with open(path, "r") as f:
+        manifest = json.load(f)
+
+    defaults = manifest.get("defaults", {})
+    boards = []
+    for num, board in enumerate(manifest["boards"]):
+        res = merge_dicts(copy.deepcopy(defaults), board)
+        res.setdefault("name", "board{}".format(num))
+        if "action" not in res:
+            raise RuntimeError("Board '{}' has no action".format(res["name"]))
+        if not any(key in res for key in ("serial", "serial_over_telnet", "serial_url")):
+            raise RuntimeError("Board '{}' has none of serial, serial_over_telnet, serial_url".format(res["name"]))
+        boards.append(res)
+    return boards
+
+
+def merge_dicts(dst, src):
+    for key, val in src.items():
+        if isinstance(val, dict) and isinstance(dst.get(key), dict):
+            merge_dicts(dst[key], val)
+        else:
+            dst[key] = val
+    return dst
+
+
+# -------------------------------------------------------------------------------------------------
+def update_config(config, overrides):
+    """ Apply manifest's config overrides, strings are converted like command line values are
+    """
+    for key, val in overrides.items():
+        if isinstance(val, dict):
+            update_config(config[key], val)
+        elif isinstance(config.get(key), int) and isinstance(val, str):
+            config[key] = utils.hsize2int(val)
+        else:
+            config[key] = val
+
+
+# -------------------------------------------------------------------------------------------------
+def args_to_argv(args):
+    """ Convert {"initrd_size": "8M", "ymodem": true} into ["--initrd-size", "8M", "--ymodem"]
+    """
+    argv = []
+    for key, val in args.items():
+        flag = "--" + key.replace("_", "-")
+        if val is True:
+            argv.append(flag)
+        elif isinstance(val, (list, tuple)):
+            argv += [flag] + [str(v) for v in val]
+        elif val is not None and val is not False:
+            argv += [flag, str(val)]
+    return argv
+
+
+def parse_action_args(action_cls, args):
+    from . import actions
+
+    parser = argparse.ArgumentParser(prog=action_cls.__name__)
+    actions.add_actions(parser, action_cls)
+    return parser.parse_args([action_cls.__name__] + args_to_argv(args))
+
+
+# -------------------------------------------------------------------------------------------------
+class SharedTftp:
+    """ One TFTP server for all boards, transfers are routed by client IP
+    Image files are memory-mapped per transfer, so boards share OS page cache instead of private copies
+    """
+    def __init__(self, listen_ip, listen_port=utils.TFTP_SERVER_DEFAULT_PORT):
+        self.listen_ip = listen_ip
+        self.listen_port = listen_port
+        self.server = tftp.TftpServer(open_read=self._open_source, open_write=self._open_receiver)
+        self.thread = None
+        self._lock = threading.Lock()
+        self._sources = {}  # (client IP, name) -> source
+        self._receivers = {}  # (client IP, name) -> TftpReceiver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        if self.thread is not None:
+            self.server.stop()
+            self.thread.join()
+
+    def start(self):
+        """ Start server on demand, fleets uploading via serial don't need privileged port
+        """
+        with self._lock:
+            if self.thread is None:
+                self.server.bind(self.listen_ip, self.listen_port)
+                self.thread = threading.Thread(target=self.server.serve, name="tftp")
+                self.thread.start()
+
+    def board(self, client_ip):
+        return BoardTftp(self, client_ip)
+
+    def register(self, key, src=None, receiver=None):
+        """ Register source or receiver under (client IP, name) key
+        """
+        with self._lock:
+            if key in self._sources or key in self._receivers:
+                raise RuntimeError("'{}' is already registered for {}".format(key[1], key[0]))
+            if receiver is None:
+                self._sources[key] = src
+            else:
+                self._receivers[key] = receiver
+
+    def unregister(self, keys):
+        with self._lock:
+            for key in keys:
+                self._sources.pop(key, None)
+                receiver = self._receivers.pop(key, None)
+                if receiver is not None:
+                    receiver.close()
+
+    def _open_source(self, name, client_addr):
+        with self._lock:
+            src = self._sources.get((client_addr[0], name))
+        if src is None:
+            return None
+        return utils.BufferReader(src)
+
+    def _open_receiver(self, name, client_addr):
+        with self._lock:
+            receiver = self._receivers.get((client_addr[0], name))
+        return None if receiver is None else receiver.open()
+
+
+class BoardTftp:
+    """ SharedTftp's view for a single board with TftpContext's interface
+    """
+    def __init__(self, shared, client_ip):
+        self.shared = shared
+        self.client_ip = client_ip
+        self._keys = []
+
+    def __enter__(self):
+        self.shared.start()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.shared.unregister(self._keys)
+        self._keys = []
+
+    def _key(self, name, prefix):
+        return (self.client_ip, "{}{}".format(prefix, len(self._keys)) if name is None else name)
+
+    def serve(self, src, name=None):
+        key = self._key(name, "hiburn")
+        self.shared.register(key, src=src)
+        self._keys.append(key)
+        return key[1]
+
+    def receive(self, dst, name=None):
+        key = self._key(name, "hiburn-rx")
+        receiver = utils.TftpReceiver(key[1], dst)
+        self.shared.register(key, receiver=receiver)
+        self._keys.append(key)
+        return receiver
+
+
+# -------------------------------------------------------------------------------------------------
+class BoardResult:
+    def __init__(self, name, action):
+        self.name = name
+        self.action = action
+        self.error = None
+        self.timings = {}  # phase -> seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def create_client(board):
+    if "serial" in board:
+        return UBootClient.create_with_serial(**utils.str2serial_kwargs(board["serial"]))
+    if "serial_url" in board:
+        return UBootClient.create_with_url(board["serial_url"])
+    return UBootClient.create_with_serial_over_telnet(*utils.str2endpoint(board["serial_over_telnet"]))
+
+
+def run_board(board, base_config, shared_tftp, action_classes):
+    """ Fetch board's console and run its action, never raises
+    """
+    threading.current_thread().name = board["name"]
+    result = BoardResult(board["name"], board["action"])
+    start = time.monotonic()
+    client = None
+    try:
+        config = copy.deepcopy(base_config)
+        update_config(config, board.get("config", {}))
+        action_cls = action_classes[board["action"]]
+        args = parse_action_args(action_cls, board.get("args", {}))
+
+        client = create_client(board)
+        if not board.get("no_fetch"):
+            stop = console_capture.parse_stop_string(board["stop_string"]) if "stop_string" in board else CTRL_C
+            capture = client.fetch_console(reset_cmd=board.get("reset_cmd") or None, stop=stop,
+                interval=board.get("interrupt_interval"), timeout=board.get("fetch_timeout"))
+            result.timings["first_byte"] = capture.first_byte
+            result.timings["prompt"] = capture.prompt
+        result.timings["fetch"] = time.monotonic() - start
+
+        action = action_cls(client, config)
+        action.tftp = shared_tftp.board(str(action.device_ip))
+        action.run(args)
+        result.timings["action"] = time.monotonic() - start - result.timings["fetch"]
+    except Exception as err:
+        logging.exception("Board '{}' failed".format(board["name"]))
+        result.error = str(err) or type(err).__name__
+    except SystemExit:  # argparse error
+        result.error = "invalid arguments {}".format(board.get("args"))
+    finally:
+        if client is not None:
+            client.s.close()
+    result.timings["total"] = time.monotonic() - start
+    return result
+
+
+# -------------------------------------------------------------------------------------------------
+def check_device_ips(boards, base_config):
+    ips = {}
+    for board in boards:
+        config = copy.deepcopy(base_config)
+        update_config(config, board.get("config", {}))
+        ip = config["net"]["device_ip"]
+        if ip in ips:
+            raise RuntimeError("Boards '{}' and '{}' have the same device IP {}, TFTP can't tell them apart".format(
+                ips[ip], board["name"], ip))
+        ips[ip] = board["name"]
+
+
+def run_fleet(boards, base_config, action_classes, jobs=DEFAULT_JOBS, listen_ip="0.0.0.0",
+        listen_port=utils.TFTP_SERVER_DEFAULT_PORT):
+    """ Run boards' actions concurrently by `jobs` workers, returns list of BoardResult
+    """
+    check_device_ips(boards, base_config)
+    with SharedTftp(listen_ip, listen_port) as shared_tftp:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(run_board, board, base_config, shared_tftp, action_classes) for board in boards]
+            return [f.result() for f in futures]
+
+
+def format_summary(results):
+    lines = ["{:<16} {:<12} {:<6} {:>8} {:>8} {:>8} {:>8}  {}".format(
+        "board", "action", "result", "prompt", "fetch", "action", "total", "error")]
+    for r in results:
+        lines.append("{:<16} {:<12} {:<6} {:>8} {:>8} {:>8} {:>8.1f}  {}".format(
+            r.name, r.action, "ok" if r.ok else "FAIL",
+            *("{:.1f}".format(r.timings[k]) if k in r.timings else "-" for k in ("prompt", "fetch", "action")),
+            r.timings["total"], r.error or ""))
+    ok = sum(r.ok for r in results)
+    lines.append("{} of {} boards succeeded".format(ok, len(results)))
+    return "\n".join(lines)
@@ -0,0 +1,260 @@
+import logging
+import collections
+import time
+from . import utils
+from .ymodem import YModem
+
+# https://www.kermitproject.org/kproto.pdf
+
+
+def tochar(val):
+    return val + 32
+
+
+def unchar(val):
+    return val - 32
+
+
+def block_check(data):
+    """ Type 1 block check of `data` (one printable character)
+    """
+    s = sum(data)
+    return tochar((s + ((s & 0xC0) >> 6)) & 0x3F)
+
+
+class Kermit:
+    MARK = 0x01
+    QCTL = ord("#")
+    EOL = 0x0D
+
+    CAP_LONG_PACKETS = 2
+    CAP_SLIDING_WINDOWS = 4
+
+    SHORT_PACKET_SIZE = 94
+    MAX_PACKET_SIZE = 9024
+    MAX_WINDOW = 31
+    MAX_RETRIES = 10
+
+    # every byte is encoded to 1 or 2 characters: control ones (low 7 bits < 32 or 127) are
+    # prefixed and have their 6th bit flipped, prefix characters are prefixed as is
+    _ENCODING = []
+    for _b in range(256):
+        if (_b & 0x7F) < 32 or (_b & 0x7F) == 127:
+            _ENCODING.append(bytes([QCTL, _b ^ 0x40]))
+        elif (_b & 0x7F) == QCTL:
+            _ENCODING.append(bytes([QCTL, _b]))
+        else:
+            _ENCODING.append(bytes([_b]))
+    del _b
+
+    @classmethod
+    def encode(cls, data):
+        return b"".join(map(cls._ENCODING.__getitem__, data))
+
+    @classmethod
+    def decode(cls, data):
+        res = bytearray()
+        it = iter(data)
+        for b in it:
+            if b == cls.QCTL:
+                b = next(it)
+                if (b & 0x7F) != cls.QCTL:
+                    b ^= 0x40
+            res.append(b)
+        return bytes(res)
+
+    @classmethod
+    def make_packet(cls, seq, ptype, data):
+        """ Build a packet with type 1 block check, long packet format is used if needed
+        """
+        if len(data) + 3 <= cls.SHORT_PACKET_SIZE:
+            head = bytes([tochar(len(data) + 3), tochar(seq), ord(ptype)])
+        else:
+            extlen = len(data) + 1
+            head = bytes([tochar(0), tochar(seq), ord(ptype), tochar(extlen // 95), tochar(extlen % 95)])
+            head += bytes([block_check(head)])
+        body = head + data
+        return bytes([cls.MARK]) + body + bytes([block_check(body), cls.EOL])
+
+    def __init__(self, serial, packet_size=1000, window=1, max_retries=MAX_RETRIES):
+        self.serial = serial
+        self.packet_size = min(packet_size, self.MAX_PACKET_SIZE)
+        self.window = max(1, min(window, self.MAX_WINDOW))
+        self.max_retries = max_retries
+        self.seq = 0
+        self.stat = None
+
+    def read_packet(self):
+        """ Read next packet from receiver, returns (seq, type, data) or None on timeout or corrupted packet
+        """
+        while True:
+            b = self.serial.read(1)
+            if not b:
+                return None
+            if b[0] == self.MARK:
+                break
+
+        head = self.serial.read(3)
+        if len(head) < 3:
+            return None
+        length = unchar(head[0])
+        if length == 0:  # long packet
+            ext = self.serial.read(3)
+            if len(ext) < 3 or block_check(head + ext[:2]) != ext[2]:
+                return None
+            head += ext
+            length = unchar(ext[0]) * 95 + unchar(ext[1])
+        else:
+            length -= 2
+        if length <= 0:
+            return None
+        rest = self.serial.read(length)
+        if len(rest) < length or block_check(head + rest[:-1]) != rest[-1]:
+            return None
+        return unchar(head[1]), chr(head[2]), rest[:-1]
+
+    def _next_seq(self):
+        seq = self.seq
+        self.seq = (self.seq + 1) % 64
+        return seq
+
+    def _send_and_wait(self, ptype, data):
+        """ Send a single packet and wait for its acknowledgement, returns ACK's data
+        """
+        seq = self._next_seq()
+        packet = self.make_packet(seq, ptype, data)
+        for _ in range(self.max_retries):
+            self.serial.write(packet)
+            resp = self.read_packet()
+            if resp is None:
+                continue
+            rseq, rtype, rdata = resp
+            if rtype == "E":
+                raise RuntimeError("Kermit receiver reports error: {}".format(self.decode(rdata)))
+            if rtype == "Y" and rseq == seq:
+                return rdata
+        raise RuntimeError("Could not send Kermit packet {}{} after {} retries".format(ptype, seq, self.max_retries))
+
+    def send_init(self):
+        """ Exchange Send-Init packets and agree on packet size and window
+        Parameters the receiver leaves empty keep our values. U-Boot's `loadb` answers with long packets
+        (up to 9024 bytes) but no sliding windows, so the window is 1 with it and helps other receivers only
+        """
+        params = bytes([
+            tochar(self.SHORT_PACKET_SIZE),  # MAXL
+            tochar(5),  # TIME
+            tochar(0),  # NPAD
+            0x40,  # PADC
+            tochar(self.EOL),  # EOL
+            self.QCTL,  # QCTL
+            ord("Y"),  # QBIN: agree to 8th bit prefixing but don't ask for it
+            ord("1"),  # CHKT
+            ord(" "),  # REPT: no repeat counts
+            tochar(self.CAP_LONG_PACKETS | self.CAP_SLIDING_WINDOWS),  # CAPAS
+            tochar(self.window),  # WINDO
+            tochar(self.packet_size // 95),  # MAXLX1
+            tochar(self.packet_size % 95),  # MAXLX2
+        ])
+        ack = self._send_and_wait("S", params)
+
+        if len(ack) > 9:
+            capas = unchar(ack[9])
+            if not capas & self.CAP_SLIDING_WINDOWS:
+                self.window = 1
+            elif len(ack) > 10:
+                self.window = max(1, min(self.window, unchar(ack[10])))
+            if not capas & self.CAP_LONG_PACKETS:
+                self.packet_size = min(self.packet_size, unchar(ack[0]))
+            elif len(ack) > 12:
+                self.packet_size = min(self.packet_size, unchar(ack[11]) * 95 + unchar(ack[12]))
+        elif ack:
+            self.packet_size = min(self.packet_size, unchar(ack[0]))
+            self.window = 1
+
+        logging.debug("Kermit packet size {}, window {}".format(self.packet_size, self.window))
+
+    def _chunks(self, data):
+        """ Generate (raw size, encoded data) pairs each fitting into a packet
+        """
+        # packet length counts SEQ, TYPE, check, and the extended header for long packets
+        limit = self.packet_size - (3 if self.packet_size <= self.SHORT_PACKET_SIZE else 6)
+        offset = 0
+        while offset < len(data):
+            size = min(limit, len(data) - offset)
+            encoded = self.encode(data[offset:offset + size])
+            if len(encoded) > limit:
+                # every dropped byte shortens encoded data at least by one and is encoded
+                # to two characters at most, so both sizes below fit into the limit
+                size = max(size - (len(encoded) - limit), limit // 2)
+                encoded = self.encode(data[offset:offset + size])
+            yield size, encoded
+            offset += size
+
+    def send_data(self, data):
+        """ Send data packets keeping up to `window` of them unacknowledged
+        """
+        outstanding = collections.OrderedDict()  # seq -> [packet, raw size, retries]
+        chunks = self._chunks(data)
+        exhausted = False
+
+        while True:
+            while not exhausted and len(outstanding) < self.window:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                seq = self._next_seq()
+                packet = self.make_packet(seq, "D", chunk[1])
+                outstanding[seq] = [packet, chunk[0], 0]
+                self.serial.write(packet)
+
+            if not outstanding:
+                break
+
+            resp = self.read_packet()
+            if resp is None:  # timeout: resend the oldest packet
+                seq, entry = next(iter(outstanding.items()))
+                self._resend(seq, entry)
+                continue
+
+            rseq, rtype, rdata = resp
+            if rtype == "E":
+                raise RuntimeError("Kermit receiver reports error: {}".format(self.decode(rdata)))
+            entry = outstanding.get(rseq)
+            if entry is None:
+                continue
+            if rtype == "Y":
+                del outstanding[rseq]
+                if self.stat is not None:
+                    self.stat.on_sent(entry[1])
+            elif rtype == "N":
+                self._resend(rseq, entry)
+
+    def _resend(self, seq, entry):
+        entry[2] += 1
+        if entry[2] > self.max_retries:
+            raise RuntimeError("Could not send Kermit packet D{} after {} retries".format(seq, self.max_retries))
+        logging.debug("Resend Kermit packet D{}...".format(seq))
+        self.serial.write(entry[0])
+
+    def transmit(self, src, file_path="data"):
+        """ Transmit `src` (bytes-like object, file path or binary file object)
+        """
+        with utils.open_buffer(src) as data:
+            self._transmit(data, file_path)
+
+    def _transmit(self, data, file_path):
+        logging.info("Kermit starts transmission...")
+        start = time.monotonic()
+        self.seq = 0
+        self.send_init()
+        self._send_and_wait("F", self.encode(file_path.encode("ascii")))
+
+        self.stat = YModem.Stat(len(data))
+        self.send_data(data)
+        self.stat = None
+
+        self._send_and_wait("Z", b"")
+        self._send_and_wait("B", b"")
+        logging.info("Kermit all {} bytes of data has been transmitted in {:.1f}s".format(
+            len(data), time.monotonic() - start))
@@ -0,0 +1,119 @@
+import logging
+import os
+from . import utils
+from . import uimage
+
+# Placement of everything `boot` puts into device's RAM: images, U-Boot's relocated region, the area
+# `bootm` unpacks the kernel into and scratch areas of compressed uploads. Regions never overlap.
+
+
+# -------------------------------------------------------------------------------------------------
+class Region:
+    def __init__(self, name, addr, size, kind):
+        self.name = name
+        self.addr = addr
+        self.size = size
+        self.kind = kind  # "image", "reserved", "load" (kernel is unpacked there), "scratch"
+
+    @property
+    def end(self):
+        return self.addr + self.size
+
+
+class Layout:
+    """ Regions in device's RAM, free space is looked for in [start, end)
+    """
+    def __init__(self, start, end, alignment):
+        self.start = start
+        self.end = end
+        self.alignment = alignment
+        self.regions = []
+
+    @property
+    def busy(self):
+        return [(r.addr, r.size) for r in self.regions]
+
+    def __getitem__(self, name):
+        for r in self.regions:
+            if r.name == name:
+                return r
+        raise KeyError(name)
+
+    def add(self, name, addr, size, kind="image"):
+        """ Add region at fixed address, raises RuntimeError if it overlaps another one
+        """
+        for r in self.regions:
+            if utils.regions_overlap(addr, size, r.addr, r.size):
+                raise RuntimeError("{} [{:#x}, {:#x}) overlaps {} [{:#x}, {:#x})".format(
+                    name, addr, addr + size, r.name, r.addr, r.end))
+        region = Region(name, addr, size, kind)
+        self.regions.append(region)
+        return region
+
+    def place(self, name, size, kind="image"):
+        """ Add region at the highest free aligned address
+        """
+        addr = utils.find_free_region(size, self.busy, self.start, self.end, self.alignment)
+        return self.add(name, addr, size, kind)
+
+    def remove(self, region):
+        self.regions.remove(region)
+
+    def is_free(self, addr, size):
+        return self.start <= addr and addr + size <= self.end and \
+            not any(utils.regions_overlap(addr, size, r.addr, r.size) for r in self.regions)
+
+    def format_map(self):
+        lines = ["RAM map [{:#x}, {:#x}):".format(self.start, self.end)]
+        for r in sorted(self.regions, key=lambda r: r.addr):
+            lines.append("  {:#010x} - {:#010x} {:>10}  {:<8} {}".format(r.addr, r.end, r.size, r.kind, r.name))
+        return "\n".join(lines)
+
+
+# -------------------------------------------------------------------------------------------------
+def plan_boot(start, linux_size, alignment, uboot_size, kernel, image, rootfs_size, dtb=None, upload_addr=None):
+    """ Layout for booting `kernel` file (parsed by `uimage.inspect` into `image`) with initrd of `rootfs_size`
+    and optional `dtb` file within Linux RAM [start, start + linux_size).
+    U-Boot's relocated code, stack and heap take `uboot_size` at the top. Uncompressed kernel is placed so that
+    its payload is right at the load address and `bootm` doesn't move it (XIP), otherwise the region
+    `bootm` unpacks it into is kept free. With `upload_addr` kernel and rootfs go one after another from there
+    """
+    layout = Layout(start, start + linux_size, alignment)
+    if uboot_size:
+        layout.add("U-Boot", layout.end - uboot_size, uboot_size, kind="reserved")
+
+    info = image.kernel
+    kernel_size = os.path.getsize(kernel)
+    xip_addr = None if info.load is None else info.load - info.data_offset
+    if upload_addr is not None:
+        kernel_addr = utils.align_address_up(alignment, upload_addr)
+        if kernel_addr != xip_addr:
+            reserve_load_region(layout, kernel, info)
+        layout.add("kernel", kernel_addr, kernel_size)
+        rootfs_addr = utils.align_address_up(alignment, kernel_addr + kernel_size)
+        if rootfs_addr + rootfs_size > layout.end:
+            raise RuntimeError("RootFS at {:#x} doesn't fit Linux RAM".format(rootfs_addr))
+        layout.add("rootfs", rootfs_addr, rootfs_size)
+    else:
+        if info.compression == "none" and xip_addr is not None and layout.is_free(xip_addr, kernel_size):
+            layout.add("kernel", xip_addr, kernel_size)
+        else:
+            reserve_load_region(layout, kernel, info)
+        layout.place("rootfs", rootfs_size)
+        if not any(r.name == "kernel" for r in layout.regions):
+            layout.place("kernel", kernel_size)
+
+    if dtb is not None:
+        layout.place("dtb", os.path.getsize(dtb))
+    return layout
+
+
+def reserve_load_region(layout, kernel, info):
+    """ Keep free the region `bootm` copies or unpacks kernel's payload into
+    """
+    if info.load is None:
+        return
+    size = uimage.load_size(kernel, info)
+    logging.info("Kernel is {} by 'bootm' into [{:#x}, {:#x})".format(
+        "copied" if info.compression == "none" else "unpacked", info.load, info.load + size))
+    layout.add("kernel payload", info.load, size, kind="load")
@@ -0,0 +1,139 @@
+import array
+import contextlib
+import logging
+import time
+import zlib
+
+
+# -------------------------------------------------------------------------------------------------
+BYTES_PER_LINE = 16  # U-Boot's `md` prints 16 bytes per line whatever item width is
+TUNE_WIDTHS = (4, 2, 1)
+TUNE_BATCH_SIZES = (4 << 10, 16 << 10, 64 << 10)
+MAX_RETRIES = 3
+
+_ARRAY_TYPECODES = {2: "H", 4: "I", 8: "Q"}
+
+
+# -------------------------------------------------------------------------------------------------
+def parse_md_lines(lines, addr, size, width, big_endian=False):
+    """ Decode `md` output lines "<addr>: <items...>    <ascii>" into `size` bytes starting from `addr`
+    Hex parts of all lines are decoded at once, items wider than a byte are swapped to memory byte order
+    """
+    hex_parts = []
+    expected_addr = addr
+    for line in lines:
+        line_addr, sep, rest = line.partition(":")
+        if not sep:
+            continue  # not a dump line
+        if int(line_addr, 16) != expected_addr:
+            raise ValueError("Unexpected 'md' line address {}, {:#x} is expected".format(line_addr, expected_addr))
+        end = rest.find("    ")  # ascii part is separated by 4 spaces
+        hex_parts.append(rest if end < 0 else rest[:end])
+        expected_addr += BYTES_PER_LINE
+
+    data = bytes.fromhex("".join(hex_parts))
+    if len(data) != size:
+        raise ValueError("{} bytes are decoded from 'md' output, {} are expected".format(len(data), size))
+
+    if width > 1 and not big_endian:
+        items = array.array(_ARRAY_TYPECODES[width], data)
+        items.byteswap()
+        data = items.tobytes()
+    return data
+
+
+# -------------------------------------------------------------------------------------------------
+class MdDownloader:
+    """ Download device's memory region into a file by parsing `md` output, batch by batch
+    """
+    def __init__(self, u_boot_client, fobj, addr, size, verify=True, big_endian=False):
+        self.client = u_boot_client
+        self.fobj = fobj
+        self.addr = addr
+        self.size = size
+        self.verify = verify
+        self.big_endian = big_endian
+        self.offset = 0
+        self.start = fobj.tell()  # region is written from the current position of `fobj`
+
+    @property
+    def done(self):
+        return self.offset >= self.size
+
+    def read(self, addr, size, width):
+        for _ in range(MAX_RETRIES):
+            lines = list(self.client.md(addr, size // width, width))  # consume whole output anyway
+            try:
+                data = parse_md_lines(lines, addr, size, width, big_endian=self.big_endian)
+            except ValueError as err:
+                logging.warning("Retry to read {} bytes from {:#x}: {}".format(size, addr, err))
+                continue
+            if self.verify and self.client.crc32(addr, size) != zlib.crc32(data):
+                logging.warning("Retry to read {} bytes from {:#x}: CRC32 mismatch".format(size, addr))
+                continue
+            return data
+        raise RuntimeError("Could not read {} bytes from {:#x} via 'md'".format(size, addr))
+
+    def transfer(self, width, batch_size):
+        """ Transfer next batch, returns achieved bytes per second
+        """
+        size = min(batch_size, self.size - self.offset)
+        if (self.addr + self.offset) % width:
+            width = 1
+        elif size % width:
+            size -= size % width
+            if size == 0:  # tail
+                width, size = 1, self.size - self.offset
+
+        start = time.monotonic()
+        data = self.read(self.addr + self.offset, size, width)
+        self.fobj.seek(self.start + self.offset)
+        self.fobj.write(data)
+        self.offset += size
+        rate = size / (time.monotonic() - start)
+        logging.debug("Read {} bytes via 'md.{}' at {:.0f} bytes/s ({} of {})".format(
+            size, width, rate, self.offset, self.size))
+        return rate
+
+    def tune(self, widths, batch_sizes):
+        """ Pick item width and batch size giving the best measured throughput
+        Transferred batches are not wasted, they are the beginning of the region
+        """
+        width = widths[0]
+        if len(widths) > 1:
+            rates = {w: self.transfer(w, min(batch_sizes)) for w in widths if not self.done}
+            width = max(rates, key=rates.get) if rates else width
+
+        batch_size = batch_sizes[0]
+        if len(batch_sizes) > 1:
+            rates = {b: self.transfer(width, b) for b in batch_sizes if not self.done}
+            batch_size = max(rates, key=rates.get) if rates else batch_size
+
+        logging.info("Use 'md' item width {} and batch size {}".format(width, batch_size))
+        return width, batch_size
+
+    def run(self, width=None, batch_size=None):
+        start = time.monotonic()
+        widths = TUNE_WIDTHS if width is None else (width,)
+        batch_sizes = TUNE_BATCH_SIZES if batch_size is None else (batch_size,)
+        head = min(-self.addr % max(widths), self.size)
+        if head:  # unaligned head goes byte by byte to align further batches
+            self.transfer(1, head)
+        width, batch_size = self.tune(widths, batch_sizes)
+        while not self.done:
+            self.transfer(width, batch_size)
+        elapsed = time.monotonic() - start
+        logging.info("{} bytes are read via 'md' in {:.1f}s ({:.0f} bytes/s)".format(
+            self.size, elapsed, self.size / elapsed if elapsed else 0))
+
+
+# -------------------------------------------------------------------------------------------------
+def download_files_via_md(u_boot_client, files_addrs_sizes, width=None, batch_size=None, verify=True):
+    """ Download device's memory regions into files (paths or binary file objects written
+    from their current position) via serial console only
+    """
+    for dst, addr, size in files_addrs_sizes:
+        logging.info("Download {} bytes from {:#x} to '{}' via 'md'".format(size, addr, getattr(dst, "name", dst)))
+        with contextlib.ExitStack() as stack:
+            f = dst if hasattr(dst, "write") else stack.enter_context(open(dst, "wb"))
+            MdDownloader(u_boot_client, f, addr, size, verify=verify).run(width=width, batch_size=batch_size)
@@ -1,40 +1,60 @@
-from telnetlib import Telnet
+from .transport import TcpTransport
 
+# Serial port over telnet (like ser2net's telnet mode): raw TCP transport with telnet commands stripped.
+# Telnet options are refused like telnetlib does by default: DO -> WONT, WILL -> DONT.
 
-class SerialOverTelnet:
-    def __str__(self):
-        return f"SerialOverTelnet({self.host}:{self.port})"
 
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+
+class SerialOverTelnet(TcpTransport):
     def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.conn = Telnet(host=self.host, port=self.port)
-        self._timeout = None
-        self._buff = None
-
-    def readline(self):
-        return self.conn.read_until(b"\n", timeout=self._timeout)
-
-    def read(self, size):  # TODO: do the same but better!
-        data = b""
-        while len(data) < size:
-            if not self._buff:
-                self._buff = self.conn.read_some()
-            chunk_size = min(size - len(data), len(self._buff))
-            data = data + self._buff[:chunk_size]
-            self._buff = self._buff[chunk_size:]
-        return data
-
-    def write(self, data):
-        self.conn.write(data)
-
-    def reset_input_buffer(self):
-        self.conn.read_very_eager()  # drop all read data
-
-    @property
-    def timeout(self):
-        return self._timeout
-
-    @timeout.setter
-    def timeout(self, timeout):
-        self._timeout = timeout
+        super().__init__(host, port)
+        self._pending = b""  # incomplete telnet command at the end of the last chunk
+
+    def _received(self, size):
+        if self._pending or self._chunk.find(IAC, 0, size) != -1:
+            self._feed(self._pending + bytes(self._chunk[:size]))
+        else:
+            super()._received(size)
+
+    def _encode(self, data):
+        return data.replace(b"\xff", b"\xff\xff")
+
+    def _feed(self, data):
+        """ Append `data` to the receive buffer, telnet commands are handled and stripped
+        """
+        self._pending = b""
+        pos = 0
+        while True:
+            start = data.find(IAC, pos)
+            if start == -1:
+                self._rx += data[pos:]
+                return
+            self._rx += data[pos:start]
+            if start + 1 == len(data):
+                break
+            cmd = data[start + 1]
+            if cmd == IAC:  # escaped 0xff
+                self._rx.append(IAC)
+                pos = start + 2
+            elif cmd in (DO, DONT, WILL, WONT):
+                if start + 2 == len(data):
+                    break
+                if cmd in (DO, WILL):  # sent before the next read
+                    self._tx += bytes((IAC, WONT if cmd == DO else DONT, data[start + 2]))
+                pos = start + 3
+            elif cmd == SB:
+                end = data.find(bytes((IAC, SE)), start + 2)
+                if end == -1:
+                    break
+                pos = end + 2
+            else:
+                pos = start + 2
+        self._pending = data[start:]
@@ -0,0 +1,696 @@
+import argparse
+import binascii
+import io
+import logging
+import os
+import random
+import re
+import select
+import signal
+import socket
+import struct
+import time
+import zlib
+from . import tftp
+from . import utils
+
+# Simulated U-Boot device to run hiburn against without hardware:
+#   python3 -m hiburn.simulator --tcp 2323    then    hiburn_app.py --serial-url tcp://localhost:2323 ...
+#   python3 -m hiburn.simulator --pty         then    hiburn_app.py --serial /dev/pts/N ...
+# The device is running its firmware from the start; SIGUSR1 or `reset` command reboots it, e.g.
+#   hiburn_app.py --reset-cmd "kill -USR1 $(cat sim.pid)" ...    with    --pid-file sim.pid
+# Device's state survives clients' reconnections, RAM is lost on reboot, SPI flash persists.
+# `tftp` is a real TFTP client against `serverip`.
+
+
+DEFAULT_PROMPT = "hisilicon # "
+DEFAULT_ENV = {
+    "bootdelay": "1",
+    "baudrate": "115200",
+    "ipaddr": "192.168.1.10",
+    "serverip": "192.168.1.2",
+    "netmask": "255.255.255.0",
+    "ethaddr": "00:00:23:34:45:66",
+    "bootcmd": "sf probe 0; sf read 0x82000000 0x100000 0x400000; bootm 0x82000000",
+    "bootargs": "mem=64M console=ttyAMA0,115200",
+}
+RAM_BASE = 0x80000000
+RAM_SIZE = 256 << 20
+FLASH_SIZE = 16 << 20
+FLASH_SECTOR_SIZE = 64 << 10
+PAGE_SIZE = 64 << 10
+COMMAND_LINE_LIMIT = 255  # CONFIG_SYS_CBSIZE - 1
+MD_DEFAULT_COUNT = 0x40
+YMODEM_TIMEOUT = 1.0
+YMODEM_MAX_RETRIES = 10
+
+SOH, STX, EOT, ACK, NAK, CAN, ESC = 0x01, 0x02, 0x04, 0x06, 0x15, 0x18, 0x1b
+CTRL_C = 0x03
+UIMAGE_MAGIC = 0x27051956
+UIMAGE_HEADER = struct.Struct(">IIIIIIIBBBB32s")
+
+
+class SimulatorError(RuntimeError):
+    """ Command failure, its message is printed to the console
+    """
+
+
+class _Reset(Exception):
+    pass
+
+
+def parse_number(val):
+    """ U-Boot parses numbers as hexadecimal ones with or without 0x prefix
+    """
+    try:
+        return int(val, 16)
+    except ValueError:
+        raise SimulatorError("Invalid number '{}'".format(val))
+
+
+# -------------------------------------------------------------------------------------------------
+class SparseMemory:
+    """ Memory of `size` bytes at `base`, pages are allocated on the first write
+    """
+    def __init__(self, base, size, fill=0):
+        self.base = base
+        self.size = size
+        self.fill = fill
+        self.pages = {}  # page number -> bytearray
+
+    def _check(self, addr, size):
+        if addr < self.base or addr + size > self.base + self.size:
+            raise SimulatorError("Address range {:#x}..{:#x} is out of {:#x}..{:#x}".format(
+                addr, addr + size, self.base, self.base + self.size))
+
+    def _chunks(self, addr, size):
+        """ Yield (page number, offset in page, offset in data, chunk size)
+        """
+        offset = 0
+        while offset < size:
+            num, page_offset = divmod(addr - self.base + offset, PAGE_SIZE)
+            chunk = min(PAGE_SIZE - page_offset, size - offset)
+            yield num, page_offset, offset, chunk
+            offset += chunk
+
+    def read(self, addr, size):
+        self._check(addr, size)
+        out = bytearray(size)
+        for num, page_offset, offset, chunk in self._chunks(addr, size):
+            page = self.pages.get(num)
+            if page is None:
+                out[offset:offset + chunk] = bytes([self.fill]) * chunk
+            else:
+                out[offset:offset + chunk] = page[page_offset:page_offset + chunk]
+        return bytes(out)
+
+    def write(self, addr, data, program=False):
+        """ Write `data`, with `program` bits are only cleared like NOR flash does
+        """
+        self._check(addr, len(data))
+        view = memoryview(data)
+        for num, page_offset, offset, chunk in self._chunks(addr, len(data)):
+            page = self.pages.get(num)
+            if page is None:
+                page = self.pages[num] = bytearray([self.fill]) * PAGE_SIZE
+            if program:
+                old = int.from_bytes(page[page_offset:page_offset + chunk], "little")
+                new = int.from_bytes(view[offset:offset + chunk], "little")
+                page[page_offset:page_offset + chunk] = (old & new).to_bytes(chunk, "little")
+            else:
+                page[page_offset:page_offset + chunk] = view[offset:offset + chunk]
+
+    def erase(self, addr, size):
+        self._check(addr, size)
+        for num, page_offset, _, chunk in self._chunks(addr, size):
+            if chunk == PAGE_SIZE:
+                self.pages.pop(num, None)
+            elif num in self.pages:
+                self.pages[num][page_offset:page_offset + chunk] = bytes([self.fill]) * chunk
+
+
+# -------------------------------------------------------------------------------------------------
+class UBootSimulator:
+    """ U-Boot console on file descriptor `fd` (pty master or socket)
+    `baudrate` - output is throttled to that line speed (None - no throttling),
+    `latency` - delay before each command line is executed, `error_rate` - probability of
+    a byte received during `loady` to be corrupted, `tftp_port` - port of host's TFTP server,
+    `bind_device_ip` - TFTP transfers are made from `ipaddr` (it must be a local address)
+    """
+    def __init__(self, fd, prompt=DEFAULT_PROMPT, env=None, baudrate=115200, latency=0.0, error_rate=0.0,
+            tftp_port=utils.TFTP_SERVER_DEFAULT_PORT, bind_device_ip=False, ram_size=RAM_SIZE, flash=None,
+            seed=None):
+        self.fd = fd
+        self.prompt = prompt
+        self.default_env = dict(DEFAULT_ENV if env is None else env)
+        self.baudrate = baudrate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tftp_port = tftp_port
+        self.bind_device_ip = bind_device_ip
+        self.ram_size = ram_size
+        self.flash = SparseMemory(0, FLASH_SIZE, fill=0xff) if flash is None else flash
+        self.rng = random.Random(seed)
+        self.reset_requested = False
+        self.state = "off"  # "console" - U-Boot's prompt, "kernel" - booted, the console is ignored
+        self._input = bytearray()
+        self._binary = False  # received data is corrupted by `error_rate` in binary transfers
+
+    def _power_on(self):
+        self.env = dict(self.default_env)
+        self.ram = SparseMemory(RAM_BASE, self.ram_size)
+        self.flash_probed = False
+        self.booted = False
+
+    # ---------------------------------------------------------------------------------------------
+    def _recv(self, timeout):
+        """ Receive available data into the input buffer, returns False on timeout
+        """
+        if self.reset_requested:
+            self.reset_requested = False
+            raise _Reset()
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except InterruptedError:
+            return False
+        if not ready:
+            return False
+        data = os.read(self.fd, 4096)
+        if not data:
+            raise EOFError("Console is closed")
+        if self._binary and self.error_rate:
+            data = bytes(b ^ 0x5a if self.rng.random() < self.error_rate else b for b in data)
+        self._input += data
+        return True
+
+    def _getc(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._input:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self._recv(0.1 if remaining is None else min(remaining, 0.1))
+        char = self._input[0]
+        del self._input[0]
+        return char
+
+    def _read_exact(self, size, timeout):
+        deadline = time.monotonic() + timeout
+        while len(self._input) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._recv(min(remaining, 0.1))
+        data = bytes(self._input[:size])
+        del self._input[:size]
+        return data
+
+    def _send(self, data):
+        if isinstance(data, str):
+            data = data.encode("ascii")
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+        if self.baudrate:
+            time.sleep(len(data) * 10 / self.baudrate)
+
+    def _print(self, *lines):
+        self._send("".join(line + "\r\n" for line in lines))
+
+    # ---------------------------------------------------------------------------------------------
+    def run(self):
+        """ Serve the console till the connection is closed, the device boots if it is powered off
+        """
+        while True:
+            try:
+                if self.state == "off":
+                    self._power_on()
+                    self.state = "console" if self._boot() else "kernel"
+                elif self.state == "console":
+                    self._console()
+                    self.state = "kernel"
+                else:
+                    self._kernel()
+            except _Reset:
+                self.state = "off"
+            except (EOFError, OSError) as err:
+                logging.info("Console is disconnected: {}".format(err))
+                return
+
+    def _boot(self):
+        """ Print banner and count autoboot down, returns True if it is interrupted
+        """
+        self._input.clear()
+        self._print("", "", "U-Boot 2010.06 (hiburn simulator)", "", "DRAM:  {} MiB".format(self.ram_size >> 20),
+            "SF: Detected simulated flash with page size 256 Bytes, erase size 64 KiB, total 16 MiB", "")
+        delay = int(self.env.get("bootdelay", "0"))
+        self._send("Hit any key to stop autoboot: {:2d} ".format(delay))
+        for left in range(delay, -1, -1):
+            if self._getc(timeout=(1.0 if left else 0.01)) is not None:
+                self._send("\b\b\b 0 \r\n")
+                return True
+            if left:
+                self._send("\b\b\b{:2d} ".format(left - 1))
+        self._send("\r\n")
+        self.run_line(self.env.get("bootcmd", ""))
+        return not self.booted
+
+    def _kernel(self):
+        """ Kernel is "running", the console is ignored till reset
+        """
+        while True:
+            self._getc()
+
+    def _console(self):
+        self._send(self.prompt)
+        line = bytearray()
+        prev = None
+        while True:
+            char = self._getc()
+            if char == CTRL_C:
+                self._send("<INTERRUPT>\r\n" + self.prompt)
+                line.clear()
+            elif char in b"\r\n":
+                if char == ord("\n") and prev == ord("\r"):
+                    pass
+                else:
+                    self._send("\r\n")
+                    self.run_line(line.decode("ascii", errors="replace"))
+                    if self.booted:
+                        return
+                    self._send(self.prompt)
+                    line.clear()
+            elif char in (0x08, 0x7f):
+                if line:
+                    line.pop()
+                    self._send("\b \b")
+            elif 0x20 <= char < 0x7f and len(line) < COMMAND_LINE_LIMIT:
+                line.append(char)
+                self._send(bytes([char]))
+            prev = char
+
+    # ---------------------------------------------------------------------------------------------
+    def run_line(self, line):
+        """ Execute `;`-separated commands of the line, `\\;` is a literal semicolon
+        """
+        self.booted = False
+        if self.latency:
+            time.sleep(self.latency)
+        for cmd in re.split(r"(?<!\\);", line):
+            args = [arg.replace("\\;", ";") for arg in cmd.split()]
+            if not args:
+                continue
+            name, _, suffix = args[0].partition(".")
+            handler = getattr(self, "cmd_" + name, None)
+            if handler is None:
+                self._print("Unknown command '{}' - try 'help'".format(args[0]))
+                continue
+            try:
+                handler(suffix, *args[1:])
+            except SimulatorError as err:
+                self._print(*str(err).split("\n"))
+            except (TypeError, ValueError, KeyError):
+                logging.debug("Command '{}' failed".format(cmd), exc_info=True)
+                self._print("Usage: {} ...".format(name))
+            if self.booted:
+                return
+
+    def _env_required(self, *names):
+        for name in names:
+            if name not in self.env:
+                raise SimulatorError("*** ERROR: `{}' not set".format(name))
+
+    # U-Boot commands are below, `suffix` is the part after dot like in `md.b`
+    def cmd_help(self, suffix, name=None):
+        if name is None:
+            self._print(*sorted(attr[4:] for attr in dir(self) if attr.startswith("cmd_")))
+        elif hasattr(self, "cmd_" + name):
+            self._print("{} - simulated command".format(name))
+        else:
+            self._print("Unknown command '{}' - try 'help' without arguments for list of all known commands".format(
+                name))
+
+    def cmd_echo(self, suffix, *args):
+        self._print(" ".join(args))
+
+    def cmd_printenv(self, suffix, *names):
+        for name in names or self.env:
+            if name in self.env:
+                self._print("{}={}".format(name, self.env[name]))
+            else:
+                self._print("## Error: \"{}\" not defined".format(name))
+        if not names:
+            size = sum(len(k) + len(v) + 2 for k, v in self.env.items())
+            self._print("", "Environment size: {}/65532 bytes".format(size))
+
+    def cmd_setenv(self, suffix, name, *value):
+        if value:
+            self.env[name] = " ".join(value)
+        else:
+            self.env.pop(name, None)
+
+    def cmd_saveenv(self, suffix):
+        self._print("Saving Environment to SPI Flash...", "done")
+
+    def cmd_reset(self, suffix):
+        self._print("resetting ...")
+        raise _Reset()
+
+    def cmd_ping(self, suffix, addr):
+        self._env_required("ipaddr")
+        self._print("Using eth0 device", "host {} is alive".format(addr))
+
+    def cmd_tftp(self, suffix, addr, name, size=None):
+        self._env_required("ipaddr", "serverip")
+        addr = parse_number(addr)
+        options = {}
+        for env, option in (("tftpblocksize", "blksize"), ("tftpwindowsize", "windowsize")):
+            if self.env.get(env):
+                options[option] = self.env[env]
+        client = tftp.TftpClient(self.env["serverip"], self.tftp_port, options=options, dally=False,
+            local_ip=(self.env["ipaddr"] if self.bind_device_ip else ""))
+
+        self._print("Using eth0 device")
+        start = time.monotonic()
+        try:
+            if size is None:
+                self._print("TFTP from server {}; our IP address is {}".format(self.env["serverip"], self.env["ipaddr"]),
+                    "Filename '{}'.".format(name), "Load address: {:#x}".format(addr))
+                fobj = io.BytesIO()
+                client.download(name, fobj)
+                data = fobj.getvalue()
+                self.ram.write(addr, data)
+                self.env["filesize"] = "{:x}".format(len(data))
+            else:
+                size = parse_number(size)
+                self._print("TFTP to server {}; our IP address is {}".format(self.env["serverip"], self.env["ipaddr"]),
+                    "Filename '{}'.".format(name), "Save address: {:#x}".format(addr),
+                    "Save size:    {:#x}".format(size))
+                data = self.ram.read(addr, size)
+                client.upload(name, io.BytesIO(data))
+        except tftp.TftpError as err:
+            raise SimulatorError("TFTP error: {}".format(err))
+        except OSError as err:
+            raise SimulatorError("Retry count exceeded; starting again ({})".format(err))
+        elapsed = max(time.monotonic() - start, 1e-6)
+        self._print("Loading: " + "#" * min(65, len(data) // (10 << 10) + 1),
+            "\t {:.1f} KiB/s".format(len(data) / elapsed / 1024), "done",
+            "Bytes transferred = {} ({:x} hex)".format(len(data), len(data)))
+
+    def cmd_crc32(self, suffix, addr, size):
+        addr, size = parse_number(addr), parse_number(size)
+        crc = zlib.crc32(self.ram.read(addr, size))
+        self._print("CRC32 for {:08x} ... {:08x} ==> {:08x}".format(addr, addr + size - 1, crc))
+
+    def cmd_md(self, suffix, addr, count=None):
+        width = {"b": 1, "w": 2, "l": 4, "q": 8, "": 4}.get(suffix)
+        if width is None:
+            raise SimulatorError("Unknown size suffix '.{}'".format(suffix))
+        addr = parse_number(addr)
+        count = MD_DEFAULT_COUNT if count is None else parse_number(count)
+        data = self.ram.read(addr, count * width)
+        lines = []
+        for offset in range(0, len(data), 16):
+            chunk = data[offset:offset + 16]
+            items = [int.from_bytes(chunk[i:i + width], "little") for i in range(0, len(chunk), width)]
+            hex_part = " ".join("{:0{}x}".format(item, width * 2) for item in items)
+            ascii_part = "".join(chr(b) if 32 <= b < 127 else "." for b in chunk)
+            lines.append("{:08x}: {:<{}}    {}".format(addr + offset, hex_part,
+                (16 // width) * (width * 2 + 1) - 1, ascii_part))
+        self._print(*lines)
+
+    def cmd_cp(self, suffix, src, dst, count):
+        width = {"b": 1, "w": 2, "l": 4, "q": 8, "": 4}[suffix]
+        size = parse_number(count) * width
+        self.ram.write(parse_number(dst), self.ram.read(parse_number(src), size))
+
+    def _decompress(self, decompressor, src, dst, size):
+        src, dst = parse_number(src), parse_number(dst)
+        limit = None if size is None else parse_number(size)
+        out = bytearray()
+        offset = 0
+        try:
+            while not decompressor.eof:
+                chunk = self.ram.read(src + offset, min(PAGE_SIZE, self.ram.base + self.ram.size - src - offset))
+                if not chunk:
+                    break
+                out += decompressor.decompress(chunk)
+                offset += len(chunk)
+        except (zlib.error, ValueError, EOFError) as err:
+            raise SimulatorError("Error: decompression failed ({})".format(err))
+        if limit is not None:
+            out = out[:limit]
+        self.ram.write(dst, out)
+        self._print("Uncompressed size: {} = {:#X}".format(len(out), len(out)))
+
+    def cmd_unzip(self, suffix, src, dst, size=None):
+        self._decompress(zlib.decompressobj(16 + zlib.MAX_WBITS), src, dst, size)
+
+    def cmd_lzmadec(self, suffix, src, dst, size=None):
+        import lzma
+        self._decompress(lzma.LZMADecompressor(format=lzma.FORMAT_ALONE), src, dst, size)
+
+    def cmd_sf(self, suffix, subcmd, *args):
+        if subcmd == "probe":
+            self.flash_probed = True
+            self._print("SF: Detected simulated flash with page size 256 Bytes, erase size 64 KiB, total 16 MiB")
+            return
+        if not self.flash_probed:
+            raise SimulatorError("No SPI flash selected. Please run `sf probe'")
+
+        # like U-Boot 2010.06 `read`, `write` and `erase` print nothing on success
+        if subcmd in ("read", "write", "update"):
+            addr, offset, size = (parse_number(arg) for arg in args)
+            if subcmd == "read":
+                self.ram.write(addr, self.flash.read(offset, size))
+            elif subcmd == "write":
+                self.flash.write(offset, self.ram.read(addr, size), program=True)
+            else:
+                self._sf_update(addr, offset, size)
+        elif subcmd == "erase":
+            offset, size = args
+            offset = parse_number(offset)
+            if size.startswith("+"):  # round length up to the erase size
+                size = -(-parse_number(size[1:]) // FLASH_SECTOR_SIZE) * FLASH_SECTOR_SIZE
+            else:
+                size = parse_number(size)
+            if offset % FLASH_SECTOR_SIZE or size % FLASH_SECTOR_SIZE:
+                raise SimulatorError("SF: Erase offset/length not multiple of erase size\nSPI flash erase failed")
+            self.flash.erase(offset, size)
+        else:
+            raise SimulatorError("Usage: sf probe|read|write|erase|update ...")
+
+    def _sf_update(self, addr, offset, size):
+        """ Erase and write only sectors which differ, like U-Boot's `sf update`
+        """
+        start = time.monotonic()
+        written = skipped = 0
+        for pos in range(0, size, FLASH_SECTOR_SIZE):
+            chunk = min(FLASH_SECTOR_SIZE, size - pos)
+            data = self.ram.read(addr + pos, chunk)
+            if self.flash.read(offset + pos, chunk) == data:
+                skipped += chunk
+                continue
+            sector = offset + pos - (offset + pos) % FLASH_SECTOR_SIZE
+            keep = self.flash.read(sector, FLASH_SECTOR_SIZE)
+            self.flash.erase(sector, FLASH_SECTOR_SIZE)
+            merged = bytearray(keep)
+            merged[offset + pos - sector:offset + pos - sector + chunk] = data
+            self.flash.write(sector, merged, program=True)
+            written += chunk
+        elapsed = time.monotonic() - start
+        self._print("{} bytes written, {} bytes skipped in {:.1f}s, speed {} B/s".format(
+            written, skipped, elapsed, int(size / max(elapsed, 1e-3))))
+
+    def cmd_loady(self, suffix, addr=None, baudrate=None):
+        addr = parse_number(addr if addr is not None else self.env.get("loadaddr", "82000000"))
+        console_baudrate = self.baudrate
+        if baudrate is not None and int(baudrate) != console_baudrate:
+            self._print("## Switch baudrate to {} bps and press ENTER ...".format(baudrate))
+            self.baudrate = int(baudrate)
+            while self._getc() != ord("\r"):
+                pass
+        self._print("## Ready for binary (ymodem) download to {:#010x} at {} bps...".format(
+            addr, self.baudrate or console_baudrate or 115200))
+
+        self._binary = True
+        try:
+            size = self._ymodem_receive(addr)
+        finally:
+            self._binary = False
+        if size is not None:
+            self.env["filesize"] = "{:x}".format(size)
+            self._print("## Total Size      = {:#010x} = {} Bytes".format(size, size),
+                "## Start Addr      = {:#010x}".format(addr))
+        else:
+            self._print("## Binary (ymodem) download aborted")
+
+        if self.baudrate != console_baudrate:
+            self._print("## Switch baudrate to {} bps and press ESC ...".format(console_baudrate))
+            self.baudrate = console_baudrate
+            while self._getc() != ESC:
+                pass
+
+    def _ymodem_receive(self, addr):
+        """ Receive YMODEM (CRC16, 128 and 1024 bytes blocks) file into RAM, returns its size or None
+        """
+        data = bytearray()
+        expected = 0  # block 0 is the header with file's name and size
+        file_size = None
+        retries = 0
+        self._send(b"C")
+        while True:
+            head = self._getc(timeout=YMODEM_TIMEOUT)
+            if head is None:
+                retries += 1
+                if retries > YMODEM_MAX_RETRIES:
+                    return None
+                self._send(b"C" if expected == 0 else bytes([NAK]))
+                continue
+            if head == EOT:
+                self._send(bytes([ACK]))
+                break
+            if head == CAN:
+                return None
+            if head not in (SOH, STX):
+                continue  # line noise
+
+            payload_size = 128 if head == SOH else 1024
+            frame = self._read_exact(2 + payload_size + 2, YMODEM_TIMEOUT)
+            num, payload, crc = frame[0:1], frame[2:2 + payload_size], frame[2 + payload_size:]
+            if (len(frame) < 2 + payload_size + 2 or frame[0] ^ frame[1] != 0xff
+                    or binascii.crc_hqx(payload, 0) != int.from_bytes(crc, "big")):
+                retries += 1
+                self._input.clear()
+                self._send(bytes([NAK]))
+                continue
+            retries = 0
+            num = num[0]
+            if expected and num == (expected - 1) & 0xff:  # our ACK is lost, block is repeated
+                self._send(bytes([ACK]))
+                continue
+            if num != expected & 0xff:
+                self._send(bytes([NAK]))
+                continue
+
+            if expected == 0:
+                fields = payload.split(b"\0")
+                size_field = fields[1].split() if len(fields) > 1 else []
+                if size_field:
+                    file_size = int(size_field[0])
+            else:
+                data += payload
+            expected += 1
+            self._send(bytes([ACK]))
+
+        if file_size is not None:
+            del data[file_size:]
+        self.ram.write(addr, data)
+        return len(data)
+
+    def cmd_bootm(self, suffix, addr=None, initrd_addr=None, fdt_addr=None):
+        addr = parse_number(addr if addr is not None else self.env.get("loadaddr", "82000000"))
+        self._print("## Booting kernel from Legacy Image at {:08x} ...".format(addr))
+        header = self.ram.read(addr, UIMAGE_HEADER.size)
+        magic, hcrc, _, size, load, entry, dcrc, _, _, _, comp, name = UIMAGE_HEADER.unpack(header)
+        if magic != UIMAGE_MAGIC or zlib.crc32(header[:4] + bytes(4) + header[8:]) != hcrc:
+            raise SimulatorError("Wrong Image Format for bootm command\nERROR: can't get kernel image!")
+        data_addr = addr + UIMAGE_HEADER.size
+        self._print("   Image Name:   {}".format(name.rstrip(b"\0").decode("ascii", errors="replace")),
+            "   Data Size:    {} Bytes = {:.1f} MiB".format(size, size / (1 << 20)),
+            "   Load Address: {:08x}".format(load), "   Entry Point:  {:08x}".format(entry))
+        if self.env.get("verify") not in ("n", "no"):
+            self._send("   Verifying Checksum ... ")
+            if zlib.crc32(self.ram.read(data_addr, size)) != dcrc:
+                raise SimulatorError("Bad Data CRC\nERROR: can't get kernel image!")
+            self._print("OK")
+        if comp == 0 and load == data_addr:
+            self._print("   XIP Kernel Image ... OK")
+        else:  # compressed payloads are stored as is, the simulator doesn't unpack them
+            self.ram.write(load, self.ram.read(data_addr, size))
+            self._print("   Loading Kernel Image ... OK")
+        self._print("OK", "", "Starting kernel ...", "")
+        self._print("Uncompressing Linux... done, booting the kernel.")
+        self.booted = True
+
+
+# -------------------------------------------------------------------------------------------------
+def serve_tcp(host, port, **kwargs):
+    """ Serve connections one by one like ser2net does
+    """
+    simulator = UBootSimulator(None, **kwargs)
+    simulator.state = "kernel"
+    signal.signal(signal.SIGUSR1, lambda *args: setattr(simulator, "reset_requested", True))
+    with socket.socket() as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(1)
+        logging.info("Simulator listens on {}:{}".format(host, port))
+        while True:
+            conn, peer = sock.accept()
+            logging.info("Connection from {}:{}".format(*peer))
+            with conn:
+                simulator.fd = conn.fileno()
+                simulator.run()
+
+
+def serve_pty(link=None, **kwargs):
+    """ Serve pseudo terminal, its slave side is kept open, so the simulator survives clients' reconnections
+    """
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    if link is not None:
+        if os.path.lexists(link):
+            os.unlink(link)
+        os.symlink(path, link)
+    print("Simulator's console is {}".format(link or path), flush=True)
+    simulator = UBootSimulator(master, **kwargs)
+    simulator.state = "kernel"
+    signal.signal(signal.SIGUSR1, lambda *args: setattr(simulator, "reset_requested", True))
+    try:
+        simulator.run()
+    finally:
+        if link is not None:
+            os.unlink(link)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python3 -m hiburn.simulator", description="Simulated U-Boot device")
+    mutexg = parser.add_mutually_exclusive_group(required=True)
+    mutexg.add_argument("--tcp", type=utils.str2endpoint, metavar="V", help="Listen on '[host:]port'")
+    mutexg.add_argument("--pty", action="store_true", help="Create pseudo terminal")
+    parser.add_argument("--link", help="Symlink to the pseudo terminal")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--bootdelay", type=int, default=int(DEFAULT_ENV["bootdelay"]))
+    parser.add_argument("--baudrate", type=int, default=115200, help="Emulated line speed, 0 - unlimited")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay before each command line, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of byte corruption in loady")
+    parser.add_argument("--tftp-port", type=int, default=utils.TFTP_SERVER_DEFAULT_PORT)
+    parser.add_argument("--bind-device-ip", action="store_true", help="Make TFTP transfers from 'ipaddr'")
+    parser.add_argument("--ram-size", type=utils.hsize2int, default=RAM_SIZE)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--pid-file", help="Write process ID there, send SIGUSR1 to reset the device")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=(logging.DEBUG if args.verbose else logging.INFO))
+
+    env = dict(DEFAULT_ENV, bootdelay=str(args.bootdelay))
+    kwargs = dict(prompt=args.prompt, env=env, baudrate=args.baudrate or None, latency=args.latency,
+        error_rate=args.error_rate, tftp_port=args.tftp_port, bind_device_ip=args.bind_device_ip,
+        ram_size=args.ram_size, seed=args.seed)
+    if args.pid_file is not None:
+        with open(args.pid_file, "w") as f:
+            f.write("{}\n".format(os.getpid()))
+    try:
+        if args.pty:
+            serve_pty(args.link, **kwargs)
+        else:
+            serve_tcp(*args.tcp, **kwargs)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
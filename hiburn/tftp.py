@@ -0,0 +1,410 @@
+import collections
+import logging
+import socket
+import struct
+import threading
+
+# https://tools.ietf.org/html/rfc1350, options: https://tools.ietf.org/html/rfc2347,
+# blksize: https://tools.ietf.org/html/rfc2348, windowsize: https://tools.ietf.org/html/rfc7440
+
+
+RRQ = 1
+WRQ = 2
+DATA = 3
+ACK = 4
+ERROR = 5
+OACK = 6
+
+ERR_NOT_DEFINED = 0
+ERR_FILE_NOT_FOUND = 1
+ERR_ACCESS_VIOLATION = 2
+ERR_ILLEGAL_OPERATION = 4
+ERR_UNKNOWN_TID = 5
+ERR_OPTION = 8
+
+DEFAULT_BLOCK_SIZE = 512
+MIN_BLOCK_SIZE = 8
+MAX_BLOCK_SIZE = 65464
+MAX_WINDOW_SIZE = 65535
+TIMEOUT = 1.0
+MAX_RETRIES = 5
+
+
+class TftpError(RuntimeError):
+    pass
+
+
+# -------------------------------------------------------------------------------------------------
+def parse_request(packet):
+    """ Parse RRQ/WRQ packet, returns (opcode, file name, options dict)
+    """
+    opcode = struct.unpack("!H", packet[:2])[0]
+    fields = packet[2:].split(b"\0")
+    name, mode = fields[0].decode("ascii"), fields[1].decode("ascii").lower()
+    if mode != "octet":
+        raise TftpError("Unsupported transfer mode '{}'".format(mode))
+    options = {}
+    for i in range(2, len(fields) - 1, 2):
+        options[fields[i].decode("ascii").lower()] = fields[i + 1].decode("ascii")
+    return opcode, name, options
+
+
+def make_request(opcode, name, options=None):
+    packet = struct.pack("!H", opcode) + name.encode("ascii") + b"\0octet\0"
+    for key, val in (options or {}).items():
+        packet += "{}\0{}\0".format(key, val).encode("ascii")
+    return packet
+
+
+def make_oack(options):
+    return struct.pack("!H", OACK) + b"".join("{}\0{}\0".format(k, v).encode("ascii") for k, v in options.items())
+
+
+def make_error(code, message):
+    return struct.pack("!HH", ERROR, code) + message.encode("ascii") + b"\0"
+
+
+def parse_oack(packet):
+    fields = packet[2:].split(b"\0")
+    return {fields[i].decode("ascii").lower(): fields[i + 1].decode("ascii") for i in range(0, len(fields) - 1, 2)}
+
+
+# -------------------------------------------------------------------------------------------------
+class Transfer:
+    """ One side of a transfer over a dedicated UDP socket bound to peer's TID
+    Up to `window_size` blocks are sent before waiting for an acknowledgement, 1 means lock-step
+    """
+    def __init__(self, sock, peer, block_size=DEFAULT_BLOCK_SIZE, window_size=1, timeout=TIMEOUT,
+            retries=MAX_RETRIES):
+        self.sock = sock
+        self.peer = peer
+        self.block_size = block_size
+        self.window_size = window_size
+        self.timeout = timeout
+        self.retries = retries
+        self.sock.settimeout(timeout)
+
+    def apply_options(self, options):
+        self.block_size = int(options.get("blksize", DEFAULT_BLOCK_SIZE))
+        self.window_size = int(options.get("windowsize", 1))
+        if "timeout" in options:
+            self.timeout = int(options["timeout"])
+            self.sock.settimeout(self.timeout)
+        # a whole window has to fit into receive buffer (kernel accounts datagrams roughly twice
+        # their size), otherwise its tail is dropped every time and costs a timeout
+        need = 2 * self.window_size * (self.block_size + 64)
+        if need > self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, need)
+
+    def recv(self):
+        """ Receive next packet from the peer, returns (opcode, packet) or None on timeout
+        """
+        while True:
+            try:
+                packet, addr = self.sock.recvfrom(65536)
+            except socket.timeout:
+                return None
+            if self.peer is None or addr == self.peer or self.peer[1] is None:
+                self.peer = addr
+            elif addr != self.peer:
+                self.sock.sendto(make_error(ERR_UNKNOWN_TID, "Unknown transfer ID"), addr)
+                continue
+            if len(packet) < 4:
+                continue
+            opcode = struct.unpack("!H", packet[:2])[0]
+            if opcode == ERROR:
+                code = struct.unpack("!H", packet[2:4])[0]
+                raise TftpError("Peer reports error {}: {}".format(code, packet[4:].rstrip(b"\0").decode(errors="replace")))
+            return opcode, packet
+
+    def exchange(self, packet, expect, dest=None):
+        """ Send `packet` to the peer (or `dest`) and wait for a packet accepted by `expect(opcode, packet)`,
+        resend on timeout
+        """
+        for _ in range(self.retries):
+            self.sock.sendto(packet, dest or self.peer)
+            while True:
+                resp = self.recv()
+                if resp is None:
+                    break  # timeout, resend
+                if expect(*resp):
+                    return resp
+        raise TftpError("Timeout waiting for peer")
+
+    def send_file(self, fobj):
+        """ Send `fobj` content block by block, options must have been agreed before
+        An ACK acknowledges all blocks up to its number and slides the window, a repeated ACK
+        means the receiver has lost the next block, so the window is resent (once till progress)
+        """
+        window = collections.OrderedDict()  # absolute block number -> packet
+        block, last, acked, retries, resent = 1, None, 0, 0, False
+        while True:
+            while last is None and len(window) < self.window_size:
+                data = fobj.read(self.block_size)
+                window[block] = struct.pack("!HH", DATA, block & 0xFFFF) + data
+                self.sock.sendto(window[block], self.peer)
+                if len(data) < self.block_size:
+                    last = block
+                block += 1
+
+            resp = self.recv()
+            if resp is None:
+                retries += 1
+                if retries > self.retries:
+                    raise TftpError("Timeout waiting for peer")
+                self._send_all(window.values())
+                continue
+
+            opcode, packet = resp
+            if opcode != ACK:
+                continue
+            num = struct.unpack("!H", packet[2:4])[0]
+            ack = next((b for b in window if b & 0xFFFF == num), None)
+            if ack is None:
+                # lock-step transfer never resends on duplicated ACK (Sorcerer's Apprentice)
+                if num == acked & 0xFFFF and self.window_size > 1 and not resent:
+                    resent = True
+                    self._send_all(window.values())
+                continue
+            acked, retries, resent = ack, 0, False
+            while window and next(iter(window)) <= acked:
+                window.popitem(last=False)
+            if acked == last:
+                return
+
+    def _send_all(self, packets):
+        for packet in packets:
+            self.sock.sendto(packet, self.peer)
+
+    def receive_file(self, fobj, first_packet, block=1, dally=True):
+        """ Receive blocks into `fobj` starting from `block`, `first_packet` acknowledges the request
+        (ACK 0 or OACK) or the previous block. Every `window_size`-th block is acknowledged, unexpected
+        block makes the last received one to be acknowledged again (once till progress).
+        With `dally` final block is acknowledged again if the sender repeats it (the ACK has been lost)
+        """
+        ack = first_packet
+        self.sock.sendto(ack, self.peer)
+        unacked, retries, stalled = 0, 0, False
+        while True:
+            resp = self.recv()
+            if resp is None:
+                retries += 1
+                if retries > self.retries:
+                    raise TftpError("Timeout waiting for peer")
+                self.sock.sendto(ack, self.peer)
+                unacked = 0
+                continue
+
+            opcode, packet = resp
+            if opcode != DATA:
+                continue
+            if struct.unpack("!H", packet[2:4])[0] != block & 0xFFFF:
+                if not stalled:
+                    stalled = True
+                    self.sock.sendto(ack, self.peer)
+                    unacked = 0
+                continue
+
+            retries, stalled = 0, False
+            data = packet[4:]
+            fobj.write(data)
+            ack = struct.pack("!HH", ACK, block & 0xFFFF)
+            unacked += 1
+            if len(data) < self.block_size:
+                self.sock.sendto(ack, self.peer)
+                if dally:
+                    self.linger(ack, block & 0xFFFF)
+                return
+            if unacked >= self.window_size:
+                self.sock.sendto(ack, self.peer)
+                unacked = 0
+            block += 1
+
+    def linger(self, ack, num):
+        """ Stay for a couple of timeouts to acknowledge repeated final block `num` again
+        """
+        self.sock.settimeout(2 * self.timeout)
+        try:
+            while True:
+                resp = self.recv()
+                if resp is None:
+                    return
+                if resp[0] == DATA and struct.unpack("!H", resp[1][2:4])[0] == num:
+                    self.sock.sendto(ack, self.peer)
+        except TftpError:
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
+
+# -------------------------------------------------------------------------------------------------
+class TftpServer:
+    """ TFTP server serving file-like objects provided by callbacks instead of a directory:
+    `open_read(name, client_addr)` and `open_write(name, client_addr)` return file-like objects or None.
+    Returned objects are closed when their transfers are over.
+    Block and window sizes requested by clients are accepted up to `max_block_size` and `max_window_size`
+    """
+    def __init__(self, open_read, open_write, max_block_size=MAX_BLOCK_SIZE, max_window_size=MAX_WINDOW_SIZE,
+            timeout=TIMEOUT):
+        self.open_read = open_read
+        self.open_write = open_write
+        self.max_block_size = max_block_size
+        self.max_window_size = max_window_size
+        self.timeout = timeout
+        self.sock = None
+        self.sessions = []
+        self._stop = threading.Event()
+
+    def bind(self, listen_ip, listen_port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((listen_ip, listen_port))
+        self.sock.settimeout(0.1)
+        logging.debug("TFTP server listens on {}:{}".format(listen_ip, listen_port))
+
+    def serve(self):
+        """ Serve requests on bound socket till `stop` is called
+        """
+        listen_ip = self.sock.getsockname()[0]
+        try:
+            while not self._stop.is_set():
+                try:
+                    packet, addr = self.sock.recvfrom(65536)
+                except socket.timeout:
+                    continue
+                session = threading.Thread(target=self._session, args=(packet, addr, listen_ip), daemon=True)
+                session.start()
+                self.sessions = [s for s in self.sessions if s.is_alive()] + [session]
+        finally:
+            self.sock.close()
+
+    def listen(self, listen_ip, listen_port):
+        self.bind(listen_ip, listen_port)
+        self.serve()
+
+    def stop(self):
+        """ Stop listening and wait for running transfers
+        """
+        self._stop.set()
+        for session in list(self.sessions):
+            session.join()
+
+    def negotiate(self, opcode, options, fobj):
+        """ Returns options to acknowledge in OACK
+        """
+        res = {}
+        if "blksize" in options:
+            res["blksize"] = str(max(MIN_BLOCK_SIZE, min(int(options["blksize"]), self.max_block_size)))
+        if "windowsize" in options:
+            res["windowsize"] = str(max(1, min(int(options["windowsize"]), self.max_window_size)))
+        if "timeout" in options:
+            res["timeout"] = options["timeout"]
+        if "tsize" in options:
+            if opcode == WRQ:
+                res["tsize"] = options["tsize"]
+            elif hasattr(fobj, "seek"):
+                res["tsize"] = str(fobj.seek(0, 2))
+                fobj.seek(0)
+        return res
+
+    def _session(self, packet, addr, listen_ip):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((listen_ip, 0))
+        fobj = None
+        try:
+            try:
+                opcode, name, options = parse_request(packet)
+            except (TftpError, UnicodeDecodeError, IndexError, struct.error) as err:
+                sock.sendto(make_error(ERR_ILLEGAL_OPERATION, str(err)), addr)
+                return
+
+            if opcode not in (RRQ, WRQ):
+                sock.sendto(make_error(ERR_ILLEGAL_OPERATION, "Unexpected request"), addr)
+                return
+
+            fobj = (self.open_read if opcode == RRQ else self.open_write)(name.lstrip("/"), addr)
+            if fobj is None:
+                logging.warning("TFTP request for unknown file '{}' from {}".format(name, addr))
+                code = ERR_FILE_NOT_FOUND if opcode == RRQ else ERR_ACCESS_VIOLATION
+                sock.sendto(make_error(code, "Unknown file"), addr)
+                return
+
+            try:
+                accepted = self.negotiate(opcode, options, fobj)
+            except ValueError:
+                sock.sendto(make_error(ERR_OPTION, "Bad options"), addr)
+                return
+            transfer = Transfer(sock, addr, timeout=self.timeout)
+            transfer.apply_options(accepted)
+            logging.debug("TFTP {} '{}' with {}, options {}".format(
+                "RRQ" if opcode == RRQ else "WRQ", name, addr, accepted))
+            self.run_transfer(transfer, opcode, fobj, accepted)
+        except (TftpError, OSError) as err:
+            logging.error("TFTP transfer with {} failed: {}".format(addr, err))
+        finally:
+            if fobj is not None:
+                fobj.close()
+            sock.close()
+
+    def run_transfer(self, transfer, opcode, fobj, accepted):
+        if opcode == RRQ:
+            if accepted:
+                transfer.exchange(make_oack(accepted),
+                    lambda op, p: op == ACK and struct.unpack("!H", p[2:4])[0] == 0)
+            transfer.send_file(fobj)
+        else:
+            first = make_oack(accepted) if accepted else struct.pack("!HH", ACK, 0)
+            transfer.receive_file(fobj, first)
+
+
+# -------------------------------------------------------------------------------------------------
+class TftpClient:
+    """ Minimal TFTP client, `options` are requested in RRQ/WRQ (e.g. blksize, windowsize)
+    Without `dally` downloads return right after the final ACK, which is lost if the server doesn't get it
+    """
+    def __init__(self, host, port, options=None, timeout=TIMEOUT, dally=True, local_ip=""):
+        self.host = host
+        self.port = port
+        self.options = options or {}
+        self.timeout = timeout
+        self.dally = dally
+        self.local_ip = local_ip
+
+    def _request(self, opcode, name, expect):
+        """ Send request till the server responds from its TID, returns (socket, Transfer, response)
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.local_ip, 0))
+        transfer = Transfer(sock, (self.host, None), timeout=self.timeout)
+        try:
+            resp = transfer.exchange(make_request(opcode, name, self.options), expect, dest=(self.host, self.port))
+        except BaseException:
+            sock.close()
+            raise
+        return sock, transfer, resp
+
+    def download(self, name, fobj):
+        sock, transfer, (opcode, packet) = self._request(RRQ, name,
+            lambda op, p: op == OACK or (op == DATA and struct.unpack("!H", p[2:4])[0] == 1))
+        with sock:
+            if opcode == OACK:
+                transfer.apply_options(parse_oack(packet))
+                transfer.receive_file(fobj, struct.pack("!HH", ACK, 0), dally=self.dally)
+                return
+            # server has ignored options, the first block is already here
+            fobj.write(packet[4:])
+            ack = struct.pack("!HH", ACK, 1)
+            if len(packet) - 4 < transfer.block_size:
+                sock.sendto(ack, transfer.peer)
+                if self.dally:
+                    transfer.linger(ack, 1)
+            else:
+                transfer.receive_file(fobj, ack, block=2, dally=self.dally)
+
+    def upload(self, name, fobj):
+        sock, transfer, (opcode, packet) = self._request(WRQ, name,
+            lambda op, p: op == OACK or (op == ACK and struct.unpack("!H", p[2:4])[0] == 0))
+        with sock:
+            if opcode == OACK:
+                transfer.apply_options(parse_oack(packet))
+            transfer.send_file(fobj)
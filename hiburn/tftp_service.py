@@ -0,0 +1,270 @@
+import itertools
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+from . import tftp
+from . import utils
+
+# Long-running TFTP endpoint shared by hiburn invocations (`hiburn serve`).
+# Actions talk to it over a local SOCK_SEQPACKET unix socket, one JSON message per packet.
+# Files are never opened by the service: clients pass opened file descriptors along with
+# registration requests, so the service reads/writes only what the client itself may access.
+# Registrations live as long as the control connection which made them.
+# The control socket is private to its owner: anyone able to connect may serve images to boards
+# and capture their uploads.
+
+
+CONTROL_SOCKET_NAME = "hiburn-tftp.sock"
+CONTROL_PATH_ENV = "HIBURN_TFTP_SOCKET"
+DEFAULT_CONTROL_MODE = 0o600
+MAX_MESSAGE_SIZE = 4096
+
+
+def default_control_path():
+    """ Socket in user's runtime directory, or user specific one in temporary directory if there is no such
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, CONTROL_SOCKET_NAME)
+    return os.path.join(tempfile.gettempdir(), "hiburn-tftp-{}.sock".format(os.getuid()))
+
+
+def control_socket_path():
+    return os.environ.get(CONTROL_PATH_ENV) or default_control_path()
+
+
+# -------------------------------------------------------------------------------------------------
+class TftpService:
+    """ TFTP server with transfers registered through control socket at `control_path` (see `control_socket_path`)
+    The socket gets `control_mode` permissions; run by sudo it's handed over to the invoking user
+    """
+    def __init__(self, listen_ip, listen_port=utils.TFTP_SERVER_DEFAULT_PORT, control_path=None,
+            control_mode=DEFAULT_CONTROL_MODE):
+        self.listen_ip = listen_ip
+        self.listen_port = listen_port
+        self.control_path = control_socket_path() if control_path is None else control_path
+        self.control_mode = control_mode
+        self.server = tftp.TftpServer(open_read=self._open_source, open_write=self._open_receiver)
+        self._lock = threading.Lock()
+        self._sources = {}  # name -> (connection id, file object)
+        self._receivers = {}  # name -> (connection id, TftpReceiver)
+        self._ids = itertools.count()
+        self._control = None
+        self._stop = threading.Event()
+
+    def run(self):
+        """ Serve till `stop` is called
+        """
+        self.server.bind(self.listen_ip, self.listen_port)
+        tftp_thread = threading.Thread(target=self.server.serve)
+        tftp_thread.start()
+        try:
+            self._listen_control()
+        finally:
+            self.server.stop()
+            tftp_thread.join()
+
+    def stop(self):
+        self._stop.set()
+
+    def _listen_control(self):
+        if os.path.exists(self.control_path):
+            os.unlink(self.control_path)  # stale one from previous run
+        self._control = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self._control.bind(self.control_path)
+            os.chmod(self.control_path, self.control_mode)
+            if "SUDO_UID" in os.environ:
+                os.chown(self.control_path, int(os.environ["SUDO_UID"]), int(os.environ.get("SUDO_GID", -1)))
+            self._control.listen()
+            self._control.settimeout(0.1)
+            logging.info("TFTP service listens on {}:{}, control socket '{}'".format(
+                self.listen_ip, self.listen_port, self.control_path))
+            while not self._stop.is_set():
+                try:
+                    conn, _ = self._control.accept()
+                except socket.timeout:
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn, next(self._ids)), daemon=True).start()
+        finally:
+            self._control.close()
+            os.unlink(self.control_path)
+
+    def _handle_connection(self, conn, conn_id):
+        logging.debug("Control connection #{} is opened".format(conn_id))
+        names = itertools.count()
+        try:
+            with conn:
+                while True:
+                    msg, fds, _, _ = socket.recv_fds(conn, MAX_MESSAGE_SIZE, 1)
+                    if not msg:
+                        break
+                    try:
+                        resp = self._handle_request(conn_id, names, json.loads(msg.decode()), fds)
+                    except (ValueError, KeyError, RuntimeError, OSError) as err:
+                        for fd in fds:
+                            os.close(fd)
+                        resp = {"error": str(err)}
+                    conn.send(json.dumps(resp).encode())
+        except OSError as err:
+            logging.warning("Control connection #{} failed: {}".format(conn_id, err))
+        finally:
+            self._unregister(conn_id)
+            logging.debug("Control connection #{} is closed".format(conn_id))
+
+    def _handle_request(self, conn_id, names, request, fds):
+        cmd = request["cmd"]
+        if cmd in ("serve", "receive"):
+            if len(fds) != 1:
+                raise ValueError("'{}' request needs a file descriptor".format(cmd))
+            name = request.get("name") or "hiburn-{}-{}".format(conn_id, next(names))
+            with self._lock:
+                if name in self._sources or name in self._receivers:
+                    raise RuntimeError("Name '{}' is already registered".format(name))
+                if cmd == "serve":
+                    self._sources[name] = (conn_id, os.fdopen(fds[0], "rb"))
+                else:
+                    # unbuffered: the file is complete on disk once the last block is received
+                    self._receivers[name] = (conn_id, utils.TftpReceiver(name, os.fdopen(fds[0], "wb", buffering=0)))
+            logging.info("Connection #{} registers '{}' to {}".format(conn_id, name, cmd))
+            return {"name": name}
+
+        if cmd == "status":
+            with self._lock:
+                receiver = self._receivers[request["name"]][1]
+            return {"size": receiver.size, "crc32": receiver.crc32, "done": receiver.closed}
+
+        if cmd == "unregister":
+            self._unregister(conn_id, request["name"])
+            return {}
+
+        raise ValueError("Unknown command '{}'".format(cmd))
+
+    def _unregister(self, conn_id, name=None):
+        with self._lock:
+            for registry in (self._sources, self._receivers):
+                for key, (owner, fobj) in list(registry.items()):
+                    if owner == conn_id and (name is None or key == name):
+                        del registry[key]
+                        fobj.close()
+                        if hasattr(fobj, "dst"):
+                            fobj.dst.close()
+
+    def _open_source(self, name, client_addr):
+        with self._lock:
+            entry = self._sources.get(name)
+        return None if entry is None else utils.BufferReader(entry[1])
+
+    def _open_receiver(self, name, client_addr):
+        with self._lock:
+            entry = self._receivers.get(name)
+        return None if entry is None else entry[1].open()
+
+
+# -------------------------------------------------------------------------------------------------
+class RemoteReceiver:
+    """ Service side TftpReceiver's counterpart, CRC32 and size are asked from the service
+    """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    @property
+    def size(self):
+        return self.client.request({"cmd": "status", "name": self.name})["size"]
+
+    @property
+    def crc32(self):
+        return self.client.request({"cmd": "status", "name": self.name})["crc32"]
+
+
+class TftpServiceClient:
+    """ Context manager with TftpContext's interface which registers transfers in running TFTP service
+    """
+    def __init__(self, control_path):
+        self.control_path = control_path
+        self.sock = None
+
+    def __enter__(self):
+        if self.sock is None:
+            self.connect()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.sock.close()  # the service drops all our registrations
+        self.sock = None
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            sock.connect(self.control_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def request(self, msg, fd=None):
+        socket.send_fds(self.sock, [json.dumps(msg).encode()], [] if fd is None else [fd])
+        resp = json.loads(self.sock.recv(MAX_MESSAGE_SIZE).decode())
+        if "error" in resp:
+            raise RuntimeError("TFTP service fails to handle '{}': {}".format(msg["cmd"], resp["error"]))
+        return resp
+
+    def serve(self, src, name=None):
+        """ Register `src` (file path, bytes-like object or binary file object) to be served as `name`
+        Bytes-like objects are passed via anonymous memory file
+        """
+        with self._open_fd(src) as fd:
+            return self.request({"cmd": "serve", "name": name}, fd)["name"]
+
+    def receive(self, dst, name=None):
+        """ Register `dst` (file path or binary file object) to receive device's upload named `name`
+        """
+        if hasattr(dst, "fileno"):  # the service writes from the file's current position
+            dst.flush()
+            name = self.request({"cmd": "receive", "name": name}, dst.fileno())["name"]
+        else:
+            with open(dst, "wb") as f:
+                name = self.request({"cmd": "receive", "name": name}, f.fileno())["name"]
+        return RemoteReceiver(self, name)
+
+    @staticmethod
+    def _open_fd(src):
+        import contextlib
+
+        @contextlib.contextmanager
+        def opened(fd):
+            try:
+                yield fd
+            finally:
+                os.close(fd)
+
+        if isinstance(src, (str, os.PathLike)):
+            return opened(os.open(src, os.O_RDONLY))
+        if hasattr(src, "fileno"):
+            return opened(os.dup(src.fileno()))
+        fd = os.memfd_create("hiburn")
+        with utils.open_buffer(src) as view:
+            offset = 0
+            while offset < len(view):
+                offset += os.write(fd, view[offset:])
+        return opened(fd)
+
+
+# -------------------------------------------------------------------------------------------------
+def connect(path=None):
+    """ TftpServiceClient for running service or None if there is no one
+    """
+    path = control_socket_path() if path is None else path
+    if not os.path.exists(path):
+        return None
+    client = TftpServiceClient(path)
+    try:
+        client.connect()
+    except OSError as err:
+        logging.debug("TFTP service at '{}' isn't available: {}".format(path, err))
+        return None
+    return client
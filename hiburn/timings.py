@@ -0,0 +1,132 @@
+import contextlib
+import json
+import time
+
+# Lightweight span tracer: where did the time of a run go (power reset, console fetch, U-Boot commands,
+# transfers). Spans are nested by the order they are opened, U-Boot commands are recorded by UBootClient
+# when it has a tracer (see `UBootClient.tracer`).
+
+
+# -------------------------------------------------------------------------------------------------
+class Span:
+    """ Times are seconds since tracer's start, `size` is amount of transferred bytes (transfers only)
+    """
+    def __init__(self, name, kind, start, depth, size=None, detail=None):
+        self.name = name
+        self.kind = kind
+        self.start = start
+        self.duration = None
+        self.depth = depth
+        self.size = size
+        self.detail = detail
+
+    @property
+    def rate(self):
+        """ Bytes per second
+        """
+        if self.size is None or not self.duration:
+            return None
+        return self.size / self.duration
+
+    def as_dict(self):
+        d = {"name": self.name, "kind": self.kind, "start": self.start, "duration": self.duration,
+            "depth": self.depth}
+        if self.size is not None:
+            d.update(size=self.size, rate=self.rate)
+        if self.detail is not None:
+            d.update(detail=self.detail)
+        return d
+
+
+class Tracer:
+    def __init__(self):
+        self.spans = []
+        self._stack = []
+        self._start = time.monotonic()
+
+    def begin(self, name, kind, size=None, detail=None):
+        s = Span(name, kind, time.monotonic() - self._start, len(self._stack), size=size, detail=detail)
+        self.spans.append(s)
+        self._stack.append(s)
+        return s
+
+    def end(self, s):
+        """ Close span `s` and ones which are opened inside it and aren't closed yet
+        """
+        if s not in self._stack:
+            return  # already closed together with an outer span
+        now = time.monotonic() - self._start
+        while self._stack:
+            top = self._stack.pop()
+            top.duration = now - top.start
+            if top is s:
+                return
+
+    @contextlib.contextmanager
+    def span(self, name, kind="phase", size=None, detail=None):
+        s = self.begin(name, kind, size=size, detail=detail)
+        try:
+            yield s
+        finally:
+            self.end(s)
+
+    def finish(self):
+        """ Close all open spans, returns total time
+        """
+        if self._stack:
+            self.end(self._stack[0])
+        return time.monotonic() - self._start
+
+    def as_dict(self):
+        return {"total": self.finish(), "spans": [s.as_dict() for s in self.spans]}
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+            f.write("\n")
+
+
+def span(tracer, name, kind="phase", size=None, detail=None):
+    """ `tracer.span(...)` or a no-op context if `tracer` is None
+    """
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, kind, size=size, detail=detail)
+
+
+# -------------------------------------------------------------------------------------------------
+def format_rate(rate):
+    if rate is None:
+        return "-"
+    for unit in ("B/s", "KB/s"):
+        if rate < 1024:
+            return "{:.0f} {}".format(rate, unit)
+        rate /= 1024
+    return "{:.1f} MB/s".format(rate)
+
+
+def format_table(tracer):
+    """ Phases and transfers one by one, U-Boot commands are summarized by name
+    """
+    total = tracer.finish()
+    lines = ["{:<36} {:>9} {:>9} {:>12} {:>12}".format("span", "start", "duration", "bytes", "rate")]
+    for s in tracer.spans:
+        if s.kind == "command":
+            continue
+        lines.append("{:<36} {:>9.3f} {:>9.3f} {:>12} {:>12}".format(
+            "  " * s.depth + s.name, s.start, s.duration, "-" if s.size is None else s.size, format_rate(s.rate)))
+
+    commands = {}
+    for s in tracer.spans:
+        if s.kind == "command":
+            count, duration, longest = commands.get(s.name, (0, 0.0, 0.0))
+            commands[s.name] = (count + 1, duration + s.duration, max(longest, s.duration))
+    if commands:
+        lines.append("")
+        lines.append("{:<36} {:>9} {:>9} {:>12}".format("U-Boot command", "count", "total", "longest"))
+        for name, (count, duration, longest) in sorted(commands.items(), key=lambda i: -i[1][1]):
+            lines.append("{:<36} {:>9} {:>9.3f} {:>12.3f}".format(name, count, duration, longest))
+
+    lines.append("")
+    lines.append("total {:.3f}s".format(total))
+    return "\n".join(lines)
@@ -0,0 +1,189 @@
+import select
+import socket
+import time
+import urllib.parse
+import serial
+
+# Connections to device's console.
+# UBootClient, YModem and Kermit use a subset of pyserial's Serial API described by Transport,
+# so pyserial ports (local ones and `serial_for_url` ones like rfc2217://) are transports as is.
+
+
+DEFAULT_BAUDRATE = 115200
+RECV_SIZE = 64 * 1024
+WRITE_BUFFER_SIZE = 4096  # written data is sent when that much is collected or before reading
+
+
+# -------------------------------------------------------------------------------------------------
+class Transport:
+    """ Console connection interface
+    `timeout` - seconds `read` and `readline` wait for data, None - forever, 0 - don't wait at all.
+    Transports able to change line's speed have `baudrate` attribute, others don't
+    """
+    timeout = None
+
+    def read(self, size=1):
+        """ Read `size` bytes, less if timeout exceeds
+        """
+        raise NotImplementedError()
+
+    def readline(self):
+        """ Read till newline (included), less if timeout exceeds
+        """
+        raise NotImplementedError()
+
+    def write(self, data):
+        raise NotImplementedError()
+
+    def flush(self):
+        """ Send written data which may be still buffered
+        """
+        raise NotImplementedError()
+
+    @property
+    def in_waiting(self):
+        """ Number of bytes which can be read without waiting
+        """
+        raise NotImplementedError()
+
+    def reset_input_buffer(self):
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+
+# -------------------------------------------------------------------------------------------------
+class TcpTransport(Transport):
+    """ Raw TCP connection (like ser2net's raw mode) on non-blocking socket
+    Incoming data is received by `recv_into` into a preallocated chunk and appended to a bytearray,
+    consumed data is deleted from its head, so large reads stay linear
+    """
+    def __str__(self):
+        return f"{type(self).__name__}({self.host}:{self.port})"
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+        self.timeout = None
+        self._rx = bytearray()
+        self._chunk = bytearray(RECV_SIZE)
+        self._tx = bytearray()
+
+    def _received(self, size):
+        """ Handle `size` bytes received into the chunk
+        """
+        self._rx += memoryview(self._chunk)[:size]
+
+    def _encode(self, data):
+        """ Convert written data into what is sent
+        """
+        return data
+
+    def _deadline(self):
+        return None if self.timeout is None else time.monotonic() + self.timeout
+
+    @staticmethod
+    def _remaining(deadline):
+        return None if deadline is None else max(0, deadline - time.monotonic())
+
+    def _fill(self, timeout):
+        """ Receive one chunk waiting at most `timeout` (None - forever), returns False on timeout
+        """
+        self.flush()
+        if timeout != 0 and not select.select([self.sock], [], [], timeout)[0]:
+            return False
+        try:
+            size = self.sock.recv_into(self._chunk)
+        except BlockingIOError:
+            return False
+        if not size:
+            raise EOFError("Connection to {}:{} is closed".format(self.host, self.port))
+        self._received(size)
+        return True
+
+    def _take(self, size):
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def read(self, size=1):
+        deadline = self._deadline()
+        while len(self._rx) < size:
+            if not self._fill(self._remaining(deadline)):
+                break
+        return self._take(size)
+
+    def readline(self):
+        deadline = self._deadline()
+        start = 0
+        while True:
+            end = self._rx.find(b"\n", start)
+            if end != -1:
+                return self._take(end + 1)
+            start = len(self._rx)
+            if not self._fill(self._remaining(deadline)):
+                return self._take(start)
+
+    @property
+    def in_waiting(self):
+        self._fill(0)
+        return len(self._rx)
+
+    def write(self, data):
+        self._tx += self._encode(bytes(data))
+        if len(self._tx) >= WRITE_BUFFER_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        while self._tx:
+            try:
+                sent = self.sock.send(self._tx)
+            except BlockingIOError:
+                sent = 0
+            del self._tx[:sent]
+            if self._tx:
+                select.select([], [self.sock], [])
+
+    def reset_input_buffer(self):
+        while self._fill(0):  # drop all read data
+            pass
+        self._rx.clear()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.sock.close()
+
+
+# -------------------------------------------------------------------------------------------------
+def open_url(url):
+    """ Open transport by URL:
+      tcp://host:port - raw TCP, telnet://host:port - serial over telnet (both are native),
+      anything else is passed to pyserial's `serial_for_url`: rfc2217://host:port, socket://host:port etc.
+    `baudrate=N` query parameter sets line's speed of pyserial ports (default is 115200)
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme in ("tcp", "telnet"):
+        if parts.hostname is None or parts.port is None:
+            raise RuntimeError("'{}' URL needs host and port".format(url))
+        if parts.scheme == "tcp":
+            return TcpTransport(parts.hostname, parts.port)
+        from .serial_over_telnet import SerialOverTelnet
+        return SerialOverTelnet(parts.hostname, parts.port)
+
+    query = urllib.parse.parse_qsl(parts.query)
+    baudrate = DEFAULT_BAUDRATE
+    for key, val in query:
+        if key == "baudrate":
+            baudrate = int(val)
+            url = parts._replace(query=urllib.parse.urlencode([q for q in query if q[0] != "baudrate"])).geturl()
+    return serial.serial_for_url(url, baudrate=baudrate)
@@ -1,20 +1,124 @@
 import serial
+import contextlib
 import logging
+import re
 import time
 from . import ymodem
+from . import kermit
 
 
 ENCODING = "ascii"
 LF = b"\n"
 CTRL_C = b"\x03"
+ESC = b"\x1b"
 PROMPTS = ("hisilicon #", "Zview #", "xmtech #", "hi3516dv300 #", "hi3519a #", "U-Boot>", "hi3516d #", "XiaoYi#", "hi3516cv500 #", "16dv300 #")
 READ_TIMEOUT = 0.5
+LOADY_BAUDRATES = (921600, 460800, 230400, 115200)  # candidates to fall back to if transfer fails
+LOADY_MAX_RETRIES = 5  # fail fast on escalated baudrate to fall back to a lower one
+BAUDRATE_SWITCH_DELAY = 0.1  # U-Boot waits 50ms before and after switching
+MD_SUFFIXES = {1: "b", 2: "w", 4: "l", 8: "q"}
+COMMAND_LINE_LIMIT = 255  # CONFIG_SYS_CBSIZE is 256 on HiSilicon's U-Boot
+BATCH_MARKER = "--hiburn-{}--"
+SF_ERRORS = ("failed", "error", "no spi flash", "usage:")  # U-Boot 2010.06 prints nothing on success
 
 
 def bytes_to_string(line):
     return line.decode(ENCODING, errors="replace").rstrip("\r\n")
 
 
+def parse_crc32_response(resp):
+    """ Checksum from `crc32` output like "CRC32 for 80000000 ... 8000ffff ==> 1c291ca3"
+    """
+    for line in resp:
+        if "==>" in line:
+            return int(line.split("==>")[1].strip().split()[0], 16)
+    raise RuntimeError("Couldn't parse 'crc32' output: {}".format(" ".join(resp)))
+
+
+def parse_sf_erase_size(probe_response):
+    """ Erase size from `sf probe` output like
+    "SF: Detected w25q128 with page size 256 Bytes, erase size 64 KiB, total 16 MiB", None if there is no one
+    """
+    for line in probe_response:
+        match = re.search(r"erase size (\d+) (KiB|Bytes)", line)
+        if match:
+            return int(match.group(1)) << (10 if match.group(2) == "KiB" else 0)
+    return None
+
+
+# -------------------------------------------------------------------------------------------------
+class PromptMatcher:
+    """ Precompiled matcher of U-Boot prompts (one alternation of all of them)
+    Prompt is printed at the beginning of a line and isn't followed by newline, so only the last
+    incomplete line of the stream has to be checked when new data arrives
+    """
+    def __init__(self, prompts=PROMPTS):
+        alternatives = b"|".join(re.escape(p.encode(ENCODING)) for p in sorted(prompts, key=len, reverse=True))
+        self._idle = re.compile(rb"\r?(?:" + alternatives + rb")\s*")
+
+    def is_prompt(self, line):
+        """ Whether `line` (bytes) is a bare prompt: console waits for a command
+        """
+        return self._idle.fullmatch(line) is not None
+
+
+# -------------------------------------------------------------------------------------------------
+class CommandBatch:
+    """ Commands queued to be sent as few `;`-joined lines as U-Boot's line length allows
+    Every command is followed by `echo <marker>`, so combined response is split back per command
+    """
+    def __init__(self, client, line_limit=COMMAND_LINE_LIMIT):
+        self.client = client
+        self.line_limit = line_limit
+        self.commands = []
+        self.responses = []
+
+    def add(self, cmd):
+        self.commands.append(cmd)
+
+    def _lines(self, commands, tail=None):
+        """ Group commands with their markers into lines, `tail` command goes last without a marker
+        """
+        lines, parts = [], []
+        for num, cmd in enumerate(commands, start=len(self.responses)):
+            part = "{}; echo {}".format(cmd, BATCH_MARKER.format(num))
+            if parts and len("; ".join(parts + [part])) > self.line_limit:
+                lines.append(parts)
+                parts = []
+            parts.append(part)
+        if tail is not None:
+            if parts and len("; ".join(parts + [tail])) > self.line_limit:
+                lines.append(parts)
+                parts = []
+            parts.append(tail)
+        if parts:
+            lines.append(parts)
+        return ["; ".join(parts) for parts in lines]
+
+    def _split_response(self, lines):
+        responses, current = [], []
+        for line in lines:
+            if line.strip() == BATCH_MARKER.format(len(self.responses) + len(responses)):
+                responses.append(current)
+                current = []
+            else:
+                current.append(line)
+        return responses
+
+    def flush(self, tail=None):
+        """ Send queued commands, with `tail` the last line is written but its response isn't read
+        Returns responses of queued commands
+        """
+        commands, self.commands = self.commands, []
+        lines = self._lines(commands, tail)
+        for num, line in enumerate(lines):
+            self.client.write_command(line)
+            if tail is not None and num == len(lines) - 1:
+                break
+            self.responses += self._split_response(self.client.read_response())
+        return self.responses
+
+
 class UBootClient:
     @classmethod
     def create_with_serial(cls, **kwargs):
@@ -25,18 +129,22 @@ class UBootClient:
         from .serial_over_telnet import SerialOverTelnet
         return cls(SerialOverTelnet(host, port))
 
+    @classmethod
+    def create_with_url(cls, url):
+        """ See transport.open_url for supported URLs
+        """
+        from .transport import open_url
+        return cls(open_url(url))
+
     def __init__(self, conn, prompts=PROMPTS):
         self.s = conn
         self.s.timeout = READ_TIMEOUT
         self.prompts = prompts
+        self._batch = None
+        self.tracer = None  # timings.Tracer to record commands' spans in
+        self._command_span = None
         logging.debug("UBootClient for {} constructed".format(self.s))
 
-    def _is_prompt(self, line):
-        for prompt in self.prompts:
-            if line.startswith(prompt):
-                return True
-        return False
-
     def _readline(self, raw=False):
         line = self.s.readline()
         if line:
@@ -49,56 +157,79 @@ class UBootClient:
         self.s.write(data)
         logging.debug(">> {}".format(data))
 
-    def fetch_console(self):
-        """ Wait for running U-Boot and try to enter console mode
+    def fetch_console(self, reset_cmd=None, stop=CTRL_C, interval=None, timeout=None):
+        """ Wait for running U-Boot and interrupt autoboot by `stop` string till prompt appears
+        `reset_cmd` shell command is run concurrently with reading, returns CaptureTimings
         """
+        from .console_capture import ConsoleCapture, INTERRUPT_INTERVAL
 
-        self.s.reset_input_buffer()
-
-        logging.debug("Wait for U-Boot printable output...")
-        while not self._readline().isprintable():
-            pass
-
-        logging.debug("Wait for prompt...")
-        while True:
-            self._write(CTRL_C)
-            if self._is_prompt(self._readline()):
-                break
-
-        logging.debug("Prompt received")
+        capture = ConsoleCapture(self.s, self.prompts, stop=stop,
+            interval=(INTERRUPT_INTERVAL if interval is None else interval), timeout=timeout)
+        timings = capture.run(reset_cmd)
+        logging.info("U-Boot console is fetched: {}".format(timings))
+        return timings
 
-        while True:
-            if self._readline().strip() in self.prompts:
-                break
-
-        logging.info("U-Boot console is fetched")
+    def _end_command_span(self):
+        if self._command_span is not None:
+            self.tracer.end(self._command_span)
+            self._command_span = None
 
     def write_command(self, cmd):
+        self._end_command_span()
+        if self.tracer is not None:  # the span lasts till the response is read
+            self._command_span = self.tracer.begin(cmd.split(None, 1)[0], "command", detail=cmd)
         self._write(cmd + "\n")
         echoed = self._readline()
         if not echoed.endswith(cmd):
             raise RuntimeError("echoed data '{}' doesn't match input '{}'".format(echoed, cmd))
 
-    def read_response(self, timeout=None, raw=False):
-        """ Read lines from serial port till prompt line is received or timeout exceeded
+    def iter_response(self, timeout=None):
+        """ Yield lines from serial port till prompt line is received or timeout exceeded
         """
 
-        response = []
         if timeout is not None:
             logging.debug("Read response with timeout={}...".format(timeout))
             self.s.timeout = timeout
-        
-        while True:
-            line = self._readline(raw=True)
-            if (not line) and (timeout is not None):
-                break  # readline timeout exceeded
-            line = bytes_to_string(line)
-            if line.strip() in self.prompts:
-                break  # prompt line is received
-            response.append(line)
-
-        self.s.timeout = READ_TIMEOUT  # restore original timeout
-        return response
+
+        try:
+            while True:
+                line = self._readline(raw=True)
+                if (not line) and (timeout is not None):
+                    break  # readline timeout exceeded
+                line = bytes_to_string(line)
+                if line.strip() in self.prompts:
+                    break  # prompt line is received
+                yield line
+        finally:
+            self.s.timeout = READ_TIMEOUT  # restore original timeout
+            self._end_command_span()
+
+    def read_response(self, timeout=None, raw=False):
+        """ Read lines from serial port till prompt line is received or timeout exceeded
+        """
+        return list(self.iter_response(timeout=timeout))
+
+    @contextlib.contextmanager
+    def batch(self, line_limit=COMMAND_LINE_LIMIT):
+        """ Queue commands which don't return anything (like `setenv`) and send them in a single round-trip
+        on exit; nested batches join the outer one. Yields CommandBatch which gets responses
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        self._batch = CommandBatch(self, line_limit)
+        try:
+            yield self._batch
+            self._batch.flush()
+        finally:
+            self._batch = None
+
+    def _run_or_queue(self, cmd):
+        if self._batch is not None:
+            self._batch.add(cmd)
+        else:
+            self.write_command(cmd)
+            self.read_response()
 
     # simple wraps for U-Boot commands are below
     def printenv(self):
@@ -106,11 +237,11 @@ class UBootClient:
         return self.read_response()
 
     def setenv(self, **kwargs):
-        for k, v in kwargs.items():
-            sv = str(v)
-            sv = sv.replace(";", "\;")
-            self.write_command("setenv {} {}".format(k, sv))
-            self.read_response()
+        with self.batch():
+            for k, v in kwargs.items():
+                sv = str(v)
+                sv = sv.replace(";", "\\;")
+                self._run_or_queue("setenv {} {}".format(k, sv))
 
     def ping(self, addr):
         self.write_command("ping {}".format(addr))
@@ -123,8 +254,60 @@ class UBootClient:
             self.write_command("tftp {:#x} {} {:#x}".format(addr, file_name, size))
         return self.read_response()
 
-    def bootm(self, uimage_addr, wait=True):
-        self.write_command("bootm {:#x}".format(uimage_addr))
+    def md(self, addr, count, width=4):
+        """ Dump `count` items of `width` bytes starting from `addr`, returns iterator over output lines
+        The output must be consumed completely before next command
+        """
+        self.write_command("md.{} {:#x} {:#x}".format(MD_SUFFIXES[width], addr, count))
+        return self.iter_response()
+
+    def cp(self, src_addr, dst_addr, size):
+        self.write_command("cp.b {:#x} {:#x} {:#x}".format(src_addr, dst_addr, size))
+        return self.read_response()
+
+    def crc32(self, addr, size):
+        self.write_command("crc32 {:#x} {:#x}".format(addr, size))
+        return parse_crc32_response(self.read_response())
+
+    def crc32_regions(self, regions):
+        """ CRC32 of every (addr, size) region, commands are sent in as few lines as fit
+        """
+        batch = CommandBatch(self)
+        for addr, size in regions:
+            batch.add("crc32 {:#x} {:#x}".format(addr, size))
+        return [parse_crc32_response(resp) for resp in batch.flush()]
+
+    def has_command(self, name):
+        self.write_command("help {}".format(name))
+        return not any(line.startswith("Unknown command") for line in self.read_response())
+
+    def _decompress(self, cmd, src_addr, dst_addr, size):
+        if size is None:
+            self.write_command("{} {:#x} {:#x}".format(cmd, src_addr, dst_addr))
+        else:
+            self.write_command("{} {:#x} {:#x} {:#x}".format(cmd, src_addr, dst_addr, size))
+        resp = self.read_response()
+        if not any(line.startswith("Uncompressed size") for line in resp):
+            raise RuntimeError("'{}' failed: {}".format(cmd, " ".join(resp)))
+        return resp
+
+    def unzip(self, src_addr, dst_addr, size=None):
+        return self._decompress("unzip", src_addr, dst_addr, size)
+
+    def lzmadec(self, src_addr, dst_addr, size=None):
+        return self._decompress("lzmadec", src_addr, dst_addr, size)
+
+    def bootm(self, uimage_addr, wait=True, fdt_addr=None):
+        """ Boot the image, commands queued in current batch are sent in the same line before `bootm`
+        Initrd is expected to be passed by `initrd=` of bootargs
+        """
+        cmd = "bootm {:#x}".format(uimage_addr)
+        if fdt_addr is not None:
+            cmd += " - {:#x}".format(fdt_addr)
+        if self._batch is not None:
+            self._batch.flush(tail=cmd)
+        else:
+            self.write_command(cmd)
         if not wait:
             return
         return self.read_response(timeout=5)
@@ -133,12 +316,105 @@ class UBootClient:
         self.write_command("sf probe {}".format(args))
         return self.read_response()
 
+    def _sf(self, cmd):
+        """ Run `sf` subcommand, raises RuntimeError if it reports a failure
+        (newer U-Boot reports "... OK" on success, older one prints nothing)
+        """
+        self.write_command(cmd)
+        resp = self.read_response()
+        if any(error in line.lower() for line in resp for error in SF_ERRORS):
+            raise RuntimeError("'{}' failed: {}".format(cmd, " ".join(resp)))
+        return resp
+
     def sf_read(self, dst_addr, flash_offset, size):
-        self.write_command("sf read {:#x} {:#x}".format(dst_addr, flash_offset, size))
-        return self.read_response()
+        return self._sf("sf read {:#x} {:#x} {:#x}".format(dst_addr, flash_offset, size))
+
+    def sf_write(self, src_addr, flash_offset, size):
+        """ Program flash, the region must be erased beforehand
+        """
+        return self._sf("sf write {:#x} {:#x} {:#x}".format(src_addr, flash_offset, size))
 
-    def loady(self, addr, data, long=True):
-        self.write_command("loady {:#x}".format(addr))
+    def sf_erase(self, flash_offset, size):
+        """ Both `flash_offset` and `size` must be multiples of flash's erase size
+        """
+        return self._sf("sf erase {:#x} {:#x}".format(flash_offset, size))
+
+    def _read_until(self, marker, timeout):
+        """ Read lines till one containing `marker` is received or `timeout` exceeded
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if marker in self._readline():
+                return True
+        return False
+
+    def _switch_baudrate(self, baudrate):
+        time.sleep(BAUDRATE_SWITCH_DELAY)
+        self.s.baudrate = baudrate
+        time.sleep(BAUDRATE_SWITCH_DELAY)
+        self.s.reset_input_buffer()
+
+    def loady(self, addr, data, long=True, streaming=False, baudrate=None):
+        """ Upload `data` (bytes-like object, file path or binary file object) to `addr` via YMODEM
+        `streaming` enables YMODEM-G if the receiver supports it.
+        With `baudrate` the transfer is done at that rate; if frames start failing it is retried
+        at lower rates from LOADY_BAUDRATES down to the console's one
+        """
+        console_baudrate = getattr(self.s, "baudrate", None)
+        if baudrate is None or baudrate == console_baudrate:
+            self.write_command("loady {:#x}".format(addr))
+            self._readline()
+            ymodem.YModem(self.s).transmit(data, long=long, streaming=streaming)
+            return self.read_response()
+
+        if console_baudrate is None:
+            raise RuntimeError("{} doesn't support baudrate switching".format(self.s))
+
+        fallbacks = [rate for rate in LOADY_BAUDRATES if console_baudrate < rate < baudrate]
+        for rate in [baudrate] + fallbacks:
+            try:
+                return self._loady_at_baudrate(addr, data, long, streaming, rate, console_baudrate)
+            except RuntimeError as err:
+                logging.warning("YMODEM upload at {} bps failed ({}), fall back to lower baudrate".format(rate, err))
+
+        return self.loady(addr, data, long=long, streaming=streaming)
+
+    def _loady_at_baudrate(self, addr, data, long, streaming, baudrate, console_baudrate):
+        self.write_command("loady {:#x} {}".format(addr, baudrate))
+        sender = ymodem.YModem(self.s, max_retries=LOADY_MAX_RETRIES)
+        if not self._read_until("press ENTER", timeout=READ_TIMEOUT * 4):
+            sender.cancel()  # U-Boot may have started receiving at the console baudrate
+            self.read_response()
+            raise RuntimeError("U-Boot doesn't ask to switch baudrate")
+
+        logging.info("Switch baudrate to {} bps for uploading".format(baudrate))
+        self._switch_baudrate(baudrate)
+        error = None
+        try:
+            self._write(b"\r")
+            try:
+                self._readline()  # "## Ready for binary (ymodem) download ..."
+                sender.transmit(data, long=long, streaming=streaming, handshake_timeout=READ_TIMEOUT * 10)
+            except RuntimeError as err:
+                sender.cancel()
+                error = err
+
+            # U-Boot asks to switch baudrate back both on success and failure
+            self._read_until("press ESC", timeout=READ_TIMEOUT * 10)
+        finally:  # the console is unusable at the escalated baudrate whatever happens
+            logging.info("Switch baudrate back to {} bps".format(console_baudrate))
+            self._switch_baudrate(console_baudrate)
+        self._write(ESC)
+        response = self.read_response()
+
+        if error is not None:
+            raise error
+        return response
+
+    def loadb(self, addr, data, packet_size=1000, window=1):
+        """ Upload `data` (bytes-like object, file path or binary file object) to `addr` via Kermit
+        """
+        self.write_command("loadb {:#x}".format(addr))
         self._readline()
-        ymodem.YModem(self.s).transmit(data, long=long)
+        kermit.Kermit(self.s, packet_size=packet_size, window=window).transmit(data)
         return self.read_response()
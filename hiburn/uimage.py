@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import struct
+import zlib
+from . import utils
+
+# Host-side inspection of images `bootm` boots: legacy uImage (64 bytes header, see U-Boot's image.h)
+# and FIT (flattened device tree with images and their hashes). Corrupted images are refused before upload,
+# and since the uploaded copy is verified by CRC32 anyway, `bootm` doesn't need to checksum it once more.
+
+
+LEGACY_MAGIC = 0x27051956
+LEGACY_HEADER = struct.Struct(">IIIIIIIBBBB32s")
+FDT_MAGIC = 0xd00dfeed
+FDT_HEADER = struct.Struct(">IIIIIIIIII")
+FDT_BEGIN_NODE, FDT_END_NODE, FDT_PROP, FDT_NOP, FDT_END = 1, 2, 3, 4, 9
+MAX_NODE_NAME = 256
+
+COMPRESSIONS = ("none", "gzip", "bzip2", "lzma", "lzo", "lz4", "zstd")
+OS_NAMES = {5: "linux", 17: "u-boot"}
+ARCH_NAMES = {2: "arm", 5: "mips", 22: "arm64"}
+TYPE_NAMES = {1: "standalone", 2: "kernel", 3: "ramdisk", 4: "multi", 5: "firmware", 6: "script", 8: "flat_dt",
+    14: "kernel_noload"}
+FIT_HASHES = ("crc32", "md5", "sha1", "sha256")
+UNKNOWN_COMPRESSION_RATIO = 4  # to estimate unpacked size if compressed format doesn't tell it
+
+
+# -------------------------------------------------------------------------------------------------
+class ImageInfo:
+    """ Single image: legacy uImage's payload or one of FIT's images
+    `data_offset` is payload's offset from the beginning of the file
+    """
+    def __init__(self, name, type, os, arch, compression, load, entry, data_offset, data_size):
+        self.name = name
+        self.type = type
+        self.os = os
+        self.arch = arch
+        self.compression = compression
+        self.load = load
+        self.entry = entry
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+    def __str__(self):
+        platform = " {}/{}".format(self.os, self.arch) if self.os or self.arch else ""
+        return "'{}' {}{}, {} bytes, compression {}, load address {}, entry point {}".format(
+            self.name, self.type, platform, self.data_size, self.compression,
+            "-" if self.load is None else "{:#x}".format(self.load),
+            "-" if self.entry is None else "{:#x}".format(self.entry))
+
+
+class LegacyImage:
+    format = "legacy"
+
+    def __init__(self, view):
+        if len(view) < LEGACY_HEADER.size:
+            raise RuntimeError("Image is shorter than uImage header")
+        header = bytes(view[:LEGACY_HEADER.size])
+        magic, self.hcrc, _, size, load, entry, self.dcrc, os, arch, type, comp, name = LEGACY_HEADER.unpack(header)
+        if zlib.crc32(header[:4] + bytes(4) + header[8:]) != self.hcrc:
+            raise RuntimeError("uImage header CRC32 mismatch")
+        self.kernel = ImageInfo(name.rstrip(b"\0").decode("ascii", errors="replace"), TYPE_NAMES.get(type, type),
+            OS_NAMES.get(os, os), ARCH_NAMES.get(arch, arch), COMPRESSIONS[comp] if comp < len(COMPRESSIONS) else comp,
+            load, entry, LEGACY_HEADER.size, size)
+        self.images = [self.kernel]
+
+    def verify(self, view):
+        if LEGACY_HEADER.size + self.kernel.data_size > len(view):
+            raise RuntimeError("uImage is truncated: {} bytes of data are expected, {} are there".format(
+                self.kernel.data_size, len(view) - LEGACY_HEADER.size))
+        if zlib.crc32(view[LEGACY_HEADER.size:LEGACY_HEADER.size + self.kernel.data_size]) != self.dcrc:
+            raise RuntimeError("uImage data CRC32 mismatch")
+
+
+# -------------------------------------------------------------------------------------------------
+class FdtNode:
+    def __init__(self, name):
+        self.name = name
+        self.props = {}  # name -> bytes, but "data" which is (offset, size) as it may be large
+        self.nodes = {}
+
+    def string(self, name, default=None):
+        value = self.props.get(name)
+        return default if value is None else value.rstrip(b"\0").decode("ascii", errors="replace")
+
+    def number(self, name):
+        value = self.props.get(name)
+        return None if value is None else int.from_bytes(value, "big")
+
+
+def parse_fdt(view):
+    """ Parse flattened device tree, returns root FdtNode
+    """
+    if len(view) < FDT_HEADER.size:
+        raise RuntimeError("Image is shorter than FDT header")
+    magic, total_size, struct_offset, strings_offset, _, version, _, _, strings_size, struct_size = \
+        FDT_HEADER.unpack_from(view)
+    if magic != FDT_MAGIC or total_size > len(view):
+        raise RuntimeError("Malformed or truncated FIT image")
+    strings = bytes(view[strings_offset:strings_offset + strings_size])
+
+    stack, root = [], None
+    pos = struct_offset
+    while True:
+        token, = struct.unpack_from(">I", view, pos)
+        pos += 4
+        if token == FDT_BEGIN_NODE:
+            name = bytes(view[pos:pos + MAX_NODE_NAME]).split(b"\0", 1)[0].decode("ascii", errors="replace")
+            pos = utils.align_address_up(4, pos + len(name) + 1)
+            node = FdtNode(name)
+            if stack:
+                stack[-1].nodes[name] = node
+            else:
+                root = node
+            stack.append(node)
+        elif token == FDT_END_NODE:
+            stack.pop()
+        elif token == FDT_PROP:
+            size, name_offset = struct.unpack_from(">II", view, pos)
+            pos += 8
+            name = strings[name_offset:strings.index(b"\0", name_offset)].decode("ascii", errors="replace")
+            stack[-1].props[name] = (pos, size) if name == "data" else bytes(view[pos:pos + size])
+            pos = utils.align_address_up(4, pos + size)
+        elif token == FDT_END:
+            return root
+        elif token != FDT_NOP:
+            raise RuntimeError("Malformed FIT image: unknown token {:#x} at {:#x}".format(token, pos - 4))
+
+
+class FitImage:
+    format = "FIT"
+
+    def __init__(self, view):
+        self.root = parse_fdt(view)
+        external_base = utils.align_address_up(4, FDT_HEADER.unpack_from(view)[1])
+
+        self.images = []
+        images = self.root.nodes.get("images", FdtNode("images")).nodes
+        for name, node in images.items():
+            if "data" in node.props:
+                data_offset, data_size = node.props["data"]
+            elif "data-position" in node.props:
+                data_offset, data_size = node.number("data-position"), node.number("data-size")
+            elif "data-offset" in node.props:
+                data_offset, data_size = external_base + node.number("data-offset"), node.number("data-size")
+            else:
+                raise RuntimeError("FIT image '{}' has no data".format(name))
+            self.images.append(ImageInfo(name, node.string("type"), node.string("os"), node.string("arch"),
+                node.string("compression", "none"), node.number("load"), node.number("entry"),
+                data_offset, data_size))
+
+        self.kernel = self._default_kernel(images)
+
+    def _default_kernel(self, images):
+        configs = self.root.nodes.get("configurations")
+        if configs is not None:
+            config = configs.nodes.get(configs.string("default"))
+            if config is not None and config.string("kernel") in images:
+                return next(i for i in self.images if i.name == config.string("kernel"))
+        for image in self.images:
+            if image.type in ("kernel", "kernel_noload"):
+                return image
+        raise RuntimeError("There is no kernel in FIT image")
+
+    def verify(self, view):
+        images = self.root.nodes["images"].nodes
+        for image in self.images:
+            if image.data_offset + image.data_size > len(view):
+                raise RuntimeError("FIT image '{}' is truncated".format(image.name))
+            for hash_node in images[image.name].nodes.values():
+                algo = hash_node.string("algo")
+                if algo not in FIT_HASHES:
+                    logging.debug("Skip '{}' hash of FIT image '{}'".format(algo, image.name))
+                    continue
+                with view[image.data_offset:image.data_offset + image.data_size] as data:
+                    if algo == "crc32":
+                        digest = zlib.crc32(data).to_bytes(4, "big")
+                    else:
+                        digest = hashlib.new(algo, data).digest()
+                if digest != hash_node.props.get("value"):
+                    raise RuntimeError("FIT image '{}' {} mismatch".format(image.name, algo))
+
+
+# -------------------------------------------------------------------------------------------------
+def load_size(src, info):
+    """ Amount of RAM `bootm` fills at the load address with payload of image `info` from `src` file
+    Size of unpacked gzip data is taken from its trailer, other methods are assumed to compress 4 times at most
+    """
+    if info.compression == "none":
+        return info.data_size
+    if info.compression == "gzip":
+        with utils.open_buffer(src) as view:
+            end = info.data_offset + info.data_size
+            return int.from_bytes(view[end - 4:end], "little")
+    return info.data_size * UNKNOWN_COMPRESSION_RATIO
+
+
+# -------------------------------------------------------------------------------------------------
+def inspect(src):
+    """ Parse and validate legacy uImage or FIT image `src` (file path or bytes-like object)
+    Returns LegacyImage or FitImage, raises RuntimeError if the image is corrupted or it's not an image at all
+    """
+    with utils.open_buffer(src) as view:
+        magic = int.from_bytes(view[:4], "big") if len(view) >= 4 else None
+        if magic == LEGACY_MAGIC:
+            image = LegacyImage(view)
+        elif magic == FDT_MAGIC:
+            image = FitImage(view)
+        else:
+            raise RuntimeError("'{}' is neither legacy uImage nor FIT image".format(utils.describe_data(src)))
+        image.verify(view)
+    return image
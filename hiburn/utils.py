@@ -1,5 +1,8 @@
+import contextlib
 import logging
+import mmap
 import os
+import zlib
 
 
 # -------------------------------------------------------------------------------------------------
@@ -77,63 +80,288 @@ def align_address_up(alignment, addr):
     return align_address_down(alignment, addr + alignment - 1)
 
 
+# -------------------------------------------------------------------------------------------------
+def regions_overlap(a_addr, a_size, b_addr, b_size):
+    return a_addr < b_addr + b_size and b_addr < a_addr + a_size
+
+
+# -------------------------------------------------------------------------------------------------
+def find_free_region(size, busy, start, end, alignment):
+    """ Find the highest aligned address in [start, end) for a region of `size` bytes
+    that doesn't overlap any of `busy` (addr, size) regions
+    """
+    candidates = [end - size] + [addr - size for addr, _ in busy]
+    for addr in sorted((align_address_down(alignment, c) for c in candidates), reverse=True):
+        if addr < start or addr + size > end:
+            continue
+        if not any(regions_overlap(addr, size, b_addr, b_size) for b_addr, b_size in busy):
+            return addr
+    raise RuntimeError("There is no free {} bytes region in memory [{:#x}, {:#x})".format(size, start, end))
+
+
+# -------------------------------------------------------------------------------------------------
+@contextlib.contextmanager
+def open_buffer(src):
+    """ Context manager yielding a read-only memoryview over `src`
+    `src` may be a bytes-like object, a file path or a binary file object.
+    Files are memory-mapped, so the data is paged in by OS on demand instead of being read in advance
+    """
+
+    if isinstance(src, (str, os.PathLike)):
+        with open(src, "rb") as f, open_buffer(f) as view:
+            yield view
+        return
+
+    if not hasattr(src, "read"):  # bytes-like object
+        with memoryview(src) as view, view.cast("B") as flat:
+            yield flat
+        return
+
+    try:
+        fileno = src.fileno()
+    except (AttributeError, OSError):
+        fileno = None
+
+    if fileno is None or os.fstat(fileno).st_size == 0:  # in-memory file object or empty file
+        with memoryview(src.getbuffer() if hasattr(src, "getbuffer") else src.read()) as view:
+            yield view
+        return
+
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+        yield view
+
+
+# -------------------------------------------------------------------------------------------------
+_crc32_cache = {}  # (path, mtime, size) -> CRC32, images are checked over and over again
+
+
+def crc32(src):
+    if isinstance(src, (str, os.PathLike)):
+        st = os.stat(src)
+        key = (os.path.abspath(src), st.st_mtime_ns, st.st_size)
+        if key not in _crc32_cache:
+            with open_buffer(src) as view:
+                _crc32_cache[key] = zlib.crc32(view)
+        return _crc32_cache[key]
+    with open_buffer(src) as view:
+        return zlib.crc32(view)
+
+
+# -------------------------------------------------------------------------------------------------
+def describe_data(src):
+    return "'{}'".format(src) if isinstance(src, (str, os.PathLike)) else "<buffer>"
+
+
+# -------------------------------------------------------------------------------------------------
+def data_size(src):
+    if isinstance(src, (str, os.PathLike)):
+        return os.path.getsize(src)
+    with open_buffer(src) as view:
+        return len(view)
+
+
+# -------------------------------------------------------------------------------------------------
+def skip_present_files(u_boot_client, files_and_addrs):
+    """ Filter out files which are already in device's RAM at their addresses (CRC32 matches)
+    """
+    res = []
+    for filename, addr in files_and_addrs:
+        size = data_size(filename)
+        if size and u_boot_client.crc32(addr, size) == crc32(filename):
+            logging.info("{} is already at address {:#x}, skip uploading".format(describe_data(filename), addr))
+        else:
+            res.append((filename, addr))
+    return res
+
+
+# -------------------------------------------------------------------------------------------------
+def verify_files(u_boot_client, files_and_addrs):
+    """ Check that files are in device's RAM at their addresses (CRC32 matches)
+    """
+    for filename, addr in files_and_addrs:
+        size = data_size(filename)
+        if size and u_boot_client.crc32(addr, size) != crc32(filename):
+            raise RuntimeError("{} at address {:#x} doesn't match CRC32 after uploading".format(
+                describe_data(filename), addr))
+        logging.debug("{} at address {:#x} is verified".format(describe_data(filename), addr))
+
+
 # -------------------------------------------------------------------------------------------------
 TFTP_SERVER_DEFAULT_PORT = 69
 
 
+class BufferReader:
+    """ Read-only file-like object over `src` (see `open_buffer`), file paths are memory-mapped
+    """
+    def __init__(self, src):
+        self._stack = contextlib.ExitStack()
+        self._view = self._stack.enter_context(open_buffer(src))
+        self._pos = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        end = len(self._view) if size < 0 else min(self._pos + size, len(self._view))
+        data = bytes(self._view[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: len(self._view)}[whence]
+        self._pos = base + offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._view = None
+            self._stack.close()
+
+
+class TftpReceiver:
+    """ File-like sink for data uploaded by device, it's written straight into `dst`
+    (file path or binary file object) with CRC32 computed on the fly.
+    A file object is written from its position at the moment the receiver is created
+    """
+    def __init__(self, name, dst):
+        self.name = name
+        self.dst = dst
+        self.start = dst.tell() if hasattr(dst, "write") and dst.seekable() else 0
+        self.crc32 = 0
+        self.size = 0
+        self.closed = False
+        self._fobj = None
+
+    def open(self):
+        if hasattr(self.dst, "write"):
+            self._fobj = self.dst
+            if self._fobj.seekable():  # transfer is restarted
+                self._fobj.seek(self.start)
+        else:
+            self._fobj = open(self.dst, "wb")
+        self.crc32 = 0
+        self.size = 0
+        self.closed = False
+        return self
+
+    def write(self, data):
+        self._fobj.write(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.size += len(data)
+
+    def close(self):
+        if not self.closed and self._fobj is not None:
+            self.closed = True
+            if self._fobj is not self.dst:
+                self._fobj.close()
+            else:
+                self._fobj.flush()
+
+
 class TftpContext:
     """ Context manager for TFTP server
+    Nothing is staged on disk: host files, buffers and file objects registered with `serve`
+    are read directly under virtual names, device's uploads go to destinations registered with `receive`
     """
 
     def __enter__(self):
+        self.server.bind(self.listen_ip, self.listen_port)
         self.thread.start()
         return self
 
     def __exit__(self, *args, **kwargs):
         self.server.stop()
         self.thread.join()
+        for receiver in self._receivers.values():
+            receiver.close()
 
-    def __init__(self, root_dir, listen_ip, listen_port=TFTP_SERVER_DEFAULT_PORT):
-        import tftpy
+    def __init__(self, listen_ip, listen_port=TFTP_SERVER_DEFAULT_PORT):
         import threading
+        from . import tftp
+
+        self._sources = {}
+        self._receivers = {}
+        self.listen_ip = listen_ip
+        self.listen_port = listen_port
+        self.server = tftp.TftpServer(open_read=self._open_source, open_write=self._open_receiver)
+        self.thread = threading.Thread(target=self.server.serve)
+
+    def serve(self, src, name=None):
+        """ Register `src` (file path, bytes-like object or binary file object) to be served as `name`
+        """
+        name = "hiburn{}".format(len(self._sources)) if name is None else name
+        self._sources[name] = src
+        return name
+
+    def receive(self, dst, name=None):
+        """ Register `dst` (file path or binary file object) to receive device's upload named `name`
+        Returns TftpReceiver which reports CRC32 and size of received data
+        """
+        name = "hiburn-rx{}".format(len(self._receivers)) if name is None else name
+        self._receivers[name] = TftpReceiver(name, dst)
+        return self._receivers[name]
+
+    def _open_source(self, name, client_addr):
+        src = self._sources.get(name)
+        return None if src is None else BufferReader(src)
+
+    def _open_receiver(self, name, client_addr):
+        receiver = self._receivers.get(name)
+        return None if receiver is None else receiver.open()
 
-        logging.getLogger("tftpy").setLevel(logging.WARN)
-
-        self.server = tftpy.TftpServer(root_dir)
 
-        def run():
-            self.server.listen(listen_ip, listen_port)
+# -------------------------------------------------------------------------------------------------
+def open_tftp_context(listen_ip, listen_port=TFTP_SERVER_DEFAULT_PORT):
+    """ Context registering transfers in running `hiburn serve` service if there is one,
+    own TftpContext otherwise
+    """
+    from . import tftp_service
 
-        self.thread = threading.Thread(target=run)
+    client = tftp_service.connect()
+    if client is not None:
+        logging.debug("Use TFTP service at '{}'".format(client.control_path))
+        return client
+    return TftpContext(listen_ip=listen_ip, listen_port=listen_port)
 
 
 # -------------------------------------------------------------------------------------------------
-def upload_files_via_tftp(u_boot_client, files_and_addrs, listen_ip, listen_port=TFTP_SERVER_DEFAULT_PORT):
-    import tempfile
-    import shutil
+def upload_files_via_tftp(u_boot_client, files_and_addrs, listen_ip, listen_port=TFTP_SERVER_DEFAULT_PORT,
+        skip_present=False, verify=False, tftp=None):
+    """ Upload files (or bytes-like objects) into device's RAM via TFTP
+    With `skip_present` files already in RAM (by CRC32) aren't uploaded, with `verify` CRC32 is checked afterwards.
+    `tftp` is a context to use instead of own one (see `open_tftp_context`)
+    """
+    if skip_present:
+        files_and_addrs = skip_present_files(u_boot_client, files_and_addrs)
+    if not files_and_addrs:
+        return
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        num = 0
-        with TftpContext(tmpdir, listen_ip=listen_ip, listen_port=listen_port):
-            for filename, addr in files_and_addrs:
-                logging.info("Upload '{}' via TFTP to address {:#x}".format(filename, addr))
-                tmp_filename = os.path.join(tmpdir, str(num))
-                num += 1
-                shutil.copyfile(filename, tmp_filename)
-                u_boot_client.tftp(addr, tmp_filename)
+    context = open_tftp_context(listen_ip=listen_ip, listen_port=listen_port) if tftp is None else tftp
+    with context as tftp:
+        for filename, addr in files_and_addrs:
+            logging.info("Upload {} via TFTP to address {:#x}".format(describe_data(filename), addr))
+            u_boot_client.tftp(addr, tftp.serve(filename))
 
+    if verify:
+        verify_files(u_boot_client, files_and_addrs)
 
-# -------------------------------------------------------------------------------------------------
-def download_files_via_tftp(uboot, files_addrs_sizes, listen_ip, listen_port=TFTP_SERVER_DEFAULT_PORT):
-    import tempfile
-    import shutil
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        num = 0
-        with TftpContext(tmpdir, listen_ip=listen_ip, listen_port=listen_port):
-            for filename, addr, size in files_addrs_sizes:
-                logging.info("Download {} bytes from {:#x} to '{}' via TFTP".format(size, addr, filename))
-                tmp_filename = os.path.join(tmpdir, str(num))
-                num += 1
-                uboot.tftp(addr, tmp_filename, size)
-                shutil.copyfile(tmp_filename, filename)
+# -------------------------------------------------------------------------------------------------
+def download_files_via_tftp(uboot, files_addrs_sizes, listen_ip, listen_port=TFTP_SERVER_DEFAULT_PORT,
+        verify=True, tftp=None):
+    """ Download device's memory regions straight into files (paths or binary file objects
+    written from their current position) via TFTP
+    With `verify` CRC32 of received data is checked against device's one
+    """
+    context = open_tftp_context(listen_ip=listen_ip, listen_port=listen_port) if tftp is None else tftp
+    with context as tftp:
+        for dst, addr, size in files_addrs_sizes:
+            logging.info("Download {} bytes from {:#x} to '{}' via TFTP".format(size, addr, getattr(dst, "name", dst)))
+            receiver = tftp.receive(dst)
+            uboot.tftp(addr, receiver.name, size)
+            if receiver.size != size:
+                raise RuntimeError("{} bytes are received via TFTP, {} are expected".format(receiver.size, size))
+            if verify and receiver.crc32 != uboot.crc32(addr, size):
+                raise RuntimeError("Data received via TFTP doesn't match CRC32 of device's memory")
@@ -1,5 +1,9 @@
 import logging
 import binascii
+import queue
+import threading
+import time
+from . import utils
 
 # http://pauillac.inria.fr/~doligez/zmodem/ymodem.txt
 
@@ -89,8 +93,10 @@ class YModem:
     NAK = b"\x15"
     CAN = b"\x18"
     C   = b"\x43"
+    G   = b"\x47"
 
     MAX_RETRIES = 50
+    STREAM_QUEUE_SIZE = 8  # frames prepared ahead of writer in YMODEM-G mode
     SHORT_PAYLOAD_SIZE = 128
     LONG_PAYLOAD_SIZE = 1024
 
@@ -117,74 +123,177 @@ class YModem:
         val = sum(int(b) for b in data) & 0xFF
         return bytes([val])
 
-    def __init__(self, serial):
+    def __init__(self, serial, max_retries=MAX_RETRIES):
         self.serial = serial
+        self.max_retries = max_retries
         self.counter = 0
         self.retry_counter = 0
         self.stat = None
 
+    def _frames(self, data, long=False, crc16=False, buffers=1):
+        """ Generate frames for `data` (bytes-like object) in a ring of `buffers` preallocated buffers
+        A buffer is overwritten again after `buffers` steps, so a frame must be sent before that
+        """
+        payload_size = self.LONG_PAYLOAD_SIZE if long else self.SHORT_PAYLOAD_SIZE
+        payload_end = 3 + payload_size
+
+        ring = [bytearray(payload_end + (2 if crc16 else 1)) for _ in range(buffers)]
+        for frame in ring:
+            frame[0] = (self.STX if long else self.SOH)[0]
+
+        with memoryview(data) as data_view:
+            for offset in range(0, len(data_view), payload_size):
+                frame = ring[self.counter % buffers]
+                payload = memoryview(frame)[3:payload_end]
+                chunk_size = min(len(data_view) - offset, payload_size)
+                num = self.counter & 0xFF
+                self.counter += 1
+
+                frame[1] = num
+                frame[2] = ~num & 0xFF
+                payload[:chunk_size] = data_view[offset:offset + chunk_size]
+                if chunk_size < payload_size:
+                    payload[chunk_size:] = bytes(payload_size - chunk_size)
+
+                if crc16:
+                    val = binascii.crc_hqx(payload, 0)
+                    frame[payload_end] = val >> 8
+                    frame[payload_end + 1] = val & 0xFF
+                else:
+                    frame[payload_end] = sum(payload) & 0xFF
+
+                payload.release()
+                yield frame, chunk_size
+
     def send_data(self, data, long=False, crc16=False):
-        PAYLOAD_SIZE = self.LONG_PAYLOAD_SIZE if long else self.SHORT_PAYLOAD_SIZE
-
-        head = self.STX if long else self.SOH
-        while data:
-            chunk_size = min(len(data), PAYLOAD_SIZE)
-            num = self.counter & 0xFF
-            padding = b"\0" * (PAYLOAD_SIZE - chunk_size)
-            payload = data[:chunk_size] + padding
-            tail = self.crc16(payload) if crc16 else self.checksum(payload)
-
-            self.counter += 1
-            frame = head + bytes([num, ~num & 0xFF]) + payload + tail
+        for frame, chunk_size in self._frames(data, long=long, crc16=crc16):
             self.send_frame(frame)
 
-            data = data[chunk_size:]
-
             if self.stat is not None:
                 self.stat.on_sent(chunk_size)
 
+    def send_data_streaming(self, data, long=False):
+        """ Send `data` YMODEM-G way: frames go back to back without waiting for ACK
+        Frames are built (and CRCs are calculated) by a producer thread ahead of the writer
+        """
+        frames = queue.Queue(maxsize=self.STREAM_QUEUE_SIZE)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                # consumer holds one frame and producer fills one more besides the queued ones
+                for item in self._frames(data, long=long, crc16=True, buffers=self.STREAM_QUEUE_SIZE + 2):
+                    if not put(item):
+                        return
+                put(None)
+            except Exception as err:
+                put(err)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                frame, chunk_size = item
+                self.serial.write(frame)
+                self.check_cancel()
+
+                if self.stat is not None:
+                    self.stat.on_sent(chunk_size)
+        finally:
+            stop.set()
+            producer.join()
+
+    def check_cancel(self):
+        """ Raise an error if receiver has cancelled transmission (doesn't block)
+        """
+        if getattr(self.serial, "in_waiting", 0) and self.serial.read(1) == self.CAN:
+            raise RuntimeError("YMODEM transmission is cancelled by receiver")
+
+    def wait_for(self, byte):
+        for _ in range(self.max_retries):
+            if self.serial.read(1) == byte:
+                return
+        raise RuntimeError("Could not receive {} from receiver".format(byte))
+
     def send_eot(self):
-         while True:
+        for _ in range(self.max_retries):
             self.serial.write(self.EOT)
             if self.serial.read(1) == self.ACK:
-                break
+                return
+        raise RuntimeError("Could not receive ACK for EOT after {} retries".format(self.max_retries))
+
+    def cancel(self):
+        """ Ask receiver to abort transmission
+        """
+        self.serial.write(self.CAN * 5)
     
     def send_frame(self, frame):
-        while self.retry_counter < self.MAX_RETRIES:
+        while self.retry_counter < self.max_retries:
             self.serial.write(frame)
             if self.serial.read(1) == self.ACK:
                 self.retry_counter = 0
                 return
-            logging.debug("Retry to send frame {}...".format(frame[:3]))
+            logging.debug("Retry to send frame {}...".format(bytes(frame[:3])))
             self.retry_counter += 1
 
-        raise RuntimeError("Could not send frame {}... after {} retires".format(frame[:3], self.retry_counter))
+        raise RuntimeError("Could not send frame {}... after {} retires".format(bytes(frame[:3]), self.retry_counter))
+
 
+    def transmit(self, src, file_path="", long=False, streaming=False, handshake_timeout=None):
+        """ Transmit `src` (bytes-like object, file path or binary file object)
+        Files are memory-mapped and sent frame by frame, so memory usage doesn't depend on file size.
+        With `streaming` YMODEM-G is used if receiver asks for it ('G' handshake)
+        """
+        with utils.open_buffer(src) as data:
+            self._transmit(data, file_path=file_path, long=long, streaming=streaming,
+                handshake_timeout=handshake_timeout)
 
-    def transmit(self, data, file_path="", long=False):
+    def _transmit(self, data, file_path, long, streaming, handshake_timeout):
         logging.info("YMODEM waits for handshake... (it may be about 10-20 seconds)")
 
-        crc = False
+        handshakes = (self.C, self.NAK, self.G) if streaming else (self.C, self.NAK)
+        deadline = None if handshake_timeout is None else time.monotonic() + handshake_timeout
         while True:
             handshake = self.serial.read(1)
-            if handshake == self.C:
-                crc = True
-                break
-            if handshake == self.NAK:
+            if handshake in handshakes:
                 break
-
-        logging.info("YMODEM got handshake, start transmission...")
-        self.send_data(
-            data=file_path.encode("ascii") + b"\0" + str(len(data)).encode("ascii"),
-            long=long,
-            crc16=crc
-        )
+            if deadline is not None and time.monotonic() > deadline:
+                raise RuntimeError("YMODEM handshake is not received in {} seconds".format(handshake_timeout))
+
+        crc = handshake != self.NAK
+        if streaming and handshake != self.G:
+            logging.info("YMODEM receiver doesn't support YMODEM-G, fall back to YMODEM")
+            streaming = False
+
+        logging.info("YMODEM{} got handshake, start transmission...".format("-G" if streaming else ""))
+        header = file_path.encode("ascii") + b"\0" + str(len(data)).encode("ascii")
+        if streaming:
+            self.send_data_streaming(data=header, long=long)
+            self.wait_for(self.G)  # receiver asks for data blocks
+        else:
+            self.send_data(data=header, long=long, crc16=crc)
 
         self.stat = self.Stat(len(data))
-        self.send_data(data=data, long=long, crc16=crc)
+        if streaming:
+            self.send_data_streaming(data=data, long=long)
+        else:
+            self.send_data(data=data, long=long, crc16=crc)
         logging.info("YMODEM all {} bytes of data has been transmitted".format(self.stat.total_bytes))
         self.stat = None
 
         self.send_eot()
         logging.info("YMODEM finished")
-
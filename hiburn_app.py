@@ -3,11 +3,12 @@ import logging
 import argparse
 import json
 import os
-import subprocess
-from hiburn.u_boot_client import UBootClient
+from hiburn.u_boot_client import UBootClient, CTRL_C
 from hiburn.config import add_arguments_from_config_desc, get_config_from_args
 from hiburn import utils
 from hiburn import actions
+from hiburn import console_capture
+from hiburn import timings
 
 
 
@@ -15,7 +16,9 @@ from hiburn import actions
 DEFAULT_CONFIG_DESC = {
     "net": {
         "device_ip": ("192.168.10.101", str, "Target IP address"),
-        "host_ip_mask": ("192.168.10.2/24", str, "Host IP address and mask's length")
+        "host_ip_mask": ("192.168.10.2/24", str, "Host IP address and mask's length"),
+        "tftp_block_size": ("1468", int, "TFTP block size for U-Boot's 'tftpblocksize' (0 to keep device's one)"),
+        "tftp_window_size": ("1", int, "TFTP window size for U-Boot's 'tftpwindowsize' (0 to keep device's one)")
     },
     "mem": {
         "start_addr": ("0x80000000", utils.hsize2int, "RAM start address"),
@@ -28,14 +31,10 @@ DEFAULT_CONFIG_DESC = {
 
 
 # -------------------------------------------------------------------------------------------------
-def reset_power(cmd=None):
-    if cmd is None:
-        print("Please, swith OFF the device's power and press Enter")
-        input()
-        print("Please, swith ON the device's power")
-    else:
-        logging.debug("Run '{}' shell command to reset power...".format(cmd))
-        subprocess.check_call(cmd, shell=True)
+def reset_power():
+    print("Please, swith OFF the device's power and press Enter")
+    input()
+    print("Please, swith ON the device's power")
 
 
 # -------------------------------------------------------------------------------------------------
@@ -45,17 +44,35 @@ def main():
         help="Print debug output"
     )
 
-    mutexg = parser.add_mutually_exclusive_group(required=True)
+    mutexg = parser.add_mutually_exclusive_group()
     mutexg.add_argument("--serial", type=utils.str2serial_kwargs, metavar="V",
         help="Serial port 'port[:baudrate[:DPS]]'")
     mutexg.add_argument("--serial-over-telnet", type=utils.str2endpoint, metavar="V",
         help="Serial-over-telnet endpoint '[host:]port'")
+    mutexg.add_argument("--serial-url", type=str, metavar="URL",
+        help="Console URL: 'rfc2217://host:port[?baudrate=N]', 'socket://host:port' (pyserial), "
+             "'tcp://host:port' (native raw TCP), 'telnet://host:port'")
 
     parser.add_argument("--no-fetch", "-n", action="store_true",
         help="Assume U-Boot's console is already fetched"
     )
     parser.add_argument("--reset-cmd", type=str,
-        help="Shell command to reset device's power"
+        help="Shell command to reset device's power, it runs while the console is already read"
+    )
+    parser.add_argument("--stop-string", type=console_capture.parse_stop_string, default=CTRL_C, metavar="S",
+        help="String to interrupt autoboot with, escapes are allowed (default: Ctrl-C '\\x03')"
+    )
+    parser.add_argument("--interrupt-interval", type=float, default=console_capture.INTERRUPT_INTERVAL, metavar="SEC",
+        help="Interval between interrupts sent since the first byte from device (default: %(default)s)"
+    )
+    parser.add_argument("--fetch-timeout", type=float, metavar="SEC",
+        help="Fail if U-Boot's prompt isn't received in that time"
+    )
+    parser.add_argument("--timings", action="store_true",
+        help="Print how long reset, console fetching, U-Boot commands and transfers took"
+    )
+    parser.add_argument("--timings-json", type=str, metavar="PATH",
+        help="Write timings report (all spans) to the JSON file"
     )
 
     add_arguments_from_config_desc(parser, DEFAULT_CONFIG_DESC)
@@ -64,23 +81,52 @@ def main():
         actions.ping,
         actions.download,
         actions.download_sf,
+        actions.upload_sf,
         actions.upload,
         actions.upload_y,
-        actions.boot
+        actions.boot,
+        actions.image_info,
+        actions.serve,
+        actions.fleet
     )
 
     args = parser.parse_args()
     logging.basicConfig(level=(logging.DEBUG if args.verbose else logging.INFO))
     config = get_config_from_args(args, DEFAULT_CONFIG_DESC)
 
+    if not getattr(args, "needs_client", True):
+        args.action(None, config, args)
+        return
+
+    if args.serial is None and args.serial_over_telnet is None and args.serial_url is None:
+        parser.error("one of the arguments --serial --serial-over-telnet --serial-url is required")
+
     if args.serial is not None:
         client = UBootClient.create_with_serial(**args.serial)
+    elif args.serial_url is not None:
+        client = UBootClient.create_with_url(args.serial_url)
     else:
         client = UBootClient.create_with_serial_over_telnet(*args.serial_over_telnet)
 
+    if args.timings or args.timings_json:
+        client.tracer = timings.Tracer()
+    try:
+        run(client, config, args)
+    finally:
+        if client.tracer is not None:
+            report_timings(client.tracer, args)
+
+
+def run(client, config, args):
     if not args.no_fetch:
-        reset_power(args.reset_cmd)
-        client.fetch_console()
+        if args.reset_cmd is None:
+            with timings.span(client.tracer, "power reset"):
+                reset_power()
+        with timings.span(client.tracer, "fetch console") as fetch_span:
+            capture = client.fetch_console(reset_cmd=args.reset_cmd, stop=args.stop_string,
+                interval=args.interrupt_interval, timeout=args.fetch_timeout)
+        if fetch_span is not None:
+            fetch_span.detail = capture.as_dict()
 
     if hasattr(args, "action"):
         args.action(client, config, args)
@@ -88,5 +134,12 @@ def main():
         print("Nothing to do here...")
 
 
+def report_timings(tracer, args):
+    if args.timings:
+        print(timings.format_table(tracer))
+    if args.timings_json:
+        tracer.save_json(args.timings_json)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,118 @@
+from hiburn.async_u_boot_client import AsyncUBootClient, PromptMatcher
+import asyncio
+import logging
+import pytest
+import time
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+PROMPT = b"hisilicon # "
+
+
+class FakeUBoot:
+    """ Console over TCP: autoboot countdown interrupted by Ctrl-C, then echoed commands with prompt after them
+    """
+    async def handle(self, reader, writer):
+        self.env = {"bootdelay": "1"}
+        writer.write(b"\r\nU-Boot 2010.06 (Jan 01 2020)\r\nHit any key to stop autoboot:  1 ")
+        while await reader.read(1) != b"\x03":
+            pass
+        writer.write(b"\r\n" + PROMPT + b"<INTERRUPT>\r\n" + PROMPT)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            cmd = line.decode().strip()
+            writer.write(cmd.encode() + b"\r\n")
+            writer.write(self.execute(cmd))
+            writer.write(PROMPT)
+            await writer.drain()
+        writer.close()
+
+    def execute(self, cmd):
+        args = cmd.split()
+        if args[0] == "printenv":
+            return b"".join("{}={}\r\n".format(k, v).encode() for k, v in self.env.items())
+        if args[0] == "setenv":
+            self.env[args[1]] = " ".join(args[2:])
+            return b""
+        if args[0] == "sf":
+            return b"No SPI flash selected. Please run `sf probe'\r\n"
+        if args[0] == "bootm":
+            return "## Booting kernel from Legacy Image at {} ...\r\n## Flattened Device Tree blob at {}\r\n".format(
+                args[1], args[3]).encode()
+        if args[0] == "crc32":
+            return "crc32 for {} ... {} ==> 1234abcd\r\n".format(args[1], args[2]).encode()
+        return "Unknown command '{}' - try 'help'\r\n".format(args[0]).encode()
+
+
+async def with_clients(count, body):
+    server = await asyncio.start_server(lambda r, w: FakeUBoot().handle(r, w), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    clients = [await AsyncUBootClient.create_with_tcp("127.0.0.1", port) for _ in range(count)]
+    try:
+        return await asyncio.gather(*(body(client) for client in clients))
+    finally:
+        for client in clients:
+            client.close()
+        server.close()
+
+
+# -------------------------------------------------------------------------------------------------
+def test_prompt_matcher():
+    matcher = PromptMatcher(("hisilicon #", "U-Boot>"))
+    assert matcher.is_prompt(b"hisilicon # ")
+    assert matcher.is_prompt(b"\rU-Boot>")
+    assert not matcher.is_prompt(b"hisilicon # printenv")
+    assert not matcher.is_prompt(b"  hisilicon #")
+
+
+def test_commands():
+    async def body(client):
+        await client.fetch_console()
+        await client.setenv(ipaddr="192.168.10.101", bootargs="a;b")
+        env = await client.printenv()
+        start = time.monotonic()
+        crc = await client.crc32(0x80000000, 0x100)
+        latency = time.monotonic() - start
+        unknown = await client.has_command("lzmadec")
+        with pytest.raises(RuntimeError, match="No SPI flash selected"):
+            await client.sf_read(0x82000000, 0, 0x1000)
+        boot = await client.bootm(0x82000000, fdt_addr=0x83000000)
+        return env, crc, latency, unknown, boot
+
+    for env, crc, latency, unknown, boot in asyncio.run(with_clients(3, body)):
+        assert env == ["bootdelay=1", "ipaddr=192.168.10.101", "bootargs=a\\;b"]
+        assert crc == 0x1234abcd
+        assert latency < 0.1  # the prompt isn't followed by newline, no read timeout is waited for
+        assert not unknown
+        assert boot[-1] == "## Flattened Device Tree blob at 0x83000000"
+
+
+class FakeSerialConnection:
+    """ Serial connection which answers `loady` with handshakes arriving right after the "Ready" line
+    """
+    def __init__(self):
+        self.serial = type("FakeSerial", (), {"timeout": 0})()
+        self.reader = asyncio.StreamReader()
+
+    def write(self, data):
+        self.reader.feed_data(data.strip() + b"\r\n## Ready for binary (ymodem) download at 115200 bps...\r\nCC")
+
+    async def drain(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        self.reader.feed_data(b"## Total Size = 0x4 = 4 Bytes\r\n" + PROMPT)
+
+
+def test_transfer_drops_handshakes():
+    async def body():
+        client = AsyncUBootClient(FakeSerialConnection())
+        return await client._transfer("loady 0x82000000", lambda serial: None)
+
+    assert asyncio.run(body()) == ["## Total Size = 0x4 = 4 Bytes"]
@@ -0,0 +1,54 @@
+from hiburn import chunked_dump
+import os
+import pytest
+
+
+class FakeDevice:
+    """ `fetch` for dump_chunked which fails once on chunk at `fail_offset`
+    """
+    def __init__(self, data, fail_offset=None):
+        self.data = data
+        self.fail_offset = fail_offset
+        self.fetched = []
+
+    def fetch(self, offset, length, f):
+        if offset == self.fail_offset:
+            self.fail_offset = None
+            raise RuntimeError("TFTP transfer failed")
+        self.fetched.append(offset)
+        f.write(self.data[offset:offset + length])
+
+
+# -------------------------------------------------------------------------------------------------
+def test_resume(tmp_path):
+    data = os.urandom(10 * 1000 + 1)
+    dst = str(tmp_path / "dump.bin")
+    region = {"ram": 0x80000000, "size": len(data)}
+    device = FakeDevice(data, fail_offset=6000)
+
+    with pytest.raises(RuntimeError):
+        chunked_dump.dump_chunked(dst, len(data), device.fetch, region, chunk_size=2000)
+    assert device.fetched == [0, 2000, 4000]
+    assert os.path.exists(dst + chunked_dump.PROGRESS_SUFFIX)
+
+    with open(dst, "r+b") as f:  # damaged chunk is dumped again
+        f.seek(2500)
+        f.write(b"\0")
+    device.fetched = []
+    chunked_dump.dump_chunked(dst, len(data), device.fetch, region, chunk_size=2000)
+    assert device.fetched == [2000, 6000, 8000, 10000]
+    with open(dst, "rb") as f:
+        assert f.read() == data
+    assert not os.path.exists(dst + chunked_dump.PROGRESS_SUFFIX)
+
+
+def test_progress_of_another_region(tmp_path):
+    data = os.urandom(5000)
+    dst = str(tmp_path / "dump.bin")
+    device = FakeDevice(data, fail_offset=4000)
+    with pytest.raises(RuntimeError):
+        chunked_dump.dump_chunked(dst, len(data), device.fetch, {"ram": 0x80000000, "size": 5000}, chunk_size=1000)
+
+    device.fetched = []
+    chunked_dump.dump_chunked(dst, len(data), device.fetch, {"ram": 0x81000000, "size": 5000}, chunk_size=1000)
+    assert device.fetched == [0, 1000, 2000, 3000, 4000]
@@ -0,0 +1,36 @@
+from hiburn import compression
+import gzip
+import lzma
+import os
+import pytest
+
+
+SERIAL_RATE = 115200 / 10
+
+
+# -------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize("method", ("gzip", "lzma"))
+def test_compress_file(tmp_path, method):
+    data = os.urandom(1000) * 300
+    src, dst = tmp_path / "image.bin", tmp_path / "image.packed"
+    src.write_bytes(data)
+    assert compression.compress_file(str(src), str(dst), method) == os.path.getsize(dst)
+    unpacked = gzip.decompress(dst.read_bytes()) if method == "gzip" else \
+        lzma.decompress(dst.read_bytes(), format=lzma.FORMAT_ALONE)
+    assert unpacked == data
+
+    with pytest.raises(ValueError):
+        compression.compress_file(str(src), str(dst), "zstd")
+
+
+def test_is_worth_compressing():
+    # a slow serial line makes even poor compression pay off
+    assert compression.is_worth_compressing(1 << 20, 900 << 10, SERIAL_RATE, "gzip")
+    assert compression.is_worth_compressing(1 << 20, 900 << 10, SERIAL_RATE, "lzma")
+    # over TFTP decompression and the extra command cost more than a few saved bytes
+    assert not compression.is_worth_compressing(1 << 20, 900 << 10, compression.TFTP_RATE, "gzip")
+    assert compression.is_worth_compressing(10 << 20, 1 << 20, compression.TFTP_RATE, "gzip")
+    # lzma's slow decompression eats up its better ratio on a fast link
+    assert not compression.is_worth_compressing(10 << 20, 5 << 20, compression.TFTP_RATE, "lzma")
+    # nothing is saved by incompressible data
+    assert not compression.is_worth_compressing(1 << 20, 1 << 20, SERIAL_RATE, "gzip")
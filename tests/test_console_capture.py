@@ -0,0 +1,84 @@
+from hiburn.console_capture import ConsoleCapture, parse_stop_string
+import pytest
+import time
+
+
+# -------------------------------------------------------------------------------------------------
+class FakePort:
+    """ Board which starts printing `delay` after creation and waits for `stop` for `bootdelay` seconds
+    """
+    def __init__(self, stop=b"\x03", delay=0.05, bootdelay=0.05):
+        self.timeout = None
+        self.stop = stop
+        self.start = time.monotonic()
+        self.delay = delay
+        self.bootdelay = bootdelay
+        self.received = b""
+        self.stopped = None
+        self.output = [(delay, b"\x00\xff\r\nU-Boot 2010.06\r\n"), (delay, b"Hit any key to stop autoboot:  0 ")]
+
+    def _now(self):
+        return time.monotonic() - self.start
+
+    def reset_input_buffer(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return sum(len(data) for at, data in self.output if at <= self._now())
+
+    def write(self, data):
+        self.received += data
+        if self.stopped is None and self.stop in self.received:
+            now = self._now()
+            if self.delay <= now <= self.delay + self.bootdelay:
+                self.stopped = now
+                self.output.append((now, b"\r\nhisilicon # "))
+        elif self.stopped is not None and data == self.stop:
+            self.output.append((self._now(), b"<INTERRUPT>\r\nhisilicon # "))
+
+    def read(self, size):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            ready = [item for item in self.output if item[0] <= self._now()]
+            if ready or time.monotonic() >= deadline:
+                break
+            time.sleep(0.001)
+        data = b"".join(data for _, data in ready)
+        self.output = [item for item in self.output if item not in ready]
+        if len(data) > size:
+            self.output.insert(0, (0, data[size:]))
+            data = data[:size]
+        return data
+
+
+# -------------------------------------------------------------------------------------------------
+def test_capture_short_bootdelay():
+    port = FakePort(bootdelay=0.03)
+    timings = ConsoleCapture(port, timeout=2).run()
+
+    assert port.stopped is not None
+    assert 0 < timings.first_byte < timings.prompt < 0.5
+    assert timings.interrupts >= 1
+    port.timeout = 0
+    assert port.read(100) == b""  # extra prompts are consumed
+
+
+def test_capture_stop_string():
+    port = FakePort(stop=b"stop")
+    timings = ConsoleCapture(port, stop=parse_stop_string("stop"), timeout=2).run(reset_cmd="true")
+
+    assert port.stopped is not None
+    assert timings.prompt is not None
+
+
+def test_capture_failures():
+    with pytest.raises(RuntimeError, match="isn't received"):
+        ConsoleCapture(FakePort(stop=b"stop"), timeout=0.3).run()
+    with pytest.raises(RuntimeError, match="failed with code 3"):
+        ConsoleCapture(FakePort(delay=1), timeout=2).run(reset_cmd="exit 3")
+
+
+def test_parse_stop_string():
+    assert parse_stop_string("\\x03") == b"\x03"
+    assert parse_stop_string("stop\\r") == b"stop\r"
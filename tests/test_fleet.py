@@ -0,0 +1,76 @@
+from hiburn import actions
+from hiburn import fleet
+from hiburn import tftp
+import io
+import json
+import os
+import socket
+import pytest
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# -------------------------------------------------------------------------------------------------
+def test_manifest(tmp_path):
+    path = tmp_path / "boards.json"
+    path.write_text(json.dumps({
+        "defaults": {"action": "boot", "args": {"uimage": "uImage", "rootfs": "rootfs"}, "config": {"mem": {"linux_size": "64M"}}},
+        "boards": [
+            {"name": "cam1", "serial": "/dev/ttyUSB0", "config": {"net": {"device_ip": "10.0.0.1"}}},
+            {"serial_over_telnet": "host:2001", "args": {"ymodem": True, "initrd_size": "8M"}},
+        ]
+    }))
+    boards = fleet.load_manifest(str(path))
+    assert [b["name"] for b in boards] == ["cam1", "board1"]
+    assert boards[1]["args"] == {"uimage": "uImage", "rootfs": "rootfs", "ymodem": True, "initrd_size": "8M"}
+
+    args = fleet.parse_action_args(actions.boot, boards[1]["args"])
+    assert (args.uimage, args.rootfs, args.ymodem, args.initrd_size) == ("uImage", "rootfs", True, 8 << 20)
+
+    config = {"net": {"device_ip": "192.168.10.101"}, "mem": {"linux_size": 256 << 20}}
+    fleet.update_config(config, boards[0]["config"])
+    assert config == {"net": {"device_ip": "10.0.0.1"}, "mem": {"linux_size": 64 << 20}}
+
+    with pytest.raises(RuntimeError):
+        fleet.check_device_ips(boards, config)
+
+
+def test_shared_tftp_routing(tmp_path):
+    image = tmp_path / "image.bin"
+    image.write_bytes(os.urandom(5000))
+    port = free_udp_port()
+    with fleet.SharedTftp("127.0.0.1", port) as shared:
+        board1, board2 = shared.board("127.0.0.1"), shared.board("127.0.0.2")
+        with board1, board2:
+            assert board1.serve(str(image)) == board2.serve(b"board2") == "hiburn0"
+
+            for ip, expected in (("127.0.0.1", image.read_bytes()), ("127.0.0.2", b"board2")):
+                out = io.BytesIO()
+                tftp.TftpClient("127.0.0.1", port, local_ip=ip, dally=False).download("hiburn0", out)
+                assert out.getvalue() == expected
+
+            receiver = board2.receive(io.BytesIO())
+            tftp.TftpClient("127.0.0.1", port, local_ip="127.0.0.2").upload(receiver.name, io.BytesIO(b"dump"))
+            assert (receiver.size, receiver.dst.getvalue()) == (4, b"dump")
+
+        with pytest.raises(tftp.TftpError):  # registrations are dropped with board's context
+            tftp.TftpClient("127.0.0.1", port, local_ip="127.0.0.2").download("hiburn0", io.BytesIO())
+
+
+def test_failed_boards_summary(tmp_path):
+    boards = [
+        {"name": "cam1", "action": "printenv", "serial": str(tmp_path / "no-such-tty"), "config": {}},
+        {"name": "cam2", "action": "boot", "serial": str(tmp_path / "no-such-tty"), "args": {},
+            "config": {"net": {"device_ip": "10.0.0.2"}}},
+    ]
+    config = {"net": {"device_ip": "10.0.0.1"}}
+    action_classes = {"printenv": actions.printenv, "boot": actions.boot}
+    results = fleet.run_fleet(boards, config, action_classes, jobs=2, listen_ip="127.0.0.1", listen_port=0)
+    assert [(r.name, r.ok) for r in results] == [("cam1", False), ("cam2", False)]
+    assert "invalid arguments" in results[1].error  # required --uimage and --rootfs are missing
+    summary = fleet.format_summary(results)
+    assert "cam1" in summary and "0 of 2 boards succeeded" in summary
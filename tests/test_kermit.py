@@ -0,0 +1,155 @@
+from hiburn.kermit import Kermit, tochar, unchar, block_check
+import logging
+import os
+import random
+import time
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+# Send-Init ACK of U-Boot's `loadb`: long packets of 94 * 95 + 94 bytes at most, no sliding windows
+U_BOOT_INIT_PARAMS = bytes([tochar(94), tochar(2), tochar(0), 0x40, tochar(Kermit.EOL), Kermit.QCTL, ord("N"),
+    ord("1"), ord(" "), tochar(Kermit.CAP_LONG_PACKETS), tochar(0), tochar(94), tochar(94)])
+WINDOWED_INIT_PARAMS = U_BOOT_INIT_PARAMS[:9] + bytes([
+    tochar(Kermit.CAP_LONG_PACKETS | Kermit.CAP_SLIDING_WINDOWS), tochar(31), tochar(94), tochar(94)])
+
+
+class FakeReceiver:
+    """ Sliding window Kermit receiver over a simulated link
+    Answers arrive `latency` seconds after packets, `error_rate` is a probability of a bit error in a packet
+    (in either direction). Send-Init is acknowledged with `init_params` (U-Boot's ones by default)
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, init_params=U_BOOT_INIT_PARAMS):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.init_params = init_params
+        self.rand = random.Random(1)
+        self.timeout = 0.05
+        self.buff = bytearray()
+        self.pending = []  # (ready time, bytes)
+        self.out = bytearray()
+        self.received = {}  # absolute packet number -> decoded data
+        self.next_num = 0  # first absolute packet number not received yet
+        self.types = []
+        self.max_packet = 0
+        self.max_outstanding = 0  # data packets received before answering the first of them
+
+    def _answer(self, seq, ptype, data=b""):
+        packet = bytearray(Kermit.make_packet(seq, ptype, data))
+        if self.rand.random() < self.error_rate:
+            packet[self.rand.randrange(2, len(packet) - 1)] ^= 1 << self.rand.randrange(7)
+        self.pending.append((time.monotonic() + self.latency, packet))
+
+    def write(self, data):
+        self.buff += data
+        while True:
+            start = self.buff.find(Kermit.MARK)
+            if start < 0 or len(self.buff) < start + 2:
+                return
+            length = unchar(self.buff[start + 1])
+            if length == 0:
+                if len(self.buff) < start + 6:
+                    return
+                length = 5 + unchar(self.buff[start + 4]) * 95 + unchar(self.buff[start + 5])
+            size = 2 + length + 1  # MARK, LEN, ..., EOL
+            if len(self.buff) < start + size:
+                return
+            packet = bytearray(self.buff[start:start + size])
+            del self.buff[:start + size]
+            self.max_packet = max(self.max_packet, size)
+            if self.rand.random() < self.error_rate:
+                packet[self.rand.randrange(2, len(packet) - 1)] ^= 1 << self.rand.randrange(8)
+            self._on_packet(bytes(packet))
+
+    def _on_packet(self, packet):
+        body = packet[1:-2]
+        head_len = 6 if body[0] == tochar(0) else 3
+        seq = unchar(body[1])
+        if block_check(body) != packet[-2] or body[2] not in b"SFDZB" or \
+                (head_len == 6 and block_check(body[:5]) != body[5]):
+            self._answer(seq, "N")
+            return
+        ptype = chr(body[2])
+        self.types.append(ptype)
+        if ptype == "S":
+            self._answer(seq, "Y", self.init_params)
+        elif ptype == "D":
+            delta = (seq - self.next_num) % 64
+            num = self.next_num + (delta if delta < 32 else delta - 64)
+            self.received[num] = Kermit.decode(body[head_len:])
+            while self.next_num in self.received:
+                self.next_num += 1
+            self._answer(seq, "Y")
+            self.max_outstanding = max(self.max_outstanding,
+                sum(1 for _, packet in self.pending if packet[3] == ord("Y")))
+        else:
+            if ptype == "F":
+                self.next_num = seq + 1  # data packets follow F packet
+            self._answer(seq, "Y")
+
+    def read(self, size):
+        deadline = time.monotonic() + self.timeout
+        while len(self.out) < size:
+            now = time.monotonic()
+            while self.pending and self.pending[0][0] <= now:
+                self.out += self.pending.pop(0)[1]
+            if len(self.out) >= size or now >= deadline:
+                break
+            time.sleep(0.0005)
+        data = bytes(self.out[:size])
+        del self.out[:size]
+        return data
+
+    @property
+    def data(self):
+        return b"".join(self.received[k] for k in sorted(self.received))
+
+
+# -------------------------------------------------------------------------------------------------
+def test_encoding():
+    data = bytes(range(256))
+    encoded = Kermit.encode(data)
+    assert all(32 <= b < 127 or b >= 160 for b in encoded)
+    assert Kermit.decode(encoded) == data
+
+
+def test_transmit_with_errors(tmp_path):
+    data = os.urandom(50000)
+    path = tmp_path / "image.bin"
+    path.write_bytes(data)
+
+    receiver = FakeReceiver(latency=0.002, error_rate=0.05, init_params=WINDOWED_INIT_PARAMS)
+    Kermit(receiver, packet_size=2000, window=8).transmit(str(path))
+
+    assert receiver.data == data
+    assert receiver.types[:2] == ["S", "F"] and receiver.types[-2:] == ["Z", "B"]
+    assert receiver.max_packet > 1000  # long packets are used
+
+
+def test_u_boot_negotiation():
+    receiver = FakeReceiver()
+    sender = Kermit(receiver, packet_size=2000, window=8)
+    sender.transmit(os.urandom(10000))
+    assert (sender.packet_size, sender.window) == (2000, 1)
+    assert receiver.max_outstanding == 1
+
+
+def test_negotiation():
+    receiver = FakeReceiver(init_params=bytes([tochar(80)]))  # receiver knows nothing about long packets
+    sender = Kermit(receiver, packet_size=2000, window=8)
+    sender.transmit(b"\x00" * 1000)
+
+    assert (sender.packet_size, sender.window) == (80, 1)
+    assert receiver.data == b"\x00" * 1000
+    assert receiver.max_packet <= 80 + 3
+
+
+def test_sliding_window():
+    data = os.urandom(64 * 1024)
+    receiver = FakeReceiver(latency=0.01, init_params=WINDOWED_INIT_PARAMS)
+    sender = Kermit(receiver, packet_size=1000, window=8)
+    sender.transmit(data)
+    assert sender.window == 8
+    assert receiver.data == data
+    assert receiver.max_outstanding > 1  # packets aren't sent one by one waiting for ACK
@@ -0,0 +1,49 @@
+from hiburn import layout
+from hiburn import uimage
+from test_uimage import make_legacy
+import gzip
+import os
+import pytest
+
+
+START, LINUX_SIZE, ALIGNMENT, UBOOT_SIZE = 0x80000000, 32 << 20, 0x10000, 512 << 10
+
+
+def write_kernel(tmp_path, data, comp):
+    path = tmp_path / "uImage"
+    path.write_bytes(make_legacy(data, comp=comp))
+    return str(path), uimage.inspect(str(path))
+
+
+# -------------------------------------------------------------------------------------------------
+def test_overlap():
+    ram = layout.Layout(START, START + LINUX_SIZE, ALIGNMENT)
+    ram.add("a", START, 0x1000)
+    with pytest.raises(RuntimeError, match="overlaps a"):
+        ram.add("b", START + 0xfff, 0x10)
+    assert ram.place("b", 0x10).addr == START + LINUX_SIZE - ALIGNMENT
+    assert not ram.is_free(START + LINUX_SIZE - ALIGNMENT + 8, 0x10)
+    assert not ram.is_free(START + LINUX_SIZE, 1)
+    assert "0x80000000 - 0x80001000" in ram.format_map()
+
+
+def test_xip_kernel(tmp_path):
+    kernel, image = write_kernel(tmp_path, os.urandom(100000), comp=0)
+    ram = layout.plan_boot(START, LINUX_SIZE, ALIGNMENT, UBOOT_SIZE, kernel, image, 1 << 20)
+    assert ram["kernel"].addr == 0x80008000 - uimage.LEGACY_HEADER.size
+    assert ram["U-Boot"].end == START + LINUX_SIZE
+    assert ram["rootfs"].end <= ram["U-Boot"].addr
+    assert all(r.kind != "load" for r in ram.regions)
+
+
+def test_compressed_kernel(tmp_path):
+    payload = os.urandom(200000)
+    kernel, image = write_kernel(tmp_path, gzip.compress(payload), comp=1)
+    ram = layout.plan_boot(START, LINUX_SIZE, ALIGNMENT, UBOOT_SIZE, kernel, image, 1 << 20)
+    load = ram["kernel payload"]
+    assert (load.addr, load.size) == (0x80008000, len(payload))
+    for name in ("kernel", "rootfs"):
+        assert ram[name].addr >= load.end
+
+    with pytest.raises(RuntimeError, match="overlaps kernel payload"):
+        layout.plan_boot(START, LINUX_SIZE, ALIGNMENT, UBOOT_SIZE, kernel, image, 1 << 20, upload_addr=0x80010000)
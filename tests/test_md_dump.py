@@ -0,0 +1,55 @@
+from hiburn import md_dump
+import io
+import os
+import zlib
+
+
+# -------------------------------------------------------------------------------------------------
+def md_output(ram, base, addr, count, width):
+    """ U-Boot's `md` output for little-endian device
+    """
+    lines = []
+    size = count * width
+    for line_addr in range(addr, addr + size, 16):
+        chunk = ram[line_addr - base:min(line_addr + 16, addr + size) - base]
+        items = [int.from_bytes(chunk[i:i + width], "little") for i in range(0, len(chunk), width)]
+        hex_part = " ".join("{:0{}x}".format(item, width * 2) for item in items)
+        ascii_part = "".join(chr(b) if 32 <= b < 127 else "." for b in chunk)
+        lines.append("{:08x}: {:<{}}    {}".format(line_addr, hex_part, (16 // width) * (width * 2 + 1) - 1, ascii_part))
+    return lines
+
+
+class FakeClient:
+    def __init__(self, ram, base):
+        self.ram = ram
+        self.base = base
+        self.commands = []
+
+    def md(self, addr, count, width=4):
+        self.commands.append((addr, count, width))
+        return iter(md_output(self.ram, self.base, addr, count, width))
+
+    def crc32(self, addr, size):
+        return zlib.crc32(self.ram[addr - self.base:addr - self.base + size])
+
+
+# -------------------------------------------------------------------------------------------------
+def test_parse_md_lines():
+    lines = [
+        "80000000: 56190527 a1b2c3d4 00000000 ffffffff    '..V............",
+        "80000010: 0000cafe                               ....",
+    ]
+    data = md_dump.parse_md_lines(lines, 0x80000000, 20, 4)
+    assert data == bytes.fromhex("27051956 d4c3b2a1 00000000 ffffffff feca0000")
+
+
+def test_download():
+    base = 0x80000000
+    ram = os.urandom(200 * 1024 + 3)
+    client = FakeClient(ram, base)
+    f = io.BytesIO()
+
+    md_dump.MdDownloader(client, f, base + 1, len(ram) - 1).run()
+
+    assert f.getvalue() == ram[1:]
+    assert {width for _, _, width in client.commands} == set(md_dump.TUNE_WIDTHS)
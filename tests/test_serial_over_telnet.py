@@ -0,0 +1,73 @@
+from hiburn.serial_over_telnet import SerialOverTelnet, IAC, DO, WILL, WONT, DONT, SB, SE
+import os
+import socket
+import threading
+import time
+
+
+# -------------------------------------------------------------------------------------------------
+class Server:
+    """ Local TCP server which runs `handler(conn)` for the single connection
+    """
+    def __init__(self, handler):
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._run, args=(handler,), daemon=True)
+        self.thread.start()
+
+    def _run(self, handler):
+        conn, _ = self.sock.accept()
+        with conn:
+            handler(conn)
+        self.sock.close()
+
+
+def recv_exactly(conn, size):
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+# -------------------------------------------------------------------------------------------------
+def test_telnet_commands_and_timeouts():
+    received = []
+
+    def handler(conn):
+        conn.sendall(bytes((IAC, DO, 1, IAC, WILL, 3)) + b"U-Bo")
+        time.sleep(0.05)
+        conn.sendall(bytes((IAC,)))  # command split between chunks
+        time.sleep(0.05)
+        conn.sendall(bytes((IAC, IAC, SB, 24, 1, IAC, SE)) + b"ot\r\nhisilicon # ")
+        received.append(recv_exactly(conn, 6 + 4))
+
+    server = Server(handler)
+    s = SerialOverTelnet("127.0.0.1", server.port)
+    s.timeout = 1
+    assert s.readline() == b"U-Bo\xff" + b"ot\r\n"
+    s.timeout = 0.1
+    start = time.monotonic()
+    assert s.read(100) == b"hisilicon # "  # less than requested on timeout
+    assert 0.1 <= time.monotonic() - start < 0.5
+    assert s.in_waiting == 0
+
+    s.write(b"\xff\x03")
+    s.close()
+    server.thread.join()
+    assert received == [bytes((IAC, WONT, 1, IAC, DONT, 3)) + b"\xff\xff\x03"]
+
+
+def test_large_reads():  # throughput is measured by benchmarks/bench_console.py
+    data = os.urandom(1024 * 1024).replace(b"\xff", b"\xfe") * 4
+    server = Server(lambda conn: conn.sendall(data))
+    s = SerialOverTelnet("127.0.0.1", server.port)
+    s.timeout = 5
+
+    parts = [s.read(1024 * 1024) for _ in range(len(data) // (1024 * 1024))]
+    s.close()
+    assert b"".join(parts) == data
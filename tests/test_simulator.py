@@ -0,0 +1,405 @@
+from hiburn import actions
+from hiburn import fleet
+from hiburn import md_dump
+from hiburn import simulator
+from hiburn import u_boot_client
+from hiburn import utils
+from hiburn.transport import TcpTransport
+from hiburn.u_boot_client import UBootClient
+import gzip
+import io
+import os
+import socket
+import struct
+import threading
+import zlib
+import pytest
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_simulator(monkeypatch, transport=TcpTransport, **kwargs):
+    """ Simulator serving a single TCP connection, returns UBootClient connected to it by `transport(host, port)`
+    """
+    monkeypatch.setattr(u_boot_client, "READ_TIMEOUT", 0.05)  # prompt isn't followed by newline
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1)
+
+    def run():
+        conn, _ = sock.accept()
+        sock.close()
+        with conn:
+            simulator.UBootSimulator(conn.fileno(), **dict({"baudrate": None}, **kwargs)).run()
+
+    threading.Thread(target=run, daemon=True).start()
+    return UBootClient(transport(*sock.getsockname()))
+
+
+class SerialLikeTransport(TcpTransport):
+    """ TcpTransport with serial port's `baudrate`, every set rate is recorded. YMODEM frames written above
+    `max_baudrate` are garbled like at a rate the line can't stand (short control sequences get through),
+    writes at `broken_baudrate` raise OSError
+    """
+    def __init__(self, host, port, max_baudrate=None, broken_baudrate=None):
+        super().__init__(host, port)
+        self.max_baudrate = max_baudrate
+        self.broken_baudrate = broken_baudrate
+        self.rates = []
+        self._baudrate = 115200
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self.rates.append(value)
+        self._baudrate = value
+
+    def write(self, data):
+        if self._baudrate == self.broken_baudrate:
+            raise OSError("Line is broken")
+        if self.max_baudrate is not None and self._baudrate > self.max_baudrate and len(data) >= 128:
+            data = bytes(b ^ 0x5a for b in data)
+        return super().write(data)
+
+
+def make_uimage(data, name=b"Linux-simulated"):
+    header = struct.pack(">IIIIIIIBBBB32s", simulator.UIMAGE_MAGIC, 0, 0, len(data), 0x80008000, 0x80008000,
+        zlib.crc32(data), 5, 2, 2, 0, name)
+    hcrc = zlib.crc32(header)
+    return header[:4] + struct.pack(">I", hcrc) + header[8:] + data
+
+
+def record_uploads(monkeypatch, client):
+    """ Record sizes of data given to uploading protocols and (src, dst, count) of `cp` commands
+    """
+    uploaded, copied = [], []
+    upload = actions.Action._upload_files_by_args
+    monkeypatch.setattr(actions.Action, "_upload_files_by_args", lambda self, args, *files: (
+        uploaded.extend(utils.data_size(src) for src, _ in files), upload(self, args, *files)))
+    cp = client.cp
+    monkeypatch.setattr(client, "cp", lambda *args: (copied.append(args), cp(*args)))
+    return uploaded, copied
+
+
+# -------------------------------------------------------------------------------------------------
+def test_sparse_memory():
+    mem = simulator.SparseMemory(0x1000, 4 * simulator.PAGE_SIZE, fill=0xff)
+    mem.write(0x1000 + simulator.PAGE_SIZE - 2, b"\x0f\x0f\x0f\x0f")
+    assert len(mem.pages) == 2
+    mem.write(0x1000 + simulator.PAGE_SIZE - 2, b"\xf0\xf0\xf0\xf0", program=True)  # NOR clears bits only
+    assert mem.read(0x1000 + simulator.PAGE_SIZE - 3, 6) == b"\xff\x00\x00\x00\x00\xff"
+    mem.erase(0x1000, simulator.PAGE_SIZE)
+    assert mem.read(0x1000 + simulator.PAGE_SIZE - 2, 4) == b"\xff\xff\x00\x00"
+
+
+def test_console_commands(monkeypatch):
+    env = dict(simulator.DEFAULT_ENV, bootcmd="bootm 0x82000000")
+    client = start_simulator(monkeypatch, env=env, error_rate=0.0005, seed=1)
+    client.fetch_console(timeout=5)
+
+    client.setenv(ipaddr="127.0.0.1", bootargs="a;b")
+    assert "bootargs=a;b" in client.printenv()
+    assert not client.has_command("lzmadec2")
+
+    data = os.urandom(100 * 1024 + 7)
+    client.loady(0x82000000, data)  # some frames are corrupted and repeated
+    assert client.crc32(0x82000000, len(data)) == zlib.crc32(data)
+    dump = io.BytesIO()
+    md_dump.MdDownloader(client, dump, 0x82000000, 1000).run()
+    assert dump.getvalue() == data[:1000]
+
+    packed = gzip.compress(data)
+    client.loady(0x83000000, packed)
+    client.unzip(0x83000000, 0x84000000)
+    assert client.crc32(0x84000000, len(data)) == zlib.crc32(data)
+
+    with pytest.raises(RuntimeError, match="No SPI flash selected"):
+        client.sf_read(0x85000000, 0, 0x10000)
+    client.sf_probe("0")
+    client.cp(0x82000000, 0x85000000, 0x10000)
+    assert client.sf_read(0x85000000, 0, 0x10000) == []  # U-Boot 2010.06 prints nothing
+    with pytest.raises(RuntimeError, match="erase failed"):
+        client.sf_erase(0x100, 0x10000)
+    assert client.crc32(0x85000000, 0x10000) == zlib.crc32(b"\xff" * 0x10000)  # erased flash
+
+    client.bootm(0x82000000, wait=False)
+    resp = client.read_response()
+    assert resp[-1] == "ERROR: can't get kernel image!"
+    client.s.close()
+
+
+def test_loady_baudrate_fallback(monkeypatch):
+    transport = lambda host, port: SerialLikeTransport(host, port, max_baudrate=460800)
+    client = start_simulator(monkeypatch, transport=transport, baudrate=115200)
+    client.fetch_console(timeout=5)
+
+    data = os.urandom(20 * 1024)
+    client.loady(0x82000000, data, baudrate=921600)  # frames are garbled at 921600
+    assert client.s.rates == [921600, 115200, 460800, 115200]
+    assert client.crc32(0x82000000, len(data)) == zlib.crc32(data)
+    client.s.close()
+
+
+def test_loady_baudrate_restored_on_error(monkeypatch):
+    transport = lambda host, port: SerialLikeTransport(host, port, broken_baudrate=921600)
+    client = start_simulator(monkeypatch, transport=transport, baudrate=115200)
+    client.fetch_console(timeout=5)
+
+    with pytest.raises(OSError):
+        client.loady(0x82000000, b"data", baudrate=921600)
+    assert client.s.baudrate == 115200
+    client.s.close()
+
+
+def test_tftp_and_boot(monkeypatch, tmp_path):
+    port = free_udp_port()
+    client = start_simulator(monkeypatch, tftp_port=port)
+    client.fetch_console(timeout=5)
+    client.setenv(ipaddr="127.0.0.1", serverip="127.0.0.1", tftpblocksize=1468)
+
+    kernel = make_uimage(os.urandom(300 * 1024))
+    path = tmp_path / "uImage"
+    path.write_bytes(kernel)
+    utils.upload_files_via_tftp(client, ((str(path), 0x82000000),), listen_ip="127.0.0.1", listen_port=port,
+        verify=True)
+
+    client.bootm(0x82000000, wait=False)
+    resp = client.read_response(timeout=0.5)
+    assert "   Image Name:   Linux-simulated" in resp
+    assert "Starting kernel ..." in resp
+    client.s.close()
+
+
+def test_upload_sf_rewrites_changed_blocks(monkeypatch, tmp_path):
+    flash = simulator.SparseMemory(0, simulator.FLASH_SIZE, fill=0xff)
+    flash.write(0x140000 - 50, b"config")  # right behind the image, in its last erase block
+    erased = []
+    monkeypatch.setattr(flash, "erase", lambda offset, size, erase=flash.erase: (
+        erased.append((offset, size)), erase(offset, size)))
+    client = start_simulator(monkeypatch, flash=flash)
+    client.fetch_console(timeout=5)
+
+    image = bytearray(os.urandom(4 * simulator.FLASH_SECTOR_SIZE - 100))
+    path = tmp_path / "rootfs.img"
+    path.write_bytes(image)
+    config = {"mem": {"start_addr": 0x80000000, "alignment": 0x10000, "linux_size": 32 << 20}}
+    args = fleet.parse_action_args(actions.upload_sf, {"probe": "0", "src": str(path), "offset": "1M", "ymodem": True})
+    actions.upload_sf(client, config).run(args)
+    assert erased == [(0x100000, 0x40000)]
+    assert flash.read(0x100000, len(image)) == image
+    assert flash.read(0x140000 - 100, 56) == b"\xff" * 50 + b"config"
+
+    erased.clear()
+    image[2 * simulator.FLASH_SECTOR_SIZE + 10] ^= 1
+    path.write_bytes(image)
+    actions.upload_sf(client, config).run(args)
+    assert erased == [(0x120000, simulator.FLASH_SECTOR_SIZE)]
+    assert flash.read(0x100000, len(image)) == image
+    client.s.close()
+
+
+def test_upload_sf_doesnt_fit(monkeypatch, tmp_path):
+    client = start_simulator(monkeypatch)
+    client.fetch_console(timeout=5)
+    uploaded, _ = record_uploads(monkeypatch, client)
+
+    path = tmp_path / "rootfs.img"
+    path.write_bytes(os.urandom(4 * simulator.FLASH_SECTOR_SIZE))
+    config = {"mem": {"start_addr": 0x80000000, "alignment": 0x10000, "linux_size": 768 << 10, "uboot_size": 512 << 10}}
+    args = fleet.parse_action_args(actions.upload_sf, {"probe": "0", "src": str(path), "ymodem": True})
+    with pytest.raises(RuntimeError, match="no free"):  # image and flash readback don't fit beneath U-Boot
+        actions.upload_sf(client, config).run(args)
+
+    config["mem"]["linux_size"] = 4 << 20
+    args = fleet.parse_action_args(actions.upload_sf, {"probe": "0", "src": str(path), "addr": "0x803c0000",
+        "ymodem": True})
+    with pytest.raises(RuntimeError, match="out of free Linux RAM"):
+        actions.upload_sf(client, config).run(args)
+    assert not uploaded
+    client.s.close()
+
+
+def test_download_sf_by_chunks(monkeypatch, tmp_path):
+    flash = simulator.SparseMemory(0, simulator.FLASH_SIZE, fill=0xff)
+    data = os.urandom(10000)
+    flash.write(0x10000, data)
+    client = start_simulator(monkeypatch, flash=flash)
+    client.fetch_console(timeout=5)
+
+    dst = tmp_path / "dump.bin"
+    config = {"mem": {"start_addr": 0x80000000, "alignment": 0x10000, "linux_size": 32 << 20}}
+    args = fleet.parse_action_args(actions.download_sf, {"probe": "0", "size": len(data), "offset": "64K",
+        "dst": str(dst), "md": True, "md_width": 4, "md_batch_size": 2048, "chunk_size": 4096})
+    actions.download_sf(client, config).run(args)
+    assert dst.read_bytes() == data
+
+    for options, error in (({"addr": 0x80000000 + (32 << 20) - 1024}, "out of free Linux RAM"),
+            ({"chunk_size": "64M"}, "no free")):
+        args = fleet.parse_action_args(actions.download_sf, dict({"probe": "0", "size": "40M", "dst": str(dst),
+            "md": True, "chunk_size": 4096}, **options))
+        with pytest.raises(RuntimeError, match=error):
+            actions.download_sf(client, config).run(args)
+    client.s.close()
+
+
+def test_download_sf_against_reference(monkeypatch, tmp_path):
+    golden = os.urandom(100 * 1024)
+    board = bytearray(golden)
+    board[40 * 1024:40 * 1024 + 6] = b"config"
+    flash = simulator.SparseMemory(0, simulator.FLASH_SIZE, fill=0xff)
+    flash.write(0, bytes(board) + b"tail")
+    client = start_simulator(monkeypatch, flash=flash)
+    client.fetch_console(timeout=5)
+
+    transferred = []
+    download = actions.Action._download_files_by_args
+    monkeypatch.setattr(actions.Action, "_download_files_by_args",
+        lambda self, args, *files: (transferred.extend(size for _, _, size in files), download(self, args, *files)))
+
+    reference = tmp_path / "golden.bin"
+    reference.write_bytes(golden)
+    dst = tmp_path / "dump.bin"
+    config = {"mem": {"start_addr": 0x80000000, "alignment": 0x10000, "linux_size": 32 << 20}}
+    args = fleet.parse_action_args(actions.download_sf, {"probe": "0", "size": len(golden) + 4, "dst": str(dst),
+        "md": True, "md_width": 4, "md_batch_size": 4096, "reference": str(reference), "reference_block_size": "16K"})
+    actions.download_sf(client, config).run(args)
+    assert dst.read_bytes() == bytes(board) + b"tail"
+    assert transferred == [16 * 1024, 4 * 1024 + 4]  # changed block and partial tail block
+    client.s.close()
+
+
+def test_upload_skips_present_files(monkeypatch, tmp_path):
+    client = start_simulator(monkeypatch)
+    client.fetch_console(timeout=5)
+    uploaded, _ = record_uploads(monkeypatch, client)
+
+    image = bytearray(os.urandom(10000))
+    path = tmp_path / "image.bin"
+    path.write_bytes(image)
+    config = {"mem": {"start_addr": 0x80000000, "alignment": 0x10000, "linux_size": 32 << 20}}
+
+    def upload(**kwargs):
+        uploaded.clear()
+        args = fleet.parse_action_args(actions.upload, dict({"src": str(path), "addr": "0x81000000",
+            "ymodem": True}, **kwargs))
+        actions.upload(client, config).run(args)
+        return uploaded
+
+    assert upload() == [len(image)]
+    assert upload() == []  # it's already there
+    assert upload(force_upload=True) == [len(image)]
+    image[5000] ^= 1
+    path.write_bytes(image)
+    assert upload() == [len(image)]
+    assert client.crc32(0x81000000, len(image)) == zlib.crc32(image)
+
+    image[5000] ^= 1
+    path.write_bytes(image)
+    monkeypatch.setattr(actions.Action, "upload_y_files", lambda self, *files, **kwargs: None)  # data is lost
+    with pytest.raises(RuntimeError, match="doesn't match CRC32"):
+        upload()
+    client.s.close()
+
+
+@pytest.mark.parametrize("method", ("gzip", "lzma"))
+def test_compressed_upload(monkeypatch, tmp_path, method):
+    monkeypatch.delattr(simulator.UBootSimulator, "cmd_lzmadec")  # lzma falls back to gzip
+    client = start_simulator(monkeypatch)
+    client.fetch_console(timeout=5)
+    uploaded, _ = record_uploads(monkeypatch, client)
+    unpacked = []
+    unzip = client.unzip
+    monkeypatch.setattr(client, "unzip", lambda *args: (unpacked.append(args), unzip(*args)))
+
+    data = b"".join(b"line %d of compressible image\n" % num for num in range(10000))
+    path = tmp_path / "image.bin"
+    path.write_bytes(data)
+    config = {"mem": {"start_addr": 0x80000000, "alignment": 0x10000, "linux_size": 32 << 20}}
+    args = fleet.parse_action_args(actions.upload, {"src": str(path), "addr": "0x81000000", "ymodem": True,
+        "compress": method})
+    actions.upload(client, config).run(args)
+
+    assert len(uploaded) == 1 and uploaded[0] < len(data) // 4
+    assert [(dst, size) for _, dst, size in unpacked] == [(0x81000000, len(data))]
+    assert client.crc32(0x81000000, len(data)) == zlib.crc32(data)
+    client.s.close()
+
+
+@pytest.mark.parametrize("protocol", ("ymodem", "tftp"))
+def test_delta_upload(monkeypatch, tmp_path, protocol):
+    monkeypatch.setenv("HIBURN_TFTP_SOCKET", str(tmp_path / "no-service.sock"))
+    port = free_udp_port()
+    client = start_simulator(monkeypatch, tftp_port=port)
+    client.fetch_console(timeout=5)
+    addr, block_size = 0x82000000, 16 * 1024
+    image = bytearray(os.urandom(16 * block_size - 100))
+    client.loady(addr, bytes(image))
+
+    for num in (2, 3, 9):
+        image[num * block_size + 10] ^= 1
+    path = tmp_path / "image.bin"
+    path.write_bytes(image)
+    config = {"net": {"device_ip": "127.0.0.1", "host_ip_mask": "127.0.0.1/8"},
+        "mem": {"start_addr": 0x80000000, "alignment": 0x10000, "linux_size": 64 << 20}}
+    args = fleet.parse_action_args(actions.upload, dict({"src": str(path), "addr": hex(addr), "delta": True,
+        "delta_block_size": "16K"}, **({"ymodem": True} if protocol == "ymodem" else {})))
+    uploaded, copied = record_uploads(monkeypatch, client)
+
+    with fleet.SharedTftp("127.0.0.1", port) as shared:
+        def run():
+            action = actions.upload(client, config)
+            action.tftp = fleet.BoardTftp(shared, "127.0.0.1")
+            action.run(args)
+
+        run()
+        assert client.crc32(addr, len(image)) == zlib.crc32(image)
+        if protocol == "ymodem":  # ranges are sent straight to their places
+            assert uploaded == [2 * block_size, block_size] and not copied
+        else:  # ranges are staged at once and copied to their places
+            assert uploaded == [3 * block_size]
+            assert [(dst, count) for _, dst, count in copied] == \
+                [(addr + 2 * block_size, 2 * block_size), (addr + 9 * block_size, block_size)]
+
+        uploaded.clear()
+        copied.clear()
+        for num in range(10):  # more than half of blocks differ
+            image[num * block_size] ^= 1
+        path.write_bytes(image)
+        run()
+        assert uploaded == [len(image)] and not copied
+        assert client.crc32(addr, len(image)) == zlib.crc32(image)
+    client.s.close()
+
+
+def test_boot_action(monkeypatch, tmp_path, capsys):
+    client = start_simulator(monkeypatch)
+    client.fetch_console(timeout=5)
+
+    kernel = tmp_path / "uImage"
+    kernel.write_bytes(make_uimage(os.urandom(64 * 1024)))
+    rootfs = tmp_path / "rootfs"
+    rootfs.write_bytes(os.urandom(32 * 1024))
+    config = {"net": {"device_ip": "127.0.0.1", "host_ip_mask": "127.0.0.1/8"}, "linux_console": "ttyAMA0,115200",
+        "mem": {"start_addr": 0x80000000, "alignment": 0x10000, "linux_size": 32 << 20, "uboot_size": 512 << 10}}
+
+    corrupted = tmp_path / "corrupted"
+    corrupted.write_bytes(kernel.read_bytes()[:-1] + b"\0")
+    args = fleet.parse_action_args(actions.boot, {"uimage": str(corrupted), "rootfs": str(rootfs), "ymodem": True})
+    with pytest.raises(RuntimeError, match="CRC32"):
+        actions.boot(client, config).run(args)
+
+    args = fleet.parse_action_args(actions.boot, {"uimage": str(kernel), "rootfs": str(rootfs), "ymodem": True})
+    actions.boot(client, config).run(args)
+    out = capsys.readouterr().out
+    assert "Starting kernel ..." in out
+    assert "Verifying Checksum" not in out  # image is already verified after uploading
+    assert "XIP Kernel Image ... OK" in out  # payload is uploaded right to the load address
+    assert "0x80007fc0 - " in out  # RAM map
+    client.s.close()
@@ -0,0 +1,203 @@
+from hiburn import utils
+from hiburn import tftp
+import contextlib
+import io
+import itertools
+import logging
+import os
+import socket
+import stat
+import time
+import zlib
+import pytest
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeUBoot:
+    """ Runs `tftp` commands with a real TFTP client against the host, RAM is a dict addr -> bytes
+    """
+    def __init__(self, port):
+        self.port = port
+        self.ram = {}
+
+    def tftp(self, addr, file_name, size=None):
+        client = tftp.TftpClient("127.0.0.1", self.port, dally=False)
+        if size is None:
+            out = io.BytesIO()
+            client.download(file_name, out)
+            self.ram[addr] = out.getvalue()
+        else:
+            client.upload(file_name, io.BytesIO(self.ram[addr][:size]))
+        return []
+
+    def crc32(self, addr, size):
+        return zlib.crc32(self.ram[addr][:size])
+
+
+# -------------------------------------------------------------------------------------------------
+def test_upload_download(tmp_path):
+    port = free_udp_port()
+    uboot = FakeUBoot(port)
+    image = os.urandom(100000)
+    path = tmp_path / "image.bin"
+    path.write_bytes(image)
+
+    utils.upload_files_via_tftp(uboot, (
+        (str(path), 0x80000000),
+        (memoryview(image)[1000:2000], 0x81000000),
+    ), listen_ip="127.0.0.1", listen_port=port, verify=True)
+    assert uboot.ram[0x80000000] == image
+    assert uboot.ram[0x81000000] == image[1000:2000]
+
+    dump = tmp_path / "dump.bin"
+    utils.download_files_via_tftp(uboot, (
+        (str(dump), 0x80000000, 50000),
+    ), listen_ip="127.0.0.1", listen_port=port)
+    assert dump.read_bytes() == image[:50000]
+    assert sorted(os.listdir(tmp_path)) == ["dump.bin", "image.bin"]
+
+
+# -------------------------------------------------------------------------------------------------
+def run_server(server):
+    import threading
+    server.bind("127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    return server.sock.getsockname()[1], thread
+
+
+def transfer_both_ways(data, options, timeout=tftp.TIMEOUT, **server_kwargs):
+    uploaded = io.BytesIO()
+    uploaded.close = lambda: None  # server closes objects when transfers are over
+    server = tftp.TftpServer(
+        open_read=lambda name, addr: utils.BufferReader(data) if name == "data" else None,
+        open_write=lambda name, addr: uploaded,
+        timeout=timeout, **server_kwargs)
+    port, thread = run_server(server)
+    try:
+        client = tftp.TftpClient("127.0.0.1", port, options=options, timeout=timeout)
+        downloaded = io.BytesIO()
+        client.download("data", downloaded)
+        client.upload("up", io.BytesIO(data))
+    finally:
+        server.stop()
+        thread.join()
+    return downloaded.getvalue(), uploaded.getvalue()
+
+
+@pytest.mark.parametrize("size", [0, 1468 * 20, 100000])
+@pytest.mark.parametrize("options", [{}, {"blksize": 1468}, {"blksize": 1468, "windowsize": 8, "tsize": 0}])
+def test_options(size, options):
+    data = os.urandom(size)
+    assert transfer_both_ways(data, options, timeout=0.05) == (data, data)
+
+
+def test_negotiation():
+    assert tftp.TftpServer(None, None, max_block_size=1024, max_window_size=4).negotiate(
+        tftp.RRQ, {"blksize": "8192", "windowsize": "16"}, None) == {"blksize": "1024", "windowsize": "4"}
+    assert tftp.TftpServer(None, None).negotiate(
+        tftp.RRQ, {"blksize": "1", "windowsize": "0", "tsize": "0"}, io.BytesIO(b"abc")) == \
+        {"blksize": "8", "windowsize": "1", "tsize": "3"}
+
+
+@pytest.mark.parametrize("window", [1, 8])
+def test_lost_packets(monkeypatch, window):
+    recv = tftp.Transfer.recv
+    counter = itertools.count()
+
+    def lossy_recv(self):
+        while True:
+            resp = recv(self)
+            if resp is None or next(counter) % 23 != 7:
+                return resp
+
+    monkeypatch.setattr(tftp.Transfer, "recv", lossy_recv)
+    data = os.urandom(512 * 100 + 1)
+    assert transfer_both_ways(data, {"blksize": 512, "windowsize": window}, timeout=0.1) == (data, data)
+
+
+# -------------------------------------------------------------------------------------------------
+@contextlib.contextmanager
+def running_service(tmp_path, monkeypatch):
+    """ Yields TftpService running in a thread and registered in the environment, and its port
+    """
+    import threading
+    from hiburn import tftp_service
+
+    control = str(tmp_path / "control.sock")
+    monkeypatch.setenv(tftp_service.CONTROL_PATH_ENV, control)
+    port = free_udp_port()
+    service = tftp_service.TftpService("127.0.0.1", port)
+    thread = threading.Thread(target=service.run)
+    thread.start()
+    try:
+        while not os.path.exists(control):
+            time.sleep(0.001)
+        yield service, port
+    finally:
+        service.stop()
+        thread.join()
+    assert not os.path.exists(control)
+
+
+def test_service(tmp_path, monkeypatch):
+    from hiburn import tftp_service
+
+    with running_service(tmp_path, monkeypatch) as (service, port):
+        assert stat.S_IMODE(os.stat(service.control_path).st_mode) == 0o600
+        uboot = FakeUBoot(port)
+        image = os.urandom(100000)
+        path = tmp_path / "image.bin"
+        path.write_bytes(image)
+
+        # listen address is the service's one, it needs no privileged port in actions
+        utils.upload_files_via_tftp(uboot, (
+            (str(path), 0x80000000),
+            (memoryview(image)[1000:2000], 0x81000000),
+        ), listen_ip="0.0.0.0", listen_port=1, verify=True)
+        assert uboot.ram[0x80000000] == image
+        assert uboot.ram[0x81000000] == image[1000:2000]
+
+        dump = tmp_path / "dump.bin"
+        utils.download_files_via_tftp(uboot, ((str(dump), 0x80000000, 50000),), listen_ip="0.0.0.0", listen_port=1)
+        assert dump.read_bytes() == image[:50000]
+
+        with tftp_service.connect() as client:
+            name = client.serve(b"abc")
+            with pytest.raises(RuntimeError):
+                client.serve(b"def", name=name)
+        for _ in range(100):  # registrations are dropped with the connection
+            if not service._sources and not service._receivers:
+                break
+            time.sleep(0.01)
+        assert not service._sources and not service._receivers
+
+
+def test_service_download_is_complete_on_return(tmp_path, monkeypatch):
+    data = os.urandom(100125)  # ends with a short block
+    dump = tmp_path / "dump.bin"
+    with running_service(tmp_path, monkeypatch) as (service, port):
+        uboot = FakeUBoot(port)
+        uboot.ram[0x80000000] = data
+        for _ in range(10):
+            utils.download_files_via_tftp(uboot, ((str(dump), 0x80000000, len(data)),),
+                listen_ip="0.0.0.0", listen_port=1)
+            assert dump.read_bytes() == data
+
+
+def test_service_control_path(monkeypatch):
+    from hiburn import tftp_service
+
+    monkeypatch.delenv(tftp_service.CONTROL_PATH_ENV, raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert tftp_service.control_socket_path() == "/run/user/1000/hiburn-tftp.sock"
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert tftp_service.control_socket_path().endswith("hiburn-tftp-{}.sock".format(os.getuid()))
@@ -0,0 +1,75 @@
+from hiburn import actions
+from hiburn import timings
+from hiburn import utils
+from hiburn.u_boot_client import UBootClient
+from test_u_boot_client import FakeConsole
+import json
+import zlib
+
+
+# -------------------------------------------------------------------------------------------------
+def test_nested_spans(tmp_path):
+    tracer = timings.Tracer()
+    with tracer.span("boot", "action"):
+        with tracer.span("tftp upload", "transfer", size=1000):
+            tracer.begin("tftp", "command")  # isn't closed explicitly
+        with tracer.span("bootm"):
+            pass
+
+    boot, upload, command, bootm = tracer.spans
+    assert [s.depth for s in tracer.spans] == [0, 1, 2, 1]
+    assert command.duration is not None and command.duration <= upload.duration
+    assert upload.rate == 1000 / upload.duration
+    assert bootm.start >= upload.start + upload.duration
+
+    path = tmp_path / "timings.json"
+    tracer.save_json(str(path))
+    report = json.loads(path.read_text())
+    assert [s["name"] for s in report["spans"]] == ["boot", "tftp upload", "tftp", "bootm"]
+    assert report["spans"][1]["size"] == 1000
+    assert report["total"] >= boot.duration
+
+
+def test_client_command_spans():
+    client = UBootClient(FakeConsole())
+    client.tracer = timings.Tracer()
+
+    with timings.span(client.tracer, "configure network"):
+        client.setenv(ipaddr="192.168.10.101", serverip="192.168.10.2")
+        client.printenv()
+    client.bootm(0x82000000, wait=False)  # the span lasts till the end
+
+    names = [(s.name, s.kind, s.depth) for s in client.tracer.spans]
+    assert names == [("configure network", "phase", 0), ("setenv", "command", 1), ("printenv", "command", 1),
+        ("bootm", "command", 0)]
+    assert client.tracer.spans[1].detail.count("setenv") == 2  # batched into a single line
+
+    table = timings.format_table(client.tracer)
+    assert "configure network" in table
+    assert "setenv" in table.split("U-Boot command")[1]
+    assert client.tracer.spans[-1].duration is not None
+
+
+def test_no_tracer():
+    with timings.span(None, "anything") as s:
+        assert s is None
+
+
+def test_upload_span_counts_sent_data(monkeypatch):
+    present, missing = b"a" * 1000, b"b" * 300
+
+    class Client:
+        tracer = timings.Tracer()
+
+        def crc32(self, addr, size):
+            return zlib.crc32(present) if addr == 0x80000000 else 0
+
+    sent = []
+    monkeypatch.setattr(utils, "upload_files_via_tftp", lambda client, files, **kwargs: sent.extend(files))
+    action = actions.Action(Client(), {"net": {"host_ip_mask": "127.0.0.1/8"}})
+    action.upload_files((present, 0x80000000), (missing, 0x81000000), skip_present=True)
+    assert sent == [(missing, 0x81000000)]
+    assert [(s.name, s.size) for s in Client.tracer.spans] == [("tftp upload", len(missing))]
+
+    with actions.Action(None, {}).span("no client") as s:  # actions which don't need a device
+        assert s is None
@@ -0,0 +1,88 @@
+from hiburn import transport
+import serial
+import serial.rfc2217
+import socket
+import threading
+import time
+
+
+# -------------------------------------------------------------------------------------------------
+class Connection:
+    def __init__(self, sock):
+        self.write = sock.sendall
+
+
+class Rfc2217Server:
+    """ RFC 2217 port server in front of pyserial's loopback port, like examples/rfc2217_server.py
+    """
+    def __init__(self):
+        self.port = serial.serial_for_url("loop://", timeout=0.05)
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.address = self.sock.getsockname()
+        self.stop = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        conn, _ = self.sock.accept()
+        conn.settimeout(0.05)
+        manager = serial.rfc2217.PortManager(self.port, Connection(conn))
+
+        def port_to_socket():
+            while not self.stop.is_set():
+                data = self.port.read(self.port.in_waiting or 1)
+                if data:
+                    conn.sendall(b"".join(manager.escape(data)))
+
+        threading.Thread(target=port_to_socket, daemon=True).start()
+        while not self.stop.is_set():
+            try:
+                data = conn.recv(1024)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            self.port.write(b"".join(manager.filter(data)))
+        self.stop.set()
+        conn.close()
+
+
+def test_rfc2217_url():
+    server = Rfc2217Server()
+    conn = transport.open_url("rfc2217://{}:{}?baudrate=230400".format(*server.address))
+    try:
+        assert server.port.baudrate == 230400
+        conn.timeout = 1
+        conn.write(b"hisilicon # \xff\r\n")
+        assert conn.readline() == b"hisilicon # \xff\r\n"
+
+        conn.baudrate = 921600  # loady switches line's speed this way
+        deadline = time.monotonic() + 2
+        while server.port.baudrate != 921600 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert server.port.baudrate == 921600
+    finally:
+        server.stop.set()
+        conn.close()
+
+
+def test_tcp_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(1)
+        conn = transport.open_url("tcp://127.0.0.1:{}".format(sock.getsockname()[1]))
+        peer, _ = sock.accept()
+        with peer:
+            assert isinstance(conn, transport.Transport) and not hasattr(conn, "baudrate")
+            conn.write(b"printenv\n")
+            conn.timeout = 0.1
+            assert conn.read(1) == b""  # written data is flushed before reading
+            assert peer.recv(100) == b"printenv\n"
+
+            peer.sendall(b"bootdelay=1\r\nhisilicon # ")
+            time.sleep(0.05)
+            assert conn.in_waiting == 25
+            assert conn.readline() == b"bootdelay=1\r\n"
+            assert conn.readline() == b"hisilicon # "
+        conn.close()
@@ -0,0 +1,80 @@
+from hiburn.u_boot_client import UBootClient, COMMAND_LINE_LIMIT
+import re
+
+
+# -------------------------------------------------------------------------------------------------
+class FakeConsole:
+    """ U-Boot console emulation good enough for `setenv`, `echo` and `printenv`
+    Lines are split by unescaped `;` and executed one by one like U-Boot's hush parser does
+    """
+    def __init__(self):
+        self.timeout = None
+        self.env = {}
+        self.lines = []
+        self.output = b""
+
+    def write(self, data):
+        line = data.decode().rstrip("\n")
+        assert len(line) <= COMMAND_LINE_LIMIT
+        self.lines.append(line)
+        out = [line]
+        for cmd in re.split(r"(?<!\\);", line):
+            name, *args = cmd.split()
+            if name == "setenv":
+                self.env[args[0]] = " ".join(args[1:]).replace("\\;", ";")
+            elif name == "echo":
+                out.append(" ".join(args))
+            elif name == "printenv":
+                out += ["{}={}".format(k, v) for k, v in self.env.items()]
+            elif name == "bootm":
+                out.append("## Booting kernel from Legacy Image at {} ...".format(args[0]))
+                return self._emit(out)
+        out.append("hisilicon # ")
+        self._emit(out)
+
+    def _emit(self, lines):
+        self.output += "\r\n".join(lines).encode() + (b"" if lines[-1].endswith("# ") else b"\r\n")
+
+    def readline(self):
+        end = self.output.find(b"\n") + 1 or len(self.output)
+        line, self.output = self.output[:end], self.output[end:]
+        return line
+
+
+# -------------------------------------------------------------------------------------------------
+def test_setenv_single_round_trip():
+    console = FakeConsole()
+    client = UBootClient(console)
+
+    client.setenv(ipaddr="192.168.10.101", serverip="192.168.10.2", bootcmd="run a; run b")
+
+    assert len(console.lines) == 1
+    assert console.env == {"ipaddr": "192.168.10.101", "serverip": "192.168.10.2", "bootcmd": "run a; run b"}
+
+
+def test_batch_line_limit_and_responses():
+    console = FakeConsole()
+    client = UBootClient(console)
+
+    values = {"var{}".format(i): "x" * 40 for i in range(20)}
+    with client.batch() as batch:
+        client.setenv(**values)
+        batch.add("printenv")
+
+    assert len(console.lines) > 1
+    assert console.env == values
+    assert len(batch.responses) == len(values) + 1
+    assert all(resp == [] for resp in batch.responses[:-1])
+    assert batch.responses[-1] == ["{}={}".format(k, v) for k, v in values.items()]
+
+
+def test_bootm_tail():
+    console = FakeConsole()
+    client = UBootClient(console)
+
+    with client.batch():
+        client.setenv(bootargs="mem=64M console=ttyAMA0,115200")
+        client.bootm(0x82000000, wait=False)
+
+    assert console.lines == ["setenv bootargs mem=64M console=ttyAMA0,115200; echo --hiburn-0--; bootm 0x82000000"]
+    assert console.output.startswith(b"--hiburn-0--\r\n## Booting kernel")
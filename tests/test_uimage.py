@@ -0,0 +1,114 @@
+from hiburn import uimage
+import hashlib
+import os
+import struct
+import zlib
+import pytest
+
+
+def make_legacy(data, load=0x80008000, comp=1):
+    header = uimage.LEGACY_HEADER.pack(uimage.LEGACY_MAGIC, 0, 0, len(data), load, load + 0x40, zlib.crc32(data),
+        5, 2, 2, comp, b"Linux-4.9.37")
+    return header[:4] + struct.pack(">I", zlib.crc32(header)) + header[8:] + data
+
+
+class FdtWriter:
+    """ Minimal flattened device tree builder: nodes are dicts, props are bytes/str/int values
+    """
+    def __init__(self):
+        self.struct = b""
+        self.strings = b""
+
+    def _string(self, name):
+        name = name.encode() + b"\0"
+        if name not in self.strings:
+            self.strings += name
+        return self.strings.index(name)
+
+    def _node(self, name, node):
+        self.struct += struct.pack(">I", uimage.FDT_BEGIN_NODE) + self._pad(name.encode() + b"\0")
+        for key, value in node.items():
+            if isinstance(value, dict):
+                self._node(key, value)
+                continue
+            if isinstance(value, str):
+                value = value.encode() + b"\0"
+            elif isinstance(value, int):
+                value = struct.pack(">I", value)
+            self.struct += struct.pack(">III", uimage.FDT_PROP, len(value), self._string(key)) + self._pad(value)
+        self.struct += struct.pack(">I", uimage.FDT_END_NODE)
+
+    @staticmethod
+    def _pad(data):
+        return data + bytes(-len(data) % 4)
+
+    def build(self, root):
+        self._node("", root)
+        self.struct += struct.pack(">I", uimage.FDT_END)
+        struct_offset = uimage.FDT_HEADER.size + 16  # empty memory reservation map
+        strings_offset = struct_offset + len(self.struct)
+        total_size = strings_offset + len(self.strings)
+        header = uimage.FDT_HEADER.pack(uimage.FDT_MAGIC, total_size, struct_offset, strings_offset,
+            uimage.FDT_HEADER.size, 17, 16, 0, len(self.strings), len(self.struct))
+        return header + bytes(16) + self.struct + self.strings
+
+
+def make_fit(kernel, fdt, external=False):
+    kernel_node = {"description": "Linux", "type": "kernel", "arch": "arm", "os": "linux", "compression": "gzip",
+        "load": 0x80008000, "entry": 0x80008000,
+        "hash-1": {"algo": "crc32", "value": zlib.crc32(kernel)},
+        "hash-2": {"algo": "sha1", "value": hashlib.sha1(kernel).digest()}}
+    fdt_node = {"type": "flat_dt", "hash-1": {"algo": "sha256", "value": hashlib.sha256(fdt).digest()}}
+    if external:
+        kernel_node.update({"data-offset": 0, "data-size": len(kernel)})
+        fdt_node.update({"data-offset": len(kernel) + 3 & ~3, "data-size": len(fdt)})
+    else:
+        kernel_node["data"], fdt_node["data"] = kernel, fdt
+    tree = FdtWriter().build({
+        "description": "FIT",
+        "images": {"fdt-1": fdt_node, "kernel-1": kernel_node},
+        "configurations": {"default": "conf-1", "conf-1": {"kernel": "kernel-1", "fdt": "fdt-1"}},
+    })
+    if not external:
+        return tree
+    tree += bytes(-len(tree) % 4)
+    return tree + kernel + bytes(-len(kernel) % 4) + fdt
+
+
+# -------------------------------------------------------------------------------------------------
+def test_legacy(tmp_path):
+    data = os.urandom(10000)
+    path = tmp_path / "uImage"
+    path.write_bytes(make_legacy(data))
+    image = uimage.inspect(str(path))
+    k = image.kernel
+    assert (image.format, k.name, k.type, k.os, k.arch, k.compression) == \
+        ("legacy", "Linux-4.9.37", "kernel", "linux", "arm", "gzip")
+    assert (k.load, k.entry, k.data_offset, k.data_size) == (0x80008000, 0x80008040, 64, 10000)
+
+    corrupted = bytearray(make_legacy(data))
+    corrupted[100] ^= 1
+    with pytest.raises(RuntimeError, match="data CRC32"):
+        uimage.inspect(corrupted)
+    corrupted[20] ^= 1
+    with pytest.raises(RuntimeError, match="header CRC32"):
+        uimage.inspect(corrupted)
+    with pytest.raises(RuntimeError, match="truncated"):
+        uimage.inspect(make_legacy(data)[:5000])
+    with pytest.raises(RuntimeError, match="neither"):
+        uimage.inspect(data)
+
+
+@pytest.mark.parametrize("external", (False, True))
+def test_fit(external):
+    kernel, fdt = os.urandom(5001), os.urandom(999)
+    image = uimage.inspect(make_fit(kernel, fdt, external=external))
+    assert image.format == "FIT"
+    assert [i.name for i in image.images] == ["fdt-1", "kernel-1"]
+    assert (image.kernel.name, image.kernel.compression, image.kernel.load) == ("kernel-1", "gzip", 0x80008000)
+    assert image.kernel.data_size == len(kernel)
+
+    corrupted = bytearray(make_fit(kernel, fdt, external=external))
+    corrupted[image.kernel.data_offset + 10] ^= 1
+    with pytest.raises(RuntimeError, match="'kernel-1' crc32 mismatch"):
+        uimage.inspect(corrupted)
@@ -0,0 +1,42 @@
+from hiburn import utils
+import io
+import pytest
+
+
+# -------------------------------------------------------------------------------------------------
+def test_open_buffer(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"0123456789")
+    empty = tmp_path / "empty.bin"
+    empty.write_bytes(b"")
+
+    for src in (b"0123456789", bytearray(b"0123456789"), str(path), io.BytesIO(b"0123456789")):
+        with utils.open_buffer(src) as view:
+            assert bytes(view[2:5]) == b"234" and len(view) == 10
+
+    with utils.open_buffer(str(empty)) as view:
+        assert len(view) == 0
+
+
+# -------------------------------------------------------------------------------------------------
+def test_find_free_region():
+    K = 1 << 10
+    busy = [(0x8000 * K, 64 * K), (0x8000 * K + 64 * K, 64 * K)]
+    start, end = 0x8000 * K - 256 * K, 0x8000 * K + 128 * K
+
+    assert utils.find_free_region(100 * K, busy, start, end, 64 * K) == 0x8000 * K - 128 * K
+    assert utils.find_free_region(100 * K, [], start, end, 64 * K) == end - 128 * K
+    with pytest.raises(RuntimeError):
+        utils.find_free_region(300 * K, busy, start, end, 64 * K)
+
+
+# -------------------------------------------------------------------------------------------------
+def test_tftp_receiver_at_offset():
+    dst = io.BytesIO(b"head|tail")
+    dst.seek(5)
+    receiver = utils.TftpReceiver("rx", dst).open()
+    receiver.write(b"XX")
+    receiver.open()  # restarted transfer goes to the same place
+    receiver.write(b"TA")
+    receiver.close()
+    assert dst.getvalue() == b"head|TAil" and receiver.size == 2
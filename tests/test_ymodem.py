@@ -1,5 +1,9 @@
 from hiburn.ymodem import YModem
+import io
+import os
+import time
 import logging
+import pytest
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -11,7 +15,7 @@ class FakeSerial:
         self.outgoing = outgoing
 
     def write(self, data):
-        self.incoming.append(data)
+        self.incoming.append(bytes(data))
     
     def read(self, size):
         s = min(len(self.outgoing), size)
@@ -22,8 +26,8 @@ class FakeSerial:
 
 # -------------------------------------------------------------------------------------------------
 def test_basic():
-    #                               C              NAK       ACK
-    serial = FakeSerial(outgoing=(b"\x43" * 10 + b"\x15" + b"\x06" * 3))
+    #                               NAK       ACK
+    serial = FakeSerial(outgoing=(b"\x15" + b"\x06" * 3))
 
     ym = YModem(serial)
     ym.transmit(b"hello serial", file_path="/my/data/path")
@@ -33,3 +37,91 @@ def test_basic():
     assert serial.incoming[1] == (b"\x01\x01\xfehello serial" + b"\x00" * 116 + b"\xb4")
     assert serial.incoming[2] == (b"\x04")
 
+
+def test_eot_is_not_acknowledged():
+    serial = FakeSerial(outgoing=b"\x15" * 10)  # receiver is lost, e.g. at another baudrate
+    with pytest.raises(RuntimeError, match="EOT"):
+        YModem(serial, max_retries=3).send_eot()
+    assert serial.incoming == [b"\x04"] * 3
+
+
+# -------------------------------------------------------------------------------------------------
+def test_file_crc16_long(tmp_path):
+    data = bytes(range(256)) * 5  # 1280 bytes -> 2 long frames
+    path = tmp_path / "image.bin"
+    path.write_bytes(data)
+
+    with open(path, "rb") as f:
+        for src in (str(path), io.BytesIO(data), f):
+            #                               C         ACK
+            serial = FakeSerial(outgoing=(b"\x43" + b"\x06" * 4))
+            YModem(serial).transmit(src, long=True)
+
+            assert len(serial.outgoing) == 0
+            assert len(serial.incoming) == 4
+            frame = serial.incoming[2]
+            assert frame[:3] == b"\x02\x02\xfd"
+            assert frame[3:-2] == data[1024:] + b"\x00" * 768
+            assert frame[-2:] == YModem.crc16(frame[3:-2])
+            assert serial.incoming[1][3:-2] == data[:1024]
+
+
+# -------------------------------------------------------------------------------------------------
+class FakeReceiver:
+    """ CRC-mode YMODEM receiver, every answer costs `latency` seconds (like a round trip of a real link)
+    """
+    def __init__(self, handshake, latency):
+        self.handshake = handshake
+        self.latency = latency
+        self.pending = bytearray(handshake)
+        self.buff = bytearray()
+        self.blocks = []
+        self.eot = False
+        self.reads = []  # amount of received blocks at every read
+
+    def write(self, data):
+        self.buff += data
+        while self.buff:
+            if self.buff[0] == 0x04:
+                del self.buff[:1]
+                self.eot = True
+                self.pending += b"\x06"
+                continue
+            size = 3 + (1024 if self.buff[0] == 0x02 else 128) + 2
+            if len(self.buff) < size:
+                break
+            frame = bytes(self.buff[:size])
+            del self.buff[:size]
+            assert frame[1] == len(self.blocks) & 0xFF
+            assert frame[-2:] == YModem.crc16(frame[3:-2])
+            self.blocks.append(frame[3:-2])
+            if self.handshake != b"G":
+                self.pending += b"\x06"
+            elif len(self.blocks) == 1:
+                self.pending += b"G"
+
+    def read(self, size):
+        self.reads.append(len(self.blocks))
+        time.sleep(self.latency)
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    @property
+    def data(self):
+        size = int(self.blocks[0].split(b"\0")[1])
+        return b"".join(self.blocks[1:])[:size]
+
+
+def test_streaming_ymodem_g():
+    data = os.urandom(64 * 1024 + 100)
+
+    ack_receiver = FakeReceiver(b"C", latency=0.001)
+    YModem(ack_receiver).transmit(data, long=True, streaming=True)  # falls back to YMODEM
+    assert ack_receiver.eot and ack_receiver.data == data
+    assert set(range(1, len(ack_receiver.blocks) + 1)) <= set(ack_receiver.reads)  # every block waits for ACK
+
+    g_receiver = FakeReceiver(b"G", latency=0.001)
+    YModem(g_receiver).transmit(data, long=True, streaming=True)
+    assert g_receiver.eot and g_receiver.data == data
+    assert not any(1 < n < len(g_receiver.blocks) for n in g_receiver.reads)  # data blocks don't wait for ACK